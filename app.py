@@ -5,9 +5,20 @@ No contiene lógica de negocio, solo presentación.
 """
 import streamlit as st
 import json
+import os
+import threading
 from modules.repository import TuvaRepository
 from modules.tokenization import TokenizadorCoMET
 from modules.engine import CometEngine
+from modules.cache import CacheEmbeddings, CachePredicciones
+from modules.snapshot import SnapshotIndice
+from modules.indexacion import sincronizar_indice
+from modules.indice import IndiceExacto
+from modules.particiones import IndiceParticionado, leer_manifiesto
+from modules.metricas import registro, servir_prometheus
+
+TOP_K = 3
+CARPETA_INDICE = "indice_comet"
 
 # --- Configuración de la Página ---
 st.set_page_config(page_title="CoMET-Col Modular", layout="wide", page_icon="🧬")
@@ -17,15 +28,78 @@ st.set_page_config(page_title="CoMET-Col Modular", layout="wide", page_icon="
 def cargar_sistema():
     repo = TuvaRepository()
     tokenizador = TokenizadorCoMET()
-    engine = CometEngine()
+    engine = CometEngine(cache_embeddings=CacheEmbeddings(), cache_predicciones=CachePredicciones())
+    # Una sola vez por proceso: el recurso cacheado sobrevive a los reruns de Streamlit
+    if os.environ.get("COMET_METRICAS_PUERTO"):
+        servir_prometheus(int(os.environ["COMET_METRICAS_PUERTO"]))
     return repo, tokenizador, engine
 
+@st.cache_resource
+def cargar_indice(modelo_embeddings, version_ontologia, carpeta=CARPETA_INDICE,
+                  carpeta_particiones="indice_comet_particiones"):
+    """
+    Snapshot pre-calculado con construir_indice.py, su índice top-k y su índice léxico.
+    Si existen particiones del mismo snapshot (construir_indice.py --particiones N),
+    la búsqueda vectorial se reparte entre procesos worker.
+    COMET_CUANTIZACION=int8|pq guarda en RAM sólo códigos compactos.
+    El estado es compartido entre sesiones y se actualiza en sitio (ver sincronizar_indice).
+    """
+    estado = {"snapshot": None, "indice": None, "lexico": None, "lock": threading.Lock()}
+    cuantizacion = os.environ.get("COMET_CUANTIZACION") or None
+    snapshot = SnapshotIndice.cargar(carpeta)
+    # Un snapshot de otro modelo u ontología produciría similitudes inválidas
+    if snapshot is None or not snapshot.es_compatible(modelo_embeddings, version_ontologia):
+        return estado
+    manifiesto = leer_manifiesto(carpeta_particiones)
+    if manifiesto is not None and manifiesto["creado"] == snapshot.creado:
+        indice = IndiceParticionado(carpeta_particiones, cuantizacion=cuantizacion)
+    else:
+        indice = snapshot.construir_indice(cuantizacion=cuantizacion)
+    estado.update(snapshot=snapshot, indice=indice, lexico=snapshot.construir_indice_lexico())
+    return estado
+
+def mostrar_metricas(panel):
+    """Resumen de modules.metricas: p50/p95 por etapa, tokens del LLM y descargas."""
+    resumen = registro.resumen()
+    with panel:
+        if not resumen['etapas']:
+            st.caption("Sin mediciones todavía.")
+            return
+        st.dataframe(
+            [{"etapa": etapa, **datos} for etapa, datos in sorted(resumen['etapas'].items())],
+            hide_index=True, column_order=("etapa", "conteo", "p50_ms", "p95_ms", "errores"),
+        )
+        llm = resumen['llm']
+        if llm['tokens_prompt'] or llm['tokens_generados']:
+            velocidad = f" · {llm['tokens_por_segundo']} tokens/s" if llm['tokens_por_segundo'] else ""
+            st.caption(f"LLM: {llm['tokens_prompt']} tokens prompt / {llm['tokens_generados']} generados{velocidad}")
+        st.download_button("Métricas (Prometheus)", registro.exportar_prometheus(), file_name="comet_metricas.txt")
+        st.download_button("Trazas (JSON)", json.dumps(registro.trazas(), ensure_ascii=False, indent=2),
+                           file_name="comet_trazas.json")
+
 try:
     repo, tokenizador, engine = cargar_sistema()
+    estado_indice = cargar_indice(engine.modelo_embeddings, tokenizador.maestro.version)
+    engine.indice, engine.indice_lexico = estado_indice["indice"], estado_indice["lexico"]
+    # Re-indexación incremental publicada mientras la app corre: sólo se aplica su delta
+    recargar = False
+    with estado_indice["lock"]:
+        if estado_indice["snapshot"] is not None:
+            vigente = sincronizar_indice(estado_indice["snapshot"], engine.indice, CARPETA_INDICE,
+                                         engine.indice_lexico)
+            recargar = vigente is None
+            if not recargar:
+                estado_indice["snapshot"] = vigente
+    snapshot = estado_indice["snapshot"]
 except Exception as e:
     st.error(f"Error crítico cargando módulos: {e}")
     st.stop()
 
+if recargar:
+    # Reconstrucción completa (u otro modelo/ontología): se recarga el índice entero
+    cargar_indice.clear()
+    st.rerun()
+
 # --- Interfaz de Usuario ---
 st.title("🧬 CoMET-Col: Arquitectura Modular")
 st.markdown("**Sistema de Auditoría Predictiva basado en Agentes.**")
@@ -44,7 +118,33 @@ with st.sidebar:
         st.info(f"Histórico: {len(hist_data)} pacientes")
         st.caption(f"Fuente: {path_h}")
 
+    if snapshot is not None:
+        st.success(f"Índice pre-calculado: {len(snapshot)} pacientes ({snapshot.creado})")
+    else:
+        st.warning("Sin índice pre-calculado: se vectoriza en vivo (python construir_indice.py)")
+
+    stats_cache = engine.cache_embeddings.estadisticas()
+    st.caption(
+        f"Cache embeddings: {stats_cache['entradas']} vectores · "
+        f"{stats_cache['hits']} hits / {stats_cache['misses']} misses"
+    )
+
+    stats_pred = engine.cache_predicciones.estadisticas()
+    st.caption(f"Cache agente: {stats_pred['entradas']} predicciones · {stats_pred['hits']} hits")
+
+    with st.expander("Endpoints Ollama"):
+        for tipo, nodos in engine.estado_endpoints().items():
+            for nodo in nodos:
+                estado = "🟢" if nodo['activo'] else "🔴"
+                latencia = f"{nodo['latencia_p50_ms']} ms" if nodo['latencia_p50_ms'] is not None else "—"
+                st.caption(f"{estado} {tipo} · {nodo['url']} · p50 {latencia} · "
+                           f"{nodo['peticiones']} peticiones / {nodo['errores']} errores")
+
     modo_ver = st.toggle("Ver Tokens Semánticos", value=True)
+    forzar_prediccion = st.checkbox("Ignorar cache del agente", value=False)
+
+    # Se llena al final del script para incluir el análisis de esta ejecución
+    panel_metricas = st.expander("⏱️ Latencia por etapa")
 
 # 2. Layout Principal
 col1, col2 = st.columns([1, 1])
@@ -60,22 +160,33 @@ with col1:
 if st.session_state.get('run_analysis'):
     with st.spinner("Tokenizando y Vectorizando..."):
         # A. Tokenización (Usando Tokenization Module)
-        secuencia_nuevo = tokenizador.construir_secuencia(new_data)
+        with registro.span("tokenizacion"):
+            secuencia_nuevo = tokenizador.construir_secuencia(new_data)
         
-        # B. Vectorización Histórica (Usando Engine Module)
-        # (Nota: En prod, esto estaría pre-calculado en ChromaDB, no en vivo)
-        vectores_hist = []
-        meta_hist = []
-        for pt in hist_data:
-            sec = tokenizador.construir_secuencia(pt)
-            vec = engine.generar_embedding(sec)
-            vectores_hist.append(vec)
-            meta_hist.append({"id": pt['id'], "secuencia": sec})
-            
-        # C. Embedding Nuevo y Búsqueda
-        vector_nuevo = engine.generar_embedding(secuencia_nuevo)
-        idx, score = engine.buscar_similitud(vector_nuevo, vectores_hist)
-        match_paciente = meta_hist[idx]
+        # B. Vectorización Histórica (Usando Snapshot o Engine Module)
+        if snapshot is not None:
+            indice_hist = engine.indice
+            secuencia_de = snapshot.secuencia_de
+        else:
+            indice_hist = IndiceExacto()
+            secuencias_hist = {}
+            for pt in hist_data:
+                with registro.span("tokenizacion"):
+                    sec = tokenizador.construir_secuencia(pt)
+                indice_hist.agregar([pt['id']], [engine.generar_embedding(sec)])
+                secuencias_hist[pt['id']] = sec
+            secuencia_de = secuencias_hist.get
+
+        # C. Búsqueda Top-K (híbrida: BM25 pre-filtra, embeddings re-puntúan)
+        similares, modo_busqueda = engine.buscar_hibrido(secuencia_nuevo, k=TOP_K, indice=indice_hist)
+        if not similares:
+            st.error("El histórico está vacío: no hay trayectorias para comparar.")
+            st.stop()
+        matches = [{"id": id_pt, "score": sc, "secuencia": secuencia_de(id_pt)} for id_pt, sc in similares]
+        match_paciente, score = matches[0], matches[0]["score"]
+        # Sin embeddings el ranking es BM25 normalizado al máximo: el primero siempre vale 1.0
+        # y no es comparable con el umbral de similitud coseno
+        modo_degradado = modo_busqueda == "lexico"
 
     # 4. Visualización de Resultados
     with col2:
@@ -87,20 +198,40 @@ if st.session_state.get('run_analysis'):
         
         st.subheader("🔍 Inferencia Vectorial")
         c1, c2 = st.columns(2)
-        c1.metric("Similitud", f"{score:.1%}")
-        c1.caption(f"Match Histórico: {match_paciente['id']}")
-        
-        if score > 0.8:
-            c2.error("⚠️ Patrón de Alto Riesgo")
+        if modo_degradado:
+            c1.metric("Similitud", "—")
+            c1.caption(f"Match Histórico: {match_paciente['id']} · búsqueda {modo_busqueda}")
+            c2.warning("Modo degradado: embeddings no disponibles, sólo ranking léxico (BM25). "
+                       "Sin evaluación de riesgo por similitud.")
         else:
-            c2.success("Patrón Estable")
+            c1.metric("Similitud", f"{score:.1%}")
+            c1.caption(f"Match Histórico: {match_paciente['id']} · búsqueda {modo_busqueda}")
+            
+            if score > 0.8:
+                c2.error("⚠️ Patrón de Alto Riesgo")
+            else:
+                c2.success("Patrón Estable")
+
+        if len(matches) > 1:
+            with st.expander(f"Top {len(matches)} trayectorias similares"):
+                for m in matches:
+                    detalle = "ranking léxico" if modo_degradado else f"similitud {m['score']:.1%}"
+                    st.caption(f"{m['id']} · {detalle}")
 
     # 5. Predicción Agéntica (Usando Engine Module)
     st.markdown("---")
     st.subheader("🔮 Predicción del Agente")
+
+    # Con Ollama caído también para el LLM no tiene sentido esperar el timeout de cada nodo
+    if modo_degradado and not any(nodo['activo'] for nodo in engine.estado_endpoints()['llm']):
+        st.warning("Agente no disponible: ningún endpoint LLM está en rotación.")
+        mostrar_metricas(panel_metricas)
+        st.stop()
     
     with st.spinner("Consultando Llama 3.1..."):
-        prediccion = engine.predecir_riesgo(secuencia_nuevo, match_paciente['secuencia'])
+        prediccion = engine.predecir_riesgo(
+            secuencia_nuevo, [m['secuencia'] for m in matches], usar_cache=not forzar_prediccion
+        )
         
         k1, k2, k3 = st.columns(3)
         riesgo = prediccion.get('riesgo', 'UNKNOWN')
@@ -113,4 +244,6 @@ if st.session_state.get('run_analysis'):
         k2.warning(f"Evento: {prediccion.get('evento_futuro')}")
         k3.metric("Tendencia", prediccion.get('costo_tendencia'))
         
-        st.markdown(f"**Análisis:** {prediccion.get('explicacion')}")
\ No newline at end of file
+        st.markdown(f"**Análisis:** {prediccion.get('explicacion')}")
+
+mostrar_metricas(panel_metricas)
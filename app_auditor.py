@@ -1,12 +1,15 @@
 import streamlit as st
 import json
 import pandas as pd
-from langchain_ollama import ChatOllama, OllamaEmbeddings
-from langchain_chroma import Chroma
-from langchain_core.documents import Document
+from langchain_ollama import ChatOllama
 from langchain_core.prompts import PromptTemplate
 from langchain_core.output_parsers import JsonOutputParser
 from pydantic import BaseModel, Field
+from modules.reglas import PrefiltroFragmentacion, ESCALAR
+from modules.temporal import IndiceTemporal, PACIENTE_UNICO
+from modules.metricas import registro
+
+MAX_EVENTOS_CONTEXTO = 20  # Eventos más recientes de la ventana que se pasan al agente
 
 # ---------------------------------------------------------
 # CONFIGURACIÓN DE LA PÁGINA
@@ -22,11 +25,19 @@ st.markdown("### Auditoría Inteligente sobre FEV-RIPS (HL7 FHIR / JSON)")
 @st.cache_resource
 def cargar_modelos():
     print(">>> Iniciando modelos Ollama...")
-    llm = ChatOllama(model="llama3.1", temperature=0, format="json")
-    embeddings = OllamaEmbeddings(model="nomic-embed-text")
-    return llm, embeddings
+    return ChatOllama(model="llama3.1", temperature=0, format="json")
+
+llm = cargar_modelos()
+
+@st.cache_resource
+def cargar_prefiltro():
+    # Compartido entre sesiones: acumula cuántos casos se resolvieron sin LLM
+    return PrefiltroFragmentacion()
 
-llm, embeddings = cargar_modelos()
+prefiltro = cargar_prefiltro()
+
+def describir_evento(evento):
+    return f"{evento['descripcion']} (CIE10: {evento['cod_diagnostico']}) - IPS: {evento['prestador']} - Fecha: {evento['fecha']}"
 
 # ---------------------------------------------------------
 # BARRA LATERAL: CARGA DE DATOS
@@ -44,6 +55,27 @@ except FileNotFoundError:
     st.sidebar.error("No se encontraron los archivos en /datos_rips")
     st.stop()
 
+@st.cache_data
+def construir_indice_temporal(eventos):
+    return IndiceTemporal.desde_eventos(eventos)
+
+indice_temporal = construir_indice_temporal(historial_data)
+id_paciente = nuevo_evento_data.get('id_paciente', PACIENTE_UNICO)
+
+st.sidebar.header("🗓️ Contexto Temporal")
+ventana_contexto = st.sidebar.number_input("Días de historia antes de la factura", min_value=1,
+                                           max_value=3650, value=90)
+
+st.sidebar.header("⚖️ Pre-filtro Determinístico")
+ventana_dias = st.sidebar.number_input("Ventana de complicación (días)", min_value=1, max_value=365,
+                                       value=prefiltro.ventana_dias)
+stats_prefiltro = prefiltro.estadisticas()
+if stats_prefiltro['total']:
+    st.sidebar.caption(
+        f"{stats_prefiltro['resueltos_por_reglas']}/{stats_prefiltro['total']} casos resueltos por reglas "
+        f"({stats_prefiltro['tasa_cortocircuito']:.0%}), {stats_prefiltro['escalados']} escalados al agente"
+    )
+
 # ---------------------------------------------------------
 # VISUALIZACIÓN DE LOS DATOS (Tu requerimiento visual)
 # ---------------------------------------------------------
@@ -66,70 +98,79 @@ with col2:
 st.divider()
 
 # ---------------------------------------------------------
-# LÓGICA AGÉNTICA (RAG + LLM)
+# LÓGICA AGÉNTICA (REGLAS + VENTANA TEMPORAL + LLM)
 # ---------------------------------------------------------
 
 if st.button("🔍 Ejecutar Análisis de Fragmentación (Agente IA)", type="primary"):
     
-    with st.spinner('Vectorizando historial y buscando relaciones semánticas...'):
-        # 1. Preparar Documentos para Vector Store
-        docs = []
-        for evento in historial_data:
-            content = f"{evento['descripcion']} (CIE10: {evento['cod_diagnostico']}) - IPS: {evento['prestador']} - Fecha: {evento['fecha']}"
-            meta = {"id": evento['id_evento'], "valor": evento['valor_neto'], "ips": evento['prestador']}
-            docs.append(Document(page_content=content, metadata=meta))
-        
-        # 2. Crear Vector Store temporal (Memoria)
-        vector_db = Chroma.from_documents(documents=docs, embedding=embeddings, collection_name="auditoria_temp")
-        
-        # 3. Búsqueda Semántica (Retrieval)
-        query = f"{nuevo_evento_data['cod_diagnostico']} {nuevo_evento_data['descripcion']}"
-        resultados = vector_db.similarity_search(query, k=2)
-        
-        contexto_encontrado = "\n".join([f"- {doc.page_content}" for doc in resultados])
-    
-    with st.spinner('El Agente Auditor está analizando el caso...'):
-        # 4. Definir Estructura de Salida
-        class AuditoriaResult(BaseModel):
-            es_fragmentacion: bool = Field(description="True si es atención fragmentada")
-            causa_raiz: str = Field(description="El evento histórico que originó este nuevo cobro")
-            explicacion: str = Field(description="Razonamiento clínico-administrativo")
-            ahorro_potencial: float = Field(description="Estimación de porcentaje de ahorro si hubiera sido integral")
-
-        parser = JsonOutputParser(pydantic_object=AuditoriaResult)
-
-        # 5. Prompt del Agente
-        prompt = PromptTemplate(
-            template="""
-            Analiza la siguiente situación de facturación médica en Colombia.
+    # 0. Ventana del paciente antes de la factura: búsqueda binaria, sin embeddings
+    eventos_ventana = indice_temporal.ventana(id_paciente, nuevo_evento_data['fecha'],
+                                              dias=max(ventana_contexto, ventana_dias))
+
+    # 1. Reglas: los casos evidentes no pasan por el LLM
+    with registro.span("reglas") as span:
+        respuesta = prefiltro.clasificar(nuevo_evento_data, eventos_ventana, ventana_dias=ventana_dias)
+        span.atributos["regla"] = respuesta['regla']
+
+    if respuesta['decision'] != ESCALAR:
+        origen_decision = f"Reglas ({respuesta['regla']})"
+        evidencia = [(describir_evento(e), e['valor_neto']) for e in respuesta['evidencia']]
+    else:
+        regla_escalada = respuesta['regla']
+        # 2. Contexto: eventos de la ventana de contexto, del más reciente al más antiguo
+        contexto_eventos = prefiltro.eventos_en_ventana(nuevo_evento_data, eventos_ventana,
+                                                        ventana_dias=ventana_contexto)[:MAX_EVENTOS_CONTEXTO]
+        contexto_encontrado = "\n".join([f"- {describir_evento(e)}" for e in contexto_eventos]) \
+            or f"- Sin atenciones en los {ventana_contexto} días anteriores"
+
+        with st.spinner('El Agente Auditor está analizando el caso...'):
+            # 3. Definir Estructura de Salida
+            class AuditoriaResult(BaseModel):
+                es_fragmentacion: bool = Field(description="True si es atención fragmentada")
+                causa_raiz: str = Field(description="El evento histórico que originó este nuevo cobro")
+                explicacion: str = Field(description="Razonamiento clínico-administrativo")
+                ahorro_potencial: float = Field(description="Estimación de porcentaje de ahorro si hubiera sido integral")
+
+            parser = JsonOutputParser(pydantic_object=AuditoriaResult)
+
+            # 4. Prompt del Agente
+            prompt = PromptTemplate(
+                template="""
+                Analiza la siguiente situación de facturación médica en Colombia.
             
-            HISTORIAL RELACIONADO ENCONTRADO (Base de Datos):
-            {contexto}
+                HISTORIAL RELACIONADO ENCONTRADO (Base de Datos):
+                {contexto}
             
-            NUEVA FACTURA (RIPS):
-            Fecha: {fecha_new}
-            IPS: {ips_new}
-            Procedimiento/Dx: {desc_new}
+                NUEVA FACTURA (RIPS):
+                Fecha: {fecha_new}
+                IPS: {ips_new}
+                Procedimiento/Dx: {desc_new}
             
-            Instrucciones:
-            1. Identifica si la nueva factura es una complicación derivada del historial.
-            2. Verifica si la IPS es diferente (Fragmentación de red).
-            3. Genera el reporte en JSON.
+                Instrucciones:
+                1. Identifica si la nueva factura es una complicación derivada del historial.
+                2. Verifica si la IPS es diferente (Fragmentación de red).
+                3. Genera el reporte en JSON.
             
-            {format_instructions}
-            """,
-            input_variables=["contexto", "fecha_new", "ips_new", "desc_new"],
-            partial_variables={"format_instructions": parser.get_format_instructions()}
-        )
-
-        chain = prompt | llm | parser
+                {format_instructions}
+                """,
+                input_variables=["contexto", "fecha_new", "ips_new", "desc_new"],
+                partial_variables={"format_instructions": parser.get_format_instructions()}
+            )
+
+            # El parser va aparte para conservar los tokens y tiempos que reporta Ollama
+            chain = prompt | llm
         
-        respuesta = chain.invoke({
-            "contexto": contexto_encontrado,
-            "fecha_new": nuevo_evento_data['fecha'],
-            "ips_new": nuevo_evento_data['prestador'],
-            "desc_new": nuevo_evento_data['descripcion']
-        })
+            with registro.span("inferencia_llm", modelo=llm.model) as span:
+                mensaje = chain.invoke({
+                    "contexto": contexto_encontrado,
+                    "fecha_new": nuevo_evento_data['fecha'],
+                    "ips_new": nuevo_evento_data['prestador'],
+                    "desc_new": nuevo_evento_data['descripcion']
+                })
+                registro.registrar_llm(mensaje.response_metadata, span)
+                respuesta = parser.parse(mensaje.content)
+        origen_decision = f"Agente IA (escalado por {regla_escalada})"
+        evidencia = [(describir_evento(e), e['valor_neto']) for e in contexto_eventos]
 
     # ---------------------------------------------------------
     # VISUALIZACIÓN DE RESULTADOS
@@ -146,16 +187,16 @@ if st.button("🔍 Ejecutar Análisis de Fragmentación (Agente IA)", type="prim
     c2.info(f"Causa Raíz Detectada: {respuesta['causa_raiz']}")
     
     # Calcular costo total involucrado (Histórico recuperado + Nuevo)
-    costo_previo = sum([doc.metadata['valor'] for doc in resultados])
+    costo_previo = sum([valor for _, valor in evidencia])
     costo_total_episodio = costo_previo + nuevo_evento_data['valor_neto']
     
     c3.metric("Costo Total del Episodio (Real)", f"${costo_total_episodio:,.0f}")
 
-    st.markdown(f"**Razonamiento del Agente:**")
+    st.markdown(f"**Razonamiento ({origen_decision}):**")
     st.write(respuesta['explicacion'])
 
     # Expander para ver la evidencia técnica
-    with st.expander("Ver Evidencia Técnica (Embeddings Recuperados)"):
+    with st.expander("Ver Evidencia Técnica (Eventos Recuperados)"):
         st.write("El sistema encontró estos eventos previos como causantes:")
-        for doc in resultados:
-            st.code(doc.page_content)
\ No newline at end of file
+        for contenido, _ in evidencia:
+            st.code(contenido)
\ No newline at end of file
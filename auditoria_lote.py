@@ -0,0 +1,209 @@
+"""
+GUÍA DE EJECUCIÓN (AUDITORÍA MASIVA SIN INTERFAZ):
+
+1. Construye el índice histórico (ver construir_indice.py).
+2. Asegúrate de tener Ollama corriendo (ollama serve) con nomic-embed-text y llama3.1.
+3. Ejecuta sobre una carpeta de RIPS (un paciente JSON por archivo, mismo
+   formato que nuevo_evento.json) o sobre un archivo NDJSON:
+   python auditoria_lote.py --entrada facturas_mes/ --salida resultados.jsonl
+   python auditoria_lote.py --entrada facturas_mes.ndjson --procesos 4 --hilos 16
+
+Cada línea de salida es un JSON con el match histórico, la predicción del
+agente y los tiempos por etapa (ms).
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from contextlib import ExitStack
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from modules.tokenization import TokenizadorCoMET
+from modules.engine import CometEngine
+from modules.cache import CacheEmbeddings, CachePredicciones
+from modules.snapshot import SnapshotIndice
+
+TOP_K = 3
+TAMANO_BLOQUE = 1000  # Casos que se tokenizan por ronda (memoria acotada)
+
+_tokenizador = None
+
+
+def _iniciar_worker(configuracion):
+    global _tokenizador
+    _tokenizador = TokenizadorCoMET.desde_configuracion(configuracion)
+
+
+def _tokenizar(caso):
+    """Se ejecuta en el pool de procesos (CPU-bound)."""
+    origen, paciente = caso
+    inicio = time.perf_counter()
+    try:
+        secuencia = _tokenizador.construir_secuencia(paciente)
+        error = None
+    except Exception as e:
+        secuencia, error = None, f"Tokenización: {e}"
+    return origen, paciente.get('id'), secuencia, error, (time.perf_counter() - inicio) * 1000
+
+
+def _validar(origen, leer):
+    """(origen, paciente, None) o (origen, None, error): un caso ilegible no detiene el lote."""
+    try:
+        paciente = leer()
+    except (OSError, ValueError) as e:  # ValueError incluye json.JSONDecodeError
+        return origen, None, f"Lectura: {e}"
+    if not isinstance(paciente, dict):
+        return origen, None, f"Lectura: se esperaba un objeto JSON, no {type(paciente).__name__}"
+    return origen, paciente, None
+
+
+def _leer_json(ruta):
+    with open(ruta, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def iterar_casos(entrada):
+    """(origen, paciente, error) desde una carpeta de .json o un archivo NDJSON."""
+    if os.path.isdir(entrada):
+        for nombre in sorted(os.listdir(entrada)):
+            if nombre.endswith(".json"):
+                ruta = os.path.join(entrada, nombre)
+                yield _validar(nombre, lambda: _leer_json(ruta))
+    else:
+        with open(entrada, 'r', encoding='utf-8') as f:
+            for n, linea in enumerate(f, start=1):
+                if linea.strip():
+                    yield _validar(f"{os.path.basename(entrada)}:{n}", lambda: json.loads(linea))
+
+
+def _bloques(iterable, tamano):
+    bloque = []
+    for item in iterable:
+        bloque.append(item)
+        if len(bloque) == tamano:
+            yield bloque
+            bloque = []
+    if bloque:
+        yield bloque
+
+
+def auditar(engine, snapshot, origen, id_caso, secuencia, ms_tokenizacion):
+    """Embedding → búsqueda top-k → predicción. Se ejecuta en el pool de hilos (I/O-bound)."""
+    tiempos = {"tokenizacion": round(ms_tokenizacion, 2)}
+    resultado = {"origen": origen, "id": id_caso, "tiempos_ms": tiempos}
+
+    t = time.perf_counter()
+    vector = engine.generar_embedding(secuencia)
+    tiempos["embedding"] = round((time.perf_counter() - t) * 1000, 2)
+
+    t = time.perf_counter()
+    similares = engine.buscar_similares(vector, k=TOP_K)
+    tiempos["busqueda"] = round((time.perf_counter() - t) * 1000, 2)
+    resultado["similares"] = [{"id": id_pt, "score": round(sc, 4)} for id_pt, sc in similares]
+
+    t = time.perf_counter()
+    if similares:
+        resultado["prediccion"] = engine.predecir_riesgo(
+            secuencia, [snapshot.secuencia_de(id_pt) for id_pt, _ in similares]
+        )
+    else:
+        resultado["prediccion"] = {"riesgo": "ERROR", "explicacion": "Índice histórico vacío"}
+    tiempos["prediccion"] = round((time.perf_counter() - t) * 1000, 2)
+    return resultado
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Auditoría CoMET-Col por lotes (sin Streamlit).")
+    parser.add_argument("--entrada", required=True, help="Carpeta de .json o archivo .ndjson de casos")
+    parser.add_argument("--salida", default="resultados_auditoria.jsonl", help="Archivo JSONL de resultados")
+    parser.add_argument("--indice", default="indice_comet", help="Snapshot de construir_indice.py")
+    parser.add_argument("--procesos", type=int, default=os.cpu_count(),
+                        help="Procesos para tokenizar (0 = en este proceso, sin pool)")
+    parser.add_argument("--hilos", type=int, default=8, help="Llamadas concurrentes a Ollama")
+    args = parser.parse_args(argv)
+    if args.procesos < 0:
+        parser.error("--procesos debe ser 0 (tokenizar en este proceso) o positivo")
+
+    engine = CometEngine(cache_embeddings=CacheEmbeddings(), cache_predicciones=CachePredicciones(),
+                         max_concurrencia=args.hilos)
+    tokenizador = TokenizadorCoMET()
+    snapshot = SnapshotIndice.cargar(args.indice)
+    if snapshot is None or not snapshot.es_compatible(engine.modelo_embeddings, tokenizador.maestro.version):
+        sys.exit(f"No hay un snapshot compatible en '{args.indice}': ejecuta construir_indice.py")
+    engine.indice = snapshot.construir_indice()
+
+    inicio, total, errores = time.perf_counter(), 0, 0
+    with ExitStack() as pila:
+        salida = pila.enter_context(open(args.salida, 'w', encoding='utf-8'))
+        hilos = pila.enter_context(ThreadPoolExecutor(args.hilos))
+        if args.procesos:
+            # spawn: el proceso padre ya tiene clientes httpx y conexiones SQLite vivos
+            procesos = pila.enter_context(ProcessPoolExecutor(
+                args.procesos, mp_context=multiprocessing.get_context("spawn"),
+                initializer=_iniciar_worker, initargs=(tokenizador.configuracion(),),
+            ))
+
+            def tokenizar(casos):
+                return procesos.map(_tokenizar, casos, chunksize=32)
+        else:
+            _iniciar_worker(tokenizador.configuracion())
+
+            def tokenizar(casos):
+                return map(_tokenizar, casos)
+
+        def escribir_error(origen, id_caso, error):
+            nonlocal total, errores
+            errores += 1
+            total += 1
+            salida.write(json.dumps({"origen": origen, "id": id_caso, "error": error}, ensure_ascii=False) + "\n")
+
+        def escribir(futuro):
+            nonlocal total, errores
+            try:
+                resultado = futuro.result()
+            except Exception as e:
+                resultado = {"origen": futuro.origen, "id": futuro.id_caso, "error": str(e)}
+            if "error" in resultado or resultado.get("prediccion", {}).get("riesgo") == "ERROR":
+                errores += 1
+            total += 1
+            salida.write(json.dumps(resultado, ensure_ascii=False) + "\n")
+
+        en_vuelo = set()
+        for bloque in _bloques(iterar_casos(args.entrada), TAMANO_BLOQUE):
+            legibles = []
+            for origen, paciente, error in bloque:
+                if error:
+                    escribir_error(origen, None, error)
+                else:
+                    legibles.append((origen, paciente))
+
+            for origen, id_caso, secuencia, error, ms in tokenizar(legibles):
+                if error:
+                    escribir_error(origen, id_caso, error)
+                    continue
+
+                # Contrapresión: no más de 2x hilos casos esperando a Ollama
+                if len(en_vuelo) >= 2 * args.hilos:
+                    listos, en_vuelo = wait(en_vuelo, return_when=FIRST_COMPLETED)
+                    for futuro in listos:
+                        escribir(futuro)
+
+                futuro = hilos.submit(auditar, engine, snapshot, origen, id_caso, secuencia, ms)
+                futuro.origen, futuro.id_caso = origen, id_caso
+                en_vuelo.add(futuro)
+
+            print(f"\r>>> {total} casos auditados ({errores} con error)", end="", file=sys.stderr)
+
+        for futuro in wait(en_vuelo).done:
+            escribir(futuro)
+
+    duracion = time.perf_counter() - inicio
+    print(file=sys.stderr)
+    print(f">>> {total} casos en {duracion:.1f}s ({total / duracion if duracion else 0:.1f} casos/s), "
+          f"{errores} con error → {args.salida}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+GUÍA DE EJECUCIÓN (BARRIDO NOCTURNO DE DUPLICADOS):
+
+1. Ejecuta sobre el histórico (JSON/NDJSON en streaming):
+   python barrido_duplicados.py --datos datos_rip --salida duplicados.jsonl
+2. Programa la ejecución nocturna (cron / Programador de tareas de Windows).
+
+Cada línea de salida es un par de pacientes con trayectorias casi idénticas
+(similitud Jaccard estimada sobre k-gramas de tokens clínicos) y las IPS que
+facturaron cada una; `ips_distintas` marca posible doble facturación.
+No requiere Ollama.
+"""
+import argparse
+import json
+import sys
+import time
+
+from modules.repository import TuvaRepository
+from modules.tokenization import TokenizadorCoMET
+from modules.minhash import GeneradorMinHash, IndiceLSH, ShinglesIds
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Detecta trayectorias casi duplicadas con MinHash/LSH.")
+    parser.add_argument("--datos", default="datos_rip", help="Carpeta con historial_paciente.json/.ndjson")
+    parser.add_argument("--salida", default="duplicados.jsonl", help="Archivo JSONL de pares")
+    parser.add_argument("--umbral", type=float, default=0.8, help="Similitud mínima reportada")
+    parser.add_argument("--permutaciones", type=int, default=128)
+    parser.add_argument("--bandas", type=int, default=32)
+    parser.add_argument("--k", type=int, default=2, help="Tokens por shingle")
+    args = parser.parse_args(argv)
+
+    repo = TuvaRepository(args.datos)
+    tokenizador = TokenizadorCoMET()
+    generador = GeneradorMinHash(args.permutaciones)
+    lsh = IndiceLSH(args.permutaciones, args.bandas)
+    # Trayectorias como ids enteros: k-gramas sin strings (ver VocabularioCoMET)
+    shingles = ShinglesIds(tokenizador.vocabulario, args.k)
+
+    inicio = time.perf_counter()
+    ips_de = {}
+    for pt in repo.iterar_historico():
+        lsh.agregar(pt['id'], generador.firma(shingles(tokenizador.construir_ids(pt))))
+        ips_de[pt['id']] = sorted({evt['cod_ips'] for evt in pt['eventos']})
+
+    pares = lsh.barrido(args.umbral)
+    with open(args.salida, 'w', encoding='utf-8') as f:
+        for a, b, sim in pares:
+            f.write(json.dumps({
+                "paciente_a": a, "paciente_b": b, "similitud": round(sim, 3),
+                "ips_a": ips_de[a], "ips_b": ips_de[b],
+                "ips_distintas": ips_de[a] != ips_de[b],
+            }, ensure_ascii=False) + "\n")
+
+    print(f">>> {len(lsh)} trayectorias, {len(pares)} pares >= {args.umbral} "
+          f"(umbral LSH ~{lsh.umbral:.2f}, {lsh.cubetas_omitidas} cubetas masivas omitidas) "
+          f"en {time.perf_counter() - inicio:.1f}s → {args.salida}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+"""
+GUÍA DE EJECUCIÓN (PRUEBA DE CARGA EXTREMO A EXTREMO):
+
+1. Desde la raíz del repositorio (no requiere Ollama ni GPU):
+   python -m benchmarks.carga --concurrencia 16 --casos 500
+   python -m benchmarks.carga --servidores 3 --latencia-chat 1.2 --tasa-error 0.02 --salida carga.json
+   python -m benchmarks.carga --modo async --concurrencia 64
+2. Se levantan --servidores instancias de benchmarks/ollama_falso.py, se indexa
+   un histórico sintético y --concurrencia auditores simultáneos (hilos, como
+   las sesiones de Streamlit) recorren tokenizar → embedding → búsqueda → predicción.
+   Con --ollama URL se apunta a servidores reales en lugar de los simulados.
+   --modo async recorre el mismo flujo con la API async de CometEngine
+   (generar_embeddings_async, generar_embedding_async, predecir_riesgo_async)
+   en un solo event loop, con --concurrencia casos en vuelo.
+3. El informe JSON trae p50/p95/p99 y throughput por etapa, errores, el
+   estado de cada endpoint visto por CometEngine y el resumen de modules.metricas
+   (incluye los tokens que reporta el servidor).
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from benchmarks.ollama_falso import ServidorOllamaFalso
+from benchmarks.sintetico import generar_pacientes
+from modules.tokenization import TokenizadorCoMET
+from modules.engine import CometEngine
+from modules.indice import IndiceExacto
+from modules.metricas import registro
+
+ETAPAS = ("tokenizacion", "embedding", "busqueda", "prediccion")
+TOP_K = 3
+
+
+def indexar_historico(engine, tokenizador, pacientes, tamano_lote=64):
+    ids = [pt['id'] for pt in pacientes]
+    secuencias = tokenizador.construir_secuencias_lote(pacientes)
+    indice = IndiceExacto()
+    indice.agregar(ids, engine.generar_embeddings_lote(secuencias, tamano_lote))
+    return indice, dict(zip(ids, secuencias))
+
+
+async def indexar_historico_async(engine, tokenizador, pacientes):
+    ids = [pt['id'] for pt in pacientes]
+    secuencias = tokenizador.construir_secuencias_lote(pacientes)
+    indice = IndiceExacto()
+    indice.agregar(ids, await engine.generar_embeddings_async(secuencias))
+    return indice, dict(zip(ids, secuencias))
+
+
+def auditar_caso(engine, tokenizador, indice, secuencias, paciente):
+    """Un caso completo; retorna {etapa: segundos} y la etapa que falló (o None)."""
+    tiempos = {}
+    t = time.perf_counter()
+    secuencia = tokenizador.construir_secuencia(paciente)
+    tiempos["tokenizacion"] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    try:
+        vector = engine.generar_embedding(secuencia)
+    except Exception:
+        tiempos["embedding"] = time.perf_counter() - t
+        return tiempos, "embedding"
+    tiempos["embedding"] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    similares = engine.buscar_similares(vector, k=TOP_K, indice=indice)
+    tiempos["busqueda"] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    prediccion = engine.predecir_riesgo(secuencia, [secuencias[id_pt] for id_pt, _ in similares], usar_cache=False)
+    tiempos["prediccion"] = time.perf_counter() - t
+    return tiempos, "prediccion" if prediccion.get("riesgo") == "ERROR" else None
+
+
+async def auditar_caso_async(engine, tokenizador, indice, secuencias, paciente):
+    """Igual que auditar_caso, con embedding y predicción por la API async."""
+    tiempos = {}
+    t = time.perf_counter()
+    secuencia = tokenizador.construir_secuencia(paciente)
+    tiempos["tokenizacion"] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    try:
+        vector = await engine.generar_embedding_async(secuencia)
+    except Exception:
+        tiempos["embedding"] = time.perf_counter() - t
+        return tiempos, "embedding"
+    tiempos["embedding"] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    similares = engine.buscar_similares(vector, k=TOP_K, indice=indice)
+    tiempos["busqueda"] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    prediccion = await engine.predecir_riesgo_async(
+        secuencia, [secuencias[id_pt] for id_pt, _ in similares], usar_cache=False
+    )
+    tiempos["prediccion"] = time.perf_counter() - t
+    return tiempos, "prediccion" if prediccion.get("riesgo") == "ERROR" else None
+
+
+def _resumen_etapa(latencias, errores, duracion):
+    if not latencias:
+        return {"operaciones": 0, "errores": errores}
+    ms = np.asarray(latencias) * 1000
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    return {
+        "operaciones": len(latencias),
+        "errores": errores,
+        "throughput_por_s": round(len(latencias) / duracion, 2),
+        "latencia_ms": {"media": round(float(ms.mean()), 3), "p50": round(float(p50), 3),
+                        "p95": round(float(p95), 3), "p99": round(float(p99), 3),
+                        "max": round(float(ms.max()), 3)},
+    }
+
+
+class _Acumulador:
+    def __init__(self, progreso=None):
+        self.latencias = {etapa: [] for etapa in ETAPAS}
+        self.errores = {etapa: 0 for etapa in ETAPAS}
+        self.completados = 0
+        self.hechos = 0
+        self.progreso = progreso
+
+    def registrar(self, tiempos, etapa_fallida):
+        for etapa, segundos in tiempos.items():
+            self.latencias[etapa].append(segundos)
+        if etapa_fallida:
+            self.errores[etapa_fallida] += 1
+        else:
+            self.completados += 1
+        self.hechos += 1
+        if self.progreso:
+            self.progreso(self.hechos)
+
+    def informe(self, casos, duracion):
+        return {
+            "duracion_s": round(duracion, 3),
+            "casos": len(casos),
+            "completados": self.completados,
+            "casos_por_s": round(len(casos) / duracion, 2),
+            "etapas": {etapa: _resumen_etapa(self.latencias[etapa], self.errores[etapa], duracion)
+                       for etapa in ETAPAS},
+        }
+
+
+def ejecutar_carga(engine, tokenizador, indice, secuencias, casos, concurrencia, progreso=None):
+    acumulador = _Acumulador(progreso)
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(concurrencia) as hilos:
+        futuros = [hilos.submit(auditar_caso, engine, tokenizador, indice, secuencias, pt) for pt in casos]
+        for futuro in futuros:
+            acumulador.registrar(*futuro.result())
+    return acumulador.informe(casos, time.perf_counter() - inicio)
+
+
+async def ejecutar_carga_async(engine, tokenizador, indice, secuencias, casos, concurrencia, progreso=None):
+    """--concurrencia casos en vuelo en un solo event loop (el engine limita además las peticiones)."""
+    acumulador = _Acumulador(progreso)
+    en_vuelo = asyncio.Semaphore(concurrencia)
+
+    async def uno(pt):
+        async with en_vuelo:
+            acumulador.registrar(*await auditar_caso_async(engine, tokenizador, indice, secuencias, pt))
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(uno(pt) for pt in casos))
+    return acumulador.informe(casos, time.perf_counter() - inicio)
+
+
+async def _carga_async(engine, tokenizador, historico, casos, concurrencia, progreso):
+    # Indexación y carga en el mismo event loop: los clientes httpx async quedan ligados a él
+    inicio = time.perf_counter()
+    indice, secuencias = await indexar_historico_async(engine, tokenizador, historico)
+    print(f">>> Índice de {len(indice)} pacientes ({time.perf_counter() - inicio:.1f}s)", file=sys.stderr)
+    return await ejecutar_carga_async(engine, tokenizador, indice, secuencias, casos, concurrencia, progreso)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Prueba de carga CoMET-Col contra Ollama simulado.")
+    parser.add_argument("--concurrencia", type=int, default=8, help="Auditores simultáneos")
+    parser.add_argument("--casos", type=int, default=200, help="Casos a auditar")
+    parser.add_argument("--historico", type=int, default=5000, help="Pacientes en el índice")
+    parser.add_argument("--servidores", type=int, default=1, help="Instancias del servidor simulado")
+    parser.add_argument("--latencia-embed", type=float, default=0.02)
+    parser.add_argument("--latencia-chat", type=float, default=0.5)
+    parser.add_argument("--jitter", type=float, default=0.2)
+    parser.add_argument("--tasa-error", type=float, default=0.0)
+    parser.add_argument("--capacidad", type=int, default=4, help="Peticiones en paralelo por servidor")
+    parser.add_argument("--dimension", type=int, default=768)
+    parser.add_argument("--estrategia", default="menos_cargado", choices=["menos_cargado", "round_robin"])
+    parser.add_argument("--modo", default="hilos", choices=["hilos", "async"],
+                        help="Auditores en hilos (como Streamlit) o en un event loop con la API async")
+    parser.add_argument("--ollama", nargs="+", help="URLs de servidores reales (omite los simulados)")
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--salida", help="Archivo JSON del informe (por defecto stdout)")
+    args = parser.parse_args(argv)
+
+    servidores = []
+    if args.ollama:
+        urls = args.ollama
+    else:
+        servidores = [
+            ServidorOllamaFalso(latencia_embed=args.latencia_embed, latencia_chat=args.latencia_chat,
+                                jitter=args.jitter, tasa_error=args.tasa_error, capacidad=args.capacidad,
+                                dimension=args.dimension, semilla=args.semilla + i).iniciar()
+            for i in range(args.servidores)
+        ]
+        urls = [s.url for s in servidores]
+
+    try:
+        engine = CometEngine(max_concurrencia=args.concurrencia, endpoints_embeddings=urls,
+                             endpoints_llm=urls, estrategia=args.estrategia)
+        tokenizador = TokenizadorCoMET()
+
+        historico = list(generar_pacientes(args.historico, semilla=args.semilla))
+        casos = list(generar_pacientes(args.casos, semilla=args.semilla + 1))
+
+        def progreso(hechos):
+            if hechos % 50 == 0 or hechos == len(casos):
+                print(f"\r>>> {hechos}/{len(casos)} casos", end="", file=sys.stderr)
+
+        if args.modo == "async":
+            informe = asyncio.run(_carga_async(engine, tokenizador, historico, casos, args.concurrencia, progreso))
+        else:
+            inicio = time.perf_counter()
+            indice, secuencias = indexar_historico(engine, tokenizador, historico)
+            print(f">>> Índice de {len(indice)} pacientes ({time.perf_counter() - inicio:.1f}s)", file=sys.stderr)
+            informe = ejecutar_carga(engine, tokenizador, indice, secuencias, casos, args.concurrencia, progreso)
+        print(file=sys.stderr)
+        informe["parametros"] = vars(args)
+        informe["endpoints"] = engine.estado_endpoints()
+        informe["metricas"] = registro.resumen()
+        if servidores:
+            informe["servidores"] = [{"url": s.url, **s.contadores} for s in servidores]
+    finally:
+        for servidor in servidores:
+            servidor.cerrar()
+
+    for etapa, datos in informe["etapas"].items():
+        if datos["operaciones"]:
+            lat = datos["latencia_ms"]
+            print(f">>> {etapa:<13} p50 {lat['p50']:>9.2f} ms  p95 {lat['p95']:>9.2f} ms  "
+                  f"p99 {lat['p99']:>9.2f} ms  errores {datos['errores']}", file=sys.stderr)
+    print(f">>> {informe['casos_por_s']} casos/s con concurrencia {args.concurrencia}", file=sys.stderr)
+
+    texto = json.dumps(informe, indent=2, ensure_ascii=False)
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            f.write(texto + "\n")
+    else:
+        print(texto)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+"""
+GUÍA DE EJECUCIÓN (MICRO-BENCHMARKS):
+
+1. Desde la raíz del repositorio (no requiere Ollama):
+   python -m benchmarks.micro --pacientes 1000 10000 --salida bench.json
+   python -m benchmarks.micro --pacientes 1000000 --max-vectores 200000
+2. Cada escala genera un repositorio sintético en --datos (se reutiliza si ya
+   existe con la misma escala y semilla) y mide:
+   - TuvaRepository.cargar_datos
+   - TokenizadorCoMET.construir_secuencia
+   - CometEngine.buscar_similitud (y buscar_similares con IndiceExacto)
+   - MaestroSispro.get_concepto
+3. La salida es JSON: throughput, latencias p50/p95/p99 (ms) y memoria pico
+   (MB, tracemalloc) por benchmark y escala. Compara dos ejecuciones para
+   detectar regresiones antes de actualizar dependencias.
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from benchmarks.sintetico import escribir_repositorio, generar_pacientes
+from modules.repository import TuvaRepository
+from modules.tokenization import TokenizadorCoMET
+from modules.engine import CometEngine
+from modules.indice import IndiceExacto
+from modules.knowledge import MaestroSispro
+
+
+def _percentiles(latencias_s):
+    ms = np.asarray(latencias_s, dtype=np.float64) * 1000
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    return {"p50": round(float(p50), 4), "p95": round(float(p95), 4),
+            "p99": round(float(p99), 4), "max": round(float(ms.max()), 4)}
+
+
+def _memoria_pico_mb(funcion):
+    """Pico de memoria Python asignada durante `funcion()` (corrida aparte: tracemalloc la hace más lenta)."""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        funcion()
+        _, pico = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return round(pico / 2**20, 2)
+
+
+def _resultado(nombre, escala, operaciones, segundos, latencias=None, memoria=None, **extra):
+    resultado = {
+        "benchmark": nombre,
+        "escala": escala,
+        "operaciones": operaciones,
+        "segundos": round(segundos, 4),
+        "throughput_por_s": round(operaciones / segundos, 2) if segundos else None,
+        "latencia_ms": _percentiles(latencias) if latencias is not None and len(latencias) else None,
+        "memoria_pico_mb": memoria,
+    }
+    resultado.update(extra)
+    return resultado
+
+
+def preparar_datos(carpeta, n, semilla):
+    """Repositorio sintético de `n` pacientes; se regenera sólo si cambia la escala o la semilla."""
+    marca = os.path.join(carpeta, "sintetico.json")
+    firma = {"pacientes": n, "semilla": semilla}
+    if os.path.exists(marca):
+        with open(marca, "r", encoding="utf-8") as f:
+            if json.load(f) == firma:
+                return
+    inicio = time.perf_counter()
+    escribir_repositorio(carpeta, n, semilla=semilla)
+    with open(marca, "w", encoding="utf-8") as f:
+        json.dump(firma, f)
+    print(f">>> {n} pacientes sintéticos en '{carpeta}' ({time.perf_counter() - inicio:.1f}s)", file=sys.stderr)
+
+
+def bench_cargar_datos(carpeta, n, repeticiones):
+    repo = TuvaRepository(carpeta)
+    latencias = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        historico, _, _, _ = repo.cargar_datos()
+        latencias.append(time.perf_counter() - inicio)
+        del historico
+    memoria = _memoria_pico_mb(repo.cargar_datos)
+    tamano = os.path.getsize(repo.get_rutas()[0])
+    return _resultado("cargar_datos", n, n * repeticiones, sum(latencias), latencias, memoria,
+                      unidad="paciente", archivo_mb=round(tamano / 2**20, 2))
+
+
+def bench_construir_secuencia(pacientes, n, tokenizador):
+    latencias = np.empty(len(pacientes))
+    for i, pt in enumerate(pacientes):
+        inicio = time.perf_counter()
+        tokenizador.construir_secuencia(pt)
+        latencias[i] = time.perf_counter() - inicio
+    muestra = pacientes[:1000]
+    memoria = _memoria_pico_mb(lambda: [tokenizador.construir_secuencia(pt) for pt in muestra])
+    eventos = sum(len(pt['eventos']) for pt in pacientes)
+    return _resultado("construir_secuencia", n, len(pacientes), float(latencias.sum()), latencias, memoria,
+                      unidad="paciente", eventos_por_paciente=round(eventos / len(pacientes), 2))
+
+
+def bench_buscar_similitud(n, dimension, max_vectores, consultas, semilla):
+    rng = np.random.default_rng(semilla)
+    n_vectores = min(n, max_vectores)
+    vectores = rng.standard_normal((n_vectores, dimension)).astype(np.float32)
+    queries = rng.standard_normal((consultas, dimension)).astype(np.float32)
+    engine = CometEngine()
+
+    resultados = []
+    latencias = []
+    for q in queries:
+        inicio = time.perf_counter()
+        engine.buscar_similitud(q, vectores)
+        latencias.append(time.perf_counter() - inicio)
+    memoria = _memoria_pico_mb(lambda: engine.buscar_similitud(queries[0], vectores))
+    resultados.append(_resultado("buscar_similitud", n, consultas, sum(latencias), latencias, memoria,
+                                 unidad="consulta", vectores=n_vectores, dimension=dimension))
+
+    indice = IndiceExacto()
+    indice.agregar(range(n_vectores), vectores)
+    latencias = []
+    for q in queries:
+        inicio = time.perf_counter()
+        engine.buscar_similares(q, k=3, indice=indice)
+        latencias.append(time.perf_counter() - inicio)
+    memoria = _memoria_pico_mb(lambda: engine.buscar_similares(queries[0], k=3, indice=indice))
+    resultados.append(_resultado("buscar_similares_exacto", n, consultas, sum(latencias), latencias, memoria,
+                                 unidad="consulta", vectores=n_vectores, dimension=dimension))
+    return resultados
+
+
+def bench_ontologia(n, consultas, semilla, tamano_lote=1000):
+    """Latencia por lote de `tamano_lote` búsquedas (una sola es menor que la resolución del reloj)."""
+    rng = np.random.default_rng(semilla)
+    maestro = MaestroSispro()
+    universo = ([("DX", c) for c in maestro.cie10] + [("PROC", c) for c in maestro.cups]
+                + [("MED", c) for c in maestro.atc])
+    # Un tercio de códigos desconocidos o más largos: fuerzan el respaldo por prefijo
+    universo += [(tipo, codigo + "9") for tipo, codigo in universo] + [("DX", "Z999"), ("PROC", "000000")]
+    elegidos = [universo[i] for i in rng.integers(0, len(universo), consultas)]
+
+    latencias = []
+    for inicio in range(0, consultas, tamano_lote):
+        lote = elegidos[inicio:inicio + tamano_lote]
+        t = time.perf_counter()
+        for tipo, codigo in lote:
+            maestro.get_concepto(tipo, codigo)
+        latencias.append((time.perf_counter() - t) / len(lote))
+    memoria = _memoria_pico_mb(lambda: [maestro.get_concepto(t, c) for t, c in elegidos[:tamano_lote]])
+    return _resultado("ontologia_get_concepto", n, consultas, sum(latencias) * tamano_lote, latencias, memoria,
+                      unidad="busqueda", compilada=maestro.compilada is not None)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Micro-benchmarks CoMET-Col sobre RIPS sintéticos.")
+    parser.add_argument("--pacientes", type=int, nargs="+", default=[1000, 10000], help="Escalas a medir")
+    parser.add_argument("--datos", default=os.path.join("benchmarks", "datos"), help="Carpeta de datos sintéticos")
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--repeticiones", type=int, default=3, help="Repeticiones de cargar_datos")
+    parser.add_argument("--muestra-tokenizacion", type=int, default=20_000,
+                        help="Pacientes tokenizados por escala (tope)")
+    parser.add_argument("--dimension", type=int, default=768, help="Dimensión de los vectores (nomic-embed-text)")
+    parser.add_argument("--max-vectores", type=int, default=100_000, help="Tope de vectores en memoria")
+    parser.add_argument("--consultas", type=int, default=200, help="Consultas de búsqueda por escala")
+    parser.add_argument("--busquedas-ontologia", type=int, default=100_000)
+    parser.add_argument("--salida", help="Archivo JSON de resultados (por defecto stdout)")
+    args = parser.parse_args(argv)
+
+    tokenizador = TokenizadorCoMET()
+    resultados = []
+    for n in args.pacientes:
+        carpeta = os.path.join(args.datos, f"p{n}")
+        preparar_datos(carpeta, n, args.semilla)
+
+        resultados.append(bench_cargar_datos(carpeta, n, args.repeticiones))
+        muestra = list(generar_pacientes(min(n, args.muestra_tokenizacion), semilla=args.semilla + 1))
+        resultados.append(bench_construir_secuencia(muestra, n, tokenizador))
+        del muestra
+        resultados.extend(bench_buscar_similitud(n, args.dimension, args.max_vectores, args.consultas, args.semilla))
+        resultados.append(bench_ontologia(n, args.busquedas_ontologia, args.semilla))
+        for r in resultados[-5:]:
+            print(f">>> [{n}] {r['benchmark']}: {r['throughput_por_s']} {r['unidad']}s/s, "
+                  f"p95 {r['latencia_ms']['p95']} ms", file=sys.stderr)
+
+    informe = {
+        "entorno": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "plataforma": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "parametros": vars(args),
+        "resultados": resultados,
+    }
+    texto = json.dumps(informe, indent=2, ensure_ascii=False)
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            f.write(texto + "\n")
+    else:
+        print(texto)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""
+GUÍA DE EJECUCIÓN (SERVIDOR OLLAMA SIMULADO):
+
+Sustituto local de Ollama para pruebas de carga sin GPU. Atiende /api/embed,
+/api/chat y /api/tags con latencia, jitter y tasa de error configurables:
+   python -m benchmarks.ollama_falso --puerto 11500 --latencia-chat 0.8 --tasa-error 0.02
+   COMET_OLLAMA_EMBEDDINGS=http://127.0.0.1:11500 COMET_OLLAMA_LLM=http://127.0.0.1:11500 streamlit run app.py
+
+Los embeddings son deterministas (hashing de tokens): secuencias que comparten
+tokens quedan cerca, así que la búsqueda top-k devuelve vecinos con sentido.
+"""
+import argparse
+import hashlib
+import json
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import numpy as np
+
+
+def embedding_falso(texto, dimension):
+    """Feature hashing de tokens: cada token suma ±1 en una dimensión fija."""
+    vector = np.zeros(dimension, dtype=np.float32)
+    for token in texto.split():
+        h = int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "little")
+        vector[h % dimension] += 1.0 if (h >> 32) & 1 else -1.0
+    norma = np.linalg.norm(vector)
+    return (vector / norma if norma else vector).tolist()
+
+
+class ServidorOllamaFalso:
+    """
+    Servidor HTTP en un hilo de fondo. `capacidad` limita las peticiones que
+    se atienden a la vez (como los slots de una GPU); el resto hace cola.
+    Latencias en segundos; `jitter` es la desviación relativa (0.3 = ±30%).
+    """
+    def __init__(self, puerto=0, latencia_embed=0.02, latencia_chat=0.5, jitter=0.2, tasa_error=0.0,
+                 capacidad=4, dimension=768, semilla=0, host="127.0.0.1"):
+        self.latencia_embed = latencia_embed
+        self.latencia_chat = latencia_chat
+        self.jitter = jitter
+        self.tasa_error = tasa_error
+        self.dimension = dimension
+        self.contadores = {"embed": 0, "chat": 0, "errores": 0}
+        self._rng = np.random.default_rng(semilla)
+        self._lock = threading.Lock()
+        self._slots = threading.Semaphore(capacidad)
+        self._servidor = ThreadingHTTPServer((host, puerto), self._manejador())
+        self._servidor.daemon_threads = True
+        self._hilo = None
+
+    @property
+    def url(self):
+        host, puerto = self._servidor.server_address[:2]
+        return f"http://{host}:{puerto}"
+
+    def _sortear(self, latencia):
+        with self._lock:
+            demora = max(0.0, latencia * (1 + self.jitter * self._rng.standard_normal()))
+            falla = self._rng.random() < self.tasa_error
+        return demora, falla
+
+    def _manejador(self):
+        servidor = self
+
+        class Manejador(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _responder(self, codigo, cuerpo):
+                datos = json.dumps(cuerpo).encode("utf-8")
+                self.send_response(codigo)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(datos)))
+                self.end_headers()
+                self.wfile.write(datos)
+
+            def do_GET(self):
+                if self.path == "/api/tags":
+                    return self._responder(200, {"models": [{"name": "nomic-embed-text"}, {"name": "llama3.1"}]})
+                self._responder(404, {"error": "not found"})
+
+            def do_POST(self):
+                largo = int(self.headers.get("Content-Length", 0))
+                peticion = json.loads(self.rfile.read(largo) or b"{}")
+                if self.path == "/api/embed":
+                    return self._atender("embed", servidor.latencia_embed, peticion)
+                if self.path == "/api/chat":
+                    return self._atender("chat", servidor.latencia_chat, peticion)
+                self._responder(404, {"error": "not found"})
+
+            def _atender(self, tipo, latencia, peticion):
+                demora, falla = servidor._sortear(latencia)
+                inicio = time.perf_counter()
+                with servidor._slots:
+                    time.sleep(demora)
+                with servidor._lock:
+                    servidor.contadores[tipo] += 1
+                    if falla:
+                        servidor.contadores["errores"] += 1
+                if falla:
+                    return self._responder(500, {"error": "fallo simulado"})
+                duracion_ns = int((time.perf_counter() - inicio) * 1e9)
+                if tipo == "embed":
+                    entradas = peticion.get("input", [])
+                    entradas = [entradas] if isinstance(entradas, str) else entradas
+                    return self._responder(200, {
+                        "model": peticion.get("model"),
+                        "embeddings": [embedding_falso(t, servidor.dimension) for t in entradas],
+                        "total_duration": duracion_ns,
+                        "prompt_eval_count": sum(len(t.split()) for t in entradas),
+                    })
+                prompt = " ".join(m.get("content", "") for m in peticion.get("messages", []))
+                contenido = json.dumps({
+                    "riesgo": ("ALTO", "MEDIO", "BAJO")[len(prompt) % 3],
+                    "evento_futuro": "SIMULADO",
+                    "costo_tendencia": "ESTABLE",
+                    "explicacion": "Respuesta del servidor Ollama simulado.",
+                })
+                eval_count = len(contenido.split())
+                self._responder(200, {
+                    "model": peticion.get("model"),
+                    "created_at": datetime.now(timezone.utc).isoformat(),
+                    "message": {"role": "assistant", "content": contenido},
+                    "done": True,
+                    "done_reason": "stop",
+                    "total_duration": duracion_ns,
+                    "prompt_eval_count": len(prompt.split()),
+                    "prompt_eval_duration": duracion_ns // 4,
+                    "eval_count": eval_count,
+                    "eval_duration": duracion_ns - duracion_ns // 4,
+                })
+
+        return Manejador
+
+    def iniciar(self):
+        self._hilo = threading.Thread(target=self._servidor.serve_forever, daemon=True)
+        self._hilo.start()
+        return self
+
+    def cerrar(self):
+        self._servidor.shutdown()
+        self._servidor.server_close()
+
+    def __enter__(self):
+        return self.iniciar()
+
+    def __exit__(self, *exc):
+        self.cerrar()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Servidor Ollama simulado (embeddings + chat).")
+    parser.add_argument("--puerto", type=int, default=11500)
+    parser.add_argument("--latencia-embed", type=float, default=0.02, help="Segundos por petición de embeddings")
+    parser.add_argument("--latencia-chat", type=float, default=0.5, help="Segundos por petición de chat")
+    parser.add_argument("--jitter", type=float, default=0.2, help="Desviación relativa de la latencia")
+    parser.add_argument("--tasa-error", type=float, default=0.0, help="Fracción de peticiones que responden 500")
+    parser.add_argument("--capacidad", type=int, default=4, help="Peticiones atendidas en paralelo")
+    parser.add_argument("--dimension", type=int, default=768)
+    args = parser.parse_args(argv)
+
+    servidor = ServidorOllamaFalso(args.puerto, args.latencia_embed, args.latencia_chat, args.jitter,
+                                   args.tasa_error, args.capacidad, args.dimension)
+    print(f">>> Ollama simulado en {servidor.url} (Ctrl+C para salir)")
+    try:
+        servidor._servidor.serve_forever()
+    except KeyboardInterrupt:
+        servidor.cerrar()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+MÓDULO: SINTÉTICO
+Responsabilidad: Generar historias RIPS sintéticas a escala (1k - 1M pacientes) con el
+mismo formato que TuvaRepository y códigos tomados de MaestroSispro.
+La generación es determinista por semilla y en streaming (memoria constante).
+"""
+import json
+import os
+from datetime import date, timedelta
+
+import numpy as np
+
+from modules.knowledge import MaestroSispro
+
+ESPECIALIDADES = ("MED_GENERAL", "MED_INTERNA", "URGENCIAS", "NEFROLOGIA", "ENDOCRINOLOGIA",
+                  "CARDIOLOGIA", "CIRUGIA_GENERAL", "PEDIATRIA")
+TIPOS_AFILIADO = ("Cotizante", "Beneficiario")
+REGIMENES = ("Contributivo", "Subsidiado", "Especial")
+# Participación aproximada por régimen en el aseguramiento nacional
+PESOS_REGIMEN = (0.48, 0.49, 0.03)
+
+
+def _codigos(catalogo, rng, extra=20):
+    """Códigos del catálogo más variantes de 4-5 caracteres que ejercitan el respaldo por prefijo."""
+    base = sorted(catalogo)
+    variantes = [c + str(rng.integers(0, 10)) for c in rng.choice(base, size=extra)]
+    return np.array(base + variantes)
+
+
+def generar_pacientes(n, semilla=0, eventos_medios=8, n_ips=500, maestro=None, desde="2020-01-01"):
+    """
+    Genera `n` pacientes en formato TuvaRepository.
+    Eventos por paciente ~ 1 + Poisson(eventos_medios - 1); los gaps entre
+    eventos mezclan seguimientos cortos (urgencias/controles) y abandonos largos.
+    """
+    rng = np.random.default_rng(semilla)
+    maestro = maestro or MaestroSispro()
+    dx = _codigos(maestro.cie10, rng)
+    proc = _codigos(maestro.cups, rng)
+    med = _codigos(maestro.atc, rng)
+    inicio = date.fromisoformat(desde)
+
+    for i in range(n):
+        n_eventos = 1 + int(rng.poisson(eventos_medios - 1))
+        gaps = np.where(rng.random(n_eventos) < 0.7,
+                        rng.integers(0, 31, n_eventos), rng.integers(31, 400, n_eventos))
+        gaps[0] = rng.integers(0, 365)
+        ips_habitual = int(rng.integers(0, n_ips))
+        fecha = inicio
+        eventos = []
+        for j in range(n_eventos):
+            fecha = fecha + timedelta(days=int(gaps[j]))
+            # 80% de las atenciones en la IPS habitual del paciente
+            ips = ips_habitual if rng.random() < 0.8 else int(rng.integers(0, n_ips))
+            evento = {
+                "fecha": fecha.isoformat(),
+                "cod_ips": f"IPS_{ips:05d}",
+                "especialidad_medico": ESPECIALIDADES[rng.integers(0, len(ESPECIALIDADES))],
+                "diagnosticos": [{"cod": str(c)} for c in rng.choice(dx, size=1 + rng.poisson(0.4))],
+            }
+            if rng.random() < 0.5:
+                evento["procedimientos"] = [{"cod": str(c)} for c in rng.choice(proc, size=1 + rng.poisson(0.5))]
+            if rng.random() < 0.6:
+                evento["medicamentos"] = [{"atc": str(c)} for c in rng.choice(med, size=1 + rng.poisson(0.7))]
+            eventos.append(evento)
+
+        yield {
+            "id": f"PT_SINT_{semilla}_{i:07d}",
+            "perfil": {
+                "sexo": "M" if rng.random() < 0.5 else "F",
+                "edad": int(rng.integers(0, 95)),
+                "regimen": REGIMENES[rng.choice(len(REGIMENES), p=PESOS_REGIMEN)],
+                "tipo_afiliado": TIPOS_AFILIADO[rng.integers(0, 2)],
+            },
+            "eventos": eventos,
+        }
+
+
+def escribir_repositorio(carpeta, n, semilla=0, ndjson=False, **parametros):
+    """
+    Escribe `carpeta` con historial_paciente.json (o .ndjson) y nuevo_evento.json
+    listos para TuvaRepository. Retorna la ruta del histórico.
+    """
+    os.makedirs(carpeta, exist_ok=True)
+    pacientes = generar_pacientes(n + 1, semilla=semilla, **parametros)
+    nuevo = next(pacientes)
+    with open(os.path.join(carpeta, "nuevo_evento.json"), "w", encoding="utf-8") as f:
+        json.dump(nuevo, f, ensure_ascii=False)
+
+    if ndjson:
+        ruta = os.path.join(carpeta, "historial_paciente.ndjson")
+        with open(ruta, "w", encoding="utf-8") as f:
+            for pt in pacientes:
+                f.write(json.dumps(pt, ensure_ascii=False) + "\n")
+        return ruta
+
+    ruta = os.path.join(carpeta, "historial_paciente.json")
+    with open(ruta, "w", encoding="utf-8") as f:
+        f.write("[")
+        for i, pt in enumerate(pacientes):
+            f.write(("," if i else "") + json.dumps(pt, ensure_ascii=False))
+        f.write("]")
+    return ruta
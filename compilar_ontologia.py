@@ -0,0 +1,63 @@
+"""
+GUÍA DE EJECUCIÓN (COMPILAR CATÁLOGOS SISPRO):
+
+1. Descarga los catálogos oficiales (SISPRO / MinSalud) como CSV de dos
+   columnas: código y descripción (separador ';' o ',', con encabezado).
+2. Ejecuta (los catálogos omitidos usan los diccionarios base):
+   python compilar_ontologia.py --cie10 cie10.csv --cups cups.csv --atc atc.csv --tarifas manual_tarifario.csv
+3. Las apps y scripts cargan ontologia_sispro.bin automáticamente
+   (o la ruta indicada en la variable de entorno COMET_ONTOLOGIA).
+
+Compilar cambia la versión de la ontología: reconstruye el índice con
+construir_indice.py.
+"""
+import argparse
+import csv
+import sys
+
+from modules.knowledge import CIE10, CUPS, ATC, REGIMEN, RUTA_ONTOLOGIA, compilar_ontologia
+
+
+def leer_catalogo(ruta):
+    with open(ruta, 'r', encoding='utf-8-sig', newline='') as f:
+        muestra = f.read(4096)
+        f.seek(0)
+        dialecto = csv.Sniffer().sniff(muestra, delimiters=";,\t|")
+        lector = csv.reader(f, dialecto)
+        next(lector, None)  # encabezado
+        catalogo = {}
+        for fila in lector:
+            if len(fila) >= 2 and fila[0].strip():
+                codigo = fila[0].strip().replace(".", "").upper()
+                catalogo[codigo] = fila[1].strip().upper()
+        return catalogo
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compila los catálogos SISPRO a un snapshot binario mapeable.")
+    parser.add_argument("--cie10", help="CSV de diagnósticos CIE-10")
+    parser.add_argument("--cups", help="CSV de procedimientos CUPS")
+    parser.add_argument("--atc", help="CSV de medicamentos ATC")
+    parser.add_argument("--tarifas", help="CSV del manual tarifario (código CUPS; valor)")
+    parser.add_argument("--salida", default=RUTA_ONTOLOGIA, help="Archivo destino")
+    args = parser.parse_args(argv)
+
+    catalogos = {
+        "DX": leer_catalogo(args.cie10) if args.cie10 else CIE10,
+        "PROC": leer_catalogo(args.cups) if args.cups else CUPS,
+        "MED": leer_catalogo(args.atc) if args.atc else ATC,
+        "REG": REGIMEN,
+    }
+    if args.tarifas:
+        catalogos["TARIFA"] = leer_catalogo(args.tarifas)
+
+    try:
+        compilar_ontologia(catalogos, args.salida)
+    except ValueError as e:
+        sys.exit(f"No se compiló la ontología: {e}")
+    resumen = ", ".join(f"{tipo}={len(c)}" for tipo, c in catalogos.items())
+    print(f">>> Ontología compilada en '{args.salida}' ({resumen})")
+
+
+if __name__ == "__main__":
+    main()
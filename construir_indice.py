@@ -0,0 +1,130 @@
+"""
+GUÍA DE EJECUCIÓN (CONSTRUCCIÓN OFFLINE DEL ÍNDICE):
+
+1. Asegúrate de tener Ollama corriendo (ollama serve) con nomic-embed-text.
+2. Ejecuta:
+   python construir_indice.py --datos datos_rip --salida indice_comet
+   (Si existe historial_paciente.ndjson en --datos, se lee en streaming.)
+   Desde el warehouse Parquet (ver exportar_parquet.py), con filtros opcionales:
+   python construir_indice.py --parquet datos_parquet --desde 2024-01-01 --regimen Contributivo
+3. Inicia la app (streamlit run app.py); cargará el snapshot al arrancar.
+
+Repite el paso 2 cuando cambie el histórico, la ontología o el modelo.
+Por defecto sólo se re-procesan los pacientes nuevos o modificados desde el
+último snapshot (--completo fuerza la reconstrucción total).
+Cada ejecución publica una versión nueva en --salida (puntero ACTUAL); una
+app en marcha aplica en sitio sólo el delta de los pacientes cambiados.
+
+La tokenización corre en --procesos procesos y los embeddings en --hilos
+hilos; cada bloque terminado queda en <salida>.parcial, así que si la
+construcción se interrumpe basta con relanzar el mismo comando para
+retomarla (--procesos 0 usa la ruta secuencial, sin checkpoint).
+
+Para históricos grandes, reparte el índice en N particiones servidas por
+procesos independientes (la app las usa si coinciden con el snapshot):
+   python construir_indice.py --particiones 8
+   python construir_indice.py --particiones 8 --criterio regimen
+
+Para servir con vectores cuantizados (COMET_CUANTIZACION=int8|pq en la app),
+mide antes la pérdida frente a la búsqueda exacta:
+   python construir_indice.py --cuantizacion pq
+"""
+import argparse
+import os
+import sys
+import time
+
+from modules.repository import TuvaRepository
+from modules.repository_parquet import TuvaRepositoryParquet
+from modules.tokenization import TokenizadorCoMET
+from modules.engine import CometEngine
+from modules.cache import CacheEmbeddings
+from modules.snapshot import SnapshotIndice
+from modules.indexacion import actualizar_snapshot
+from modules.pipeline_indice import construir_snapshot_paralelo, descartar_checkpoint
+from modules.particiones import particionar_snapshot
+from modules.indice import medir_perdida
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Construye el snapshot vectorial del histórico CoMET-Col.")
+    parser.add_argument("--datos", default="datos_rip", help="Carpeta con historial_paciente.json")
+    parser.add_argument("--parquet", help="Carpeta del warehouse Parquet (reemplaza --datos)")
+    parser.add_argument("--desde", help="Sólo eventos desde AAAA-MM-DD (Parquet)")
+    parser.add_argument("--hasta", help="Sólo eventos hasta AAAA-MM-DD (Parquet)")
+    parser.add_argument("--regimen", help="Sólo pacientes de este régimen (Parquet)")
+    parser.add_argument("--ips", help="Sólo eventos de esta IPS (Parquet)")
+    parser.add_argument("--salida", default="indice_comet", help="Carpeta destino del snapshot")
+    parser.add_argument("--lote", type=int, default=32, help="Secuencias por llamada de embeddings")
+    parser.add_argument("--completo", action="store_true", help="Ignorar el snapshot previo y re-procesar todo")
+    parser.add_argument("--sin-cache", action="store_true", help="No usar el cache de embeddings en disco")
+    parser.add_argument("--procesos", type=int, default=os.cpu_count(),
+                        help="Procesos para tokenizar (0 = ruta secuencial)")
+    parser.add_argument("--hilos", type=int, default=4, help="Llamadas de embeddings concurrentes")
+    parser.add_argument("--bloque", type=int, default=256, help="Pacientes por bloque de checkpoint")
+    parser.add_argument("--checkpoint", help="Carpeta de trabajo (por defecto <salida>.parcial)")
+    parser.add_argument("--particiones", type=int, default=0, help="Repartir el índice en N particiones")
+    parser.add_argument("--criterio", choices=["id", "regimen"], default="id",
+                        help="Partición por hash del id del paciente o por régimen")
+    parser.add_argument("--salida-particiones", default="indice_comet_particiones",
+                        help="Carpeta destino de las particiones")
+    parser.add_argument("--cuantizacion", choices=["int8", "pq"],
+                        help="Medir recall y pérdida del top-1 de un índice cuantizado")
+    args = parser.parse_args(argv)
+
+    filtros = None
+    if args.parquet:
+        repo = TuvaRepositoryParquet(args.parquet)
+        filtros = {"fecha_desde": args.desde, "fecha_hasta": args.hasta,
+                   "regimen": args.regimen, "cod_ips": args.ips}
+    else:
+        repo = TuvaRepository(args.datos)
+    tokenizador = TokenizadorCoMET()
+    engine = CometEngine(cache_embeddings=None if args.sin_cache else CacheEmbeddings())
+
+    previo = None if args.completo else SnapshotIndice.cargar(args.salida)
+
+    def progreso(hechos, vectorizados=None, velocidad=None):
+        detalle = f", {vectorizados} vectorizados ({velocidad:.1f} pacientes/s)" if velocidad is not None else ""
+        print(f"\r>>> Revisados {hechos} pacientes{detalle}", end="", file=sys.stderr)
+
+    inicio = time.perf_counter()
+    if args.procesos > 0:
+        carpeta_checkpoint = args.checkpoint or args.salida.rstrip(os.sep) + ".parcial"
+        snapshot, delta, metricas = construir_snapshot_paralelo(
+            previo, repo, tokenizador, engine, carpeta_checkpoint, procesos=args.procesos, hilos=args.hilos,
+            tamano_bloque=args.bloque, tamano_lote=args.lote, progreso=progreso, filtros=filtros)
+    else:
+        snapshot, delta = actualizar_snapshot(previo, repo, tokenizador, engine, tamano_lote=args.lote,
+                                              progreso=progreso, filtros=filtros)
+        metricas = None
+    snapshot.guardar(args.salida)
+    if metricas is not None:
+        descartar_checkpoint(carpeta_checkpoint)
+    print(file=sys.stderr)
+    print(f">>> Snapshot con {len(snapshot)} pacientes en '{args.salida}' "
+          f"({time.perf_counter() - inicio:.1f}s, ontología {snapshot.version_ontologia})")
+    print(f">>> Delta: {delta.resumen()}")
+    if metricas is not None:
+        print(f">>> {metricas['vectorizados']} vectorizados a {metricas['pacientes_por_segundo']:.1f} pacientes/s, "
+              f"{metricas['reanudados']} retomados del checkpoint")
+
+    if args.cuantizacion and len(snapshot):
+        cuantizado = snapshot.construir_indice(cuantizacion=args.cuantizacion)
+        perdida = medir_perdida(cuantizado, snapshot.ids, snapshot.vectores)
+        print(f">>> Cuantización {args.cuantizacion}: {cuantizado.bytes_por_vector()} bytes/vector "
+              f"(float32: {snapshot.vectores.shape[1] * 4}), recall@3 {perdida['recall_k']:.3f}, "
+              f"top-1 {perdida['top1']:.3f}, pérdida máx. top-1 {perdida['perdida_max_top1']:.4f} "
+              f"({perdida['consultas']} consultas)")
+
+    if args.particiones > 0:
+        clave_de = None
+        if args.criterio == "regimen":
+            clave_de = {pt['id']: pt['perfil']['regimen'] for pt in repo.iterar_historico(**(filtros or {}))}
+        particionar_snapshot(snapshot, args.salida_particiones, args.particiones,
+                             clave_de=clave_de, criterio=args.criterio)
+        print(f">>> {args.particiones} particiones ({args.criterio}) en '{args.salida_particiones}'")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+"""
+GUÍA DE EJECUCIÓN (EXPORTAR WAREHOUSE A PARQUET):
+
+1. Instala la dependencia opcional:
+   pip install pyarrow
+2. Ejecuta (lee el JSON/NDJSON en streaming):
+   python exportar_parquet.py --datos datos_rip --salida datos_parquet
+3. Construye el índice sobre el warehouse columnar:
+   python construir_indice.py --parquet datos_parquet
+"""
+import argparse
+import os
+import shutil
+
+from modules.repository import TuvaRepository
+from modules.repository_parquet import TuvaRepositoryParquet
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Exporta el histórico Tuva (JSON) a Parquet particionado.")
+    parser.add_argument("--datos", default="datos_rip", help="Carpeta con historial_paciente.json/.ndjson")
+    parser.add_argument("--salida", default="datos_parquet", help="Carpeta destino del warehouse Parquet")
+    parser.add_argument("--lote", type=int, default=50_000, help="Pacientes por archivo Parquet")
+    args = parser.parse_args(argv)
+
+    origen = TuvaRepository(args.datos)
+    destino = TuvaRepositoryParquet(args.salida)
+    total = destino.importar(origen.iterar_historico(), tamano_lote=args.lote)
+
+    # El caso a auditar viaja junto al warehouse
+    _, path_nuevo = origen.get_rutas()
+    if os.path.exists(path_nuevo):
+        shutil.copy(path_nuevo, os.path.join(args.salida, "nuevo_evento.json"))
+
+    print(f">>> {total} pacientes exportados a '{args.salida}'")
+
+
+if __name__ == "__main__":
+    main()
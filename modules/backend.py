@@ -0,0 +1,212 @@
+"""
+MÓDULO: BACKEND
+Responsabilidad: Repartir las llamadas a Ollama entre varios servidores de inferencia.
+Enruta por menor carga o round-robin, expulsa temporalmente los nodos que fallan,
+los re-admite tras una verificación de salud y mide la latencia por endpoint.
+"""
+import asyncio
+import itertools
+import os
+import threading
+import time
+from collections import deque
+
+import httpx
+import numpy as np
+
+ESTRATEGIAS = ("menos_cargado", "round_robin")
+
+
+def _url_base(url):
+    url = url or os.environ.get("OLLAMA_HOST") or "http://127.0.0.1:11434"
+    return url if "://" in url else f"http://{url}"
+
+
+class NodoOllama:
+    """Un endpoint con su cliente LangChain y sus contadores (protegidos por lock)."""
+    def __init__(self, url, cliente, ventana_latencias=1000):
+        self.url = _url_base(url)
+        self.cliente = cliente
+        self.en_vuelo = 0
+        self.peticiones = 0
+        self.errores = 0
+        self.fallos_consecutivos = 0
+        self.expulsado_hasta = 0.0
+        self.ultimo_error = None
+        self.verificando = False
+        self._latencias = deque(maxlen=ventana_latencias)
+        self._lock = threading.Lock()
+
+    @property
+    def en_rotacion(self):
+        return self.expulsado_hasta == 0.0
+
+    def cuarentena_vencida(self):
+        return not self.en_rotacion and not self.verificando and time.monotonic() >= self.expulsado_hasta
+
+    def _iniciar(self):
+        with self._lock:
+            self.en_vuelo += 1
+            self.peticiones += 1
+
+    def _terminar(self, segundos, error=None):
+        with self._lock:
+            self.en_vuelo -= 1
+            if error is None:
+                self._latencias.append(segundos)
+                self.fallos_consecutivos = 0
+            else:
+                self.errores += 1
+                self.fallos_consecutivos += 1
+                self.ultimo_error = f"{type(error).__name__}: {error}"
+
+    def _cancelar(self):
+        with self._lock:
+            self.en_vuelo -= 1
+
+    def estadisticas(self):
+        with self._lock:
+            latencias = np.array(self._latencias, dtype=np.float64) * 1000
+            base = {
+                "url": self.url,
+                "activo": self.en_rotacion,
+                "en_vuelo": self.en_vuelo,
+                "peticiones": self.peticiones,
+                "errores": self.errores,
+                "ultimo_error": self.ultimo_error,
+            }
+        if len(latencias):
+            p50, p95 = np.percentile(latencias, [50, 95])
+            base.update(latencia_p50_ms=round(float(p50), 2), latencia_p95_ms=round(float(p95), 2))
+        else:
+            base.update(latencia_p50_ms=None, latencia_p95_ms=None)
+        return base
+
+
+class PoolOllama:
+    """
+    Pool de endpoints para un mismo modelo. `fabrica(url)` crea el cliente
+    LangChain de cada nodo (OllamaEmbeddings, ChatOllama...).
+    Tras `max_fallos` errores seguidos un nodo sale de la rotación por
+    `cuarentena` segundos; al vencer, vuelve si responde a /api/tags.
+    Una llamada fallida se reintenta en otro nodo antes de propagar el error.
+    """
+    def __init__(self, urls, fabrica, estrategia="menos_cargado", max_fallos=3, cuarentena=30.0,
+                 timeout_salud=2.0):
+        if estrategia not in ESTRATEGIAS:
+            raise ValueError(f"Estrategia desconocida: {estrategia} (opciones: {', '.join(ESTRATEGIAS)})")
+        urls = list(urls) or [None]
+        self.nodos = [NodoOllama(url, fabrica(url)) for url in urls]
+        self.estrategia = estrategia
+        self.max_fallos = max_fallos
+        self.cuarentena = cuarentena
+        self.timeout_salud = timeout_salud
+        self._turno = itertools.count()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.nodos)
+
+    def verificar_salud(self, nodo):
+        """GET /api/tags: el servidor está arriba y responde."""
+        try:
+            respuesta = httpx.get(f"{nodo.url}/api/tags", timeout=self.timeout_salud)
+            return respuesta.status_code == 200
+        except httpx.HTTPError:
+            return False
+
+    def _readmitir(self, nodo):
+        """Re-admite el nodo si pasa la verificación; si no, renueva su cuarentena."""
+        if self.verificar_salud(nodo):
+            nodo.fallos_consecutivos = 0
+            nodo.expulsado_hasta = 0.0
+        else:
+            nodo.expulsado_hasta = time.monotonic() + self.cuarentena
+        return nodo.en_rotacion
+
+    def verificar_todos(self):
+        """Verificación activa de todos los nodos (p. ej. desde un botón o un cron)."""
+        return [self._readmitir(nodo) for nodo in self.nodos]
+
+    def _pendientes_de_verificar(self):
+        with self._lock:
+            vencidos = [n for n in self.nodos if n.cuarentena_vencida()]
+            for nodo in vencidos:
+                nodo.verificando = True
+        return vencidos
+
+    def _revisar_cuarentenas(self, vencidos):
+        # Fuera del lock: la verificación es una petición HTTP
+        for nodo in vencidos:
+            try:
+                self._readmitir(nodo)
+            finally:
+                nodo.verificando = False
+
+    def _elegir(self, excluidos=()):
+        candidatos = [n for n in self.nodos if n not in excluidos and n.en_rotacion]
+        if not candidatos:
+            # Todos expulsados: se intenta el que antes sale de cuarentena
+            restantes = [n for n in self.nodos if n not in excluidos]
+            if not restantes:
+                return None
+            return min(restantes, key=lambda n: n.expulsado_hasta)
+        if self.estrategia == "round_robin":
+            return candidatos[next(self._turno) % len(candidatos)]
+        return min(candidatos, key=lambda n: n.en_vuelo)
+
+    def _registrar_fallo(self, nodo):
+        if nodo.en_rotacion and nodo.fallos_consecutivos >= self.max_fallos:
+            nodo.expulsado_hasta = time.monotonic() + self.cuarentena
+
+    def ejecutar(self, llamada):
+        """`llamada(cliente)` en el nodo elegido; reintenta en los demás si falla."""
+        self._revisar_cuarentenas(self._pendientes_de_verificar())
+        intentados = []
+        while True:
+            with self._lock:
+                nodo = self._elegir(intentados)
+                if nodo is None:
+                    raise error
+                nodo._iniciar()
+            inicio = time.perf_counter()
+            try:
+                resultado = llamada(nodo.cliente)
+            except Exception as e:
+                error = e
+                nodo._terminar(time.perf_counter() - inicio, e)
+                self._registrar_fallo(nodo)
+                intentados.append(nodo)
+                continue
+            nodo._terminar(time.perf_counter() - inicio)
+            return resultado
+
+    async def aejecutar(self, llamada):
+        """Versión async: `llamada(cliente)` retorna un awaitable. La cancelación no penaliza al nodo."""
+        vencidos = self._pendientes_de_verificar()
+        if vencidos:
+            await asyncio.to_thread(self._revisar_cuarentenas, vencidos)
+        intentados = []
+        while True:
+            with self._lock:
+                nodo = self._elegir(intentados)
+                if nodo is None:
+                    raise error
+                nodo._iniciar()
+            inicio = time.perf_counter()
+            try:
+                resultado = await llamada(nodo.cliente)
+            except Exception as e:
+                error = e
+                nodo._terminar(time.perf_counter() - inicio, e)
+                self._registrar_fallo(nodo)
+                intentados.append(nodo)
+                continue
+            except BaseException:
+                nodo._cancelar()
+                raise
+            nodo._terminar(time.perf_counter() - inicio)
+            return resultado
+
+    def estadisticas(self):
+        return [nodo.estadisticas() for nodo in self.nodos]
@@ -0,0 +1,222 @@
+"""
+MÓDULO: CACHE
+Responsabilidad: Persistir en disco resultados costosos de los modelos (Ollama).
+Evita repetir llamadas HTTP cuando la entrada no ha cambiado.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+
+class _CacheSQLite:
+    """
+    Tabla clave/valor en SQLite con expulsión LRU por número de entradas y
+    TTL opcional. Las subclases definen cómo serializar el valor.
+    Varios procesos pueden compartir el archivo (app, construir_indice,
+    auditoria_lote): el conteo local es sólo una estimación y se corrige con
+    COUNT(*) dentro de la transacción de escritura cada `intervalo_conteo` inserciones.
+    """
+    TABLA = None
+    # Columna donde versiones anteriores guardaban el valor (migración de esquema)
+    COLUMNA_ANTERIOR = None
+
+    def __init__(self, ruta, max_entradas, ttl_segundos=None):
+        self.ruta = ruta
+        self.max_entradas = max_entradas
+        self.ttl_segundos = ttl_segundos
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        carpeta = os.path.dirname(ruta)
+        if carpeta and not os.path.exists(carpeta):
+            os.makedirs(carpeta)
+
+        # Streamlit atiende cada sesión en un hilo distinto
+        self._conn = sqlite3.connect(ruta, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {self.TABLA} ("
+            " clave TEXT PRIMARY KEY, modelo TEXT, valor BLOB, acceso INTEGER, creado REAL)"
+        )
+        self._migrar()
+        self._conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{self.TABLA}_acceso ON {self.TABLA}(acceso)")
+        self._conn.commit()
+
+        self._total, self._reloj = 0, 0
+        self._recontar()
+        # Inserciones entre recuentos: ~1% del límite acota la deriva entre procesos
+        self.intervalo_conteo = max(1, max_entradas // 100)
+        self._sin_recontar = 0
+
+    def _recontar(self):
+        """Conteo real y reloj LRU al día con lo que escribieron otros procesos."""
+        total, reloj = self._conn.execute(
+            f"SELECT COUNT(*), COALESCE(MAX(acceso), 0) FROM {self.TABLA}"
+        ).fetchone()
+        self._total = total
+        self._reloj = max(self._reloj, reloj)
+        self._sin_recontar = 0
+
+    def _migrar(self):
+        """Lleva una tabla de una versión anterior al esquema actual sin perder entradas."""
+        columnas = {c[1] for c in self._conn.execute(f"PRAGMA table_info({self.TABLA})")}
+        if "valor" not in columnas:
+            self._conn.execute(f"ALTER TABLE {self.TABLA} ADD COLUMN valor BLOB")
+            if self.COLUMNA_ANTERIOR in columnas:
+                self._conn.execute(f"UPDATE {self.TABLA} SET valor = {self.COLUMNA_ANTERIOR}")
+        if "creado" not in columnas:
+            # Sin fecha de creación: el TTL de las entradas migradas corre desde hoy
+            self._conn.execute(f"ALTER TABLE {self.TABLA} ADD COLUMN creado REAL")
+            self._conn.execute(f"UPDATE {self.TABLA} SET creado = ?", (time.time(),))
+
+    def _serializar(self, valor):
+        raise NotImplementedError
+
+    def _deserializar(self, blob):
+        raise NotImplementedError
+
+    def _tick(self):
+        self._reloj += 1
+        return self._reloj
+
+    def _obtener(self, clave):
+        with self._lock:
+            fila = self._conn.execute(
+                f"SELECT valor, creado FROM {self.TABLA} WHERE clave = ?", (clave,)
+            ).fetchone()
+            if fila is not None and self.ttl_segundos is not None and time.time() - fila[1] > self.ttl_segundos:
+                self._conn.execute(f"DELETE FROM {self.TABLA} WHERE clave = ?", (clave,))
+                self._conn.commit()
+                self._total -= 1
+                fila = None
+            if fila is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute(
+                f"UPDATE {self.TABLA} SET acceso = ? WHERE clave = ?", (self._tick(), clave)
+            )
+            self._conn.commit()
+        return self._deserializar(fila[0])
+
+    def _guardar(self, clave, modelo, valor):
+        blob = self._serializar(valor)
+        with self._lock:
+            cur = self._conn.execute(
+                f"INSERT OR IGNORE INTO {self.TABLA} (clave, modelo, valor, acceso, creado) VALUES (?, ?, ?, ?, ?)",
+                (clave, modelo, blob, self._tick(), time.time()),
+            )
+            if cur.rowcount > 0:
+                self._total += 1
+                self._sin_recontar += 1
+            else:
+                self._conn.execute(
+                    f"UPDATE {self.TABLA} SET valor = ?, acceso = ?, creado = ? WHERE clave = ?",
+                    (blob, self._reloj, time.time(), clave),
+                )
+            if self._total > self.max_entradas or self._sin_recontar >= self.intervalo_conteo:
+                self._evictar()
+            self._conn.commit()
+
+    def _evictar(self):
+        """
+        Expulsa las entradas menos usadas recientemente (con 5% de holgura).
+        Corre dentro de la transacción del INSERT, que ya tiene el bloqueo de
+        escritura: el COUNT(*) incluye lo que agregaron otros procesos.
+        """
+        self._recontar()
+        if self._total <= self.max_entradas:
+            return
+        excedente = self._total - int(self.max_entradas * 0.95)
+        cur = self._conn.execute(
+            f"DELETE FROM {self.TABLA} WHERE clave IN ("
+            f" SELECT clave FROM {self.TABLA} ORDER BY acceso ASC LIMIT ?)",
+            (excedente,),
+        )
+        self._total -= cur.rowcount
+
+    def estadisticas(self):
+        with self._lock:
+            self._recontar()
+        consultas = self.hits + self.misses
+        return {
+            "entradas": self._total,
+            "hits": self.hits,
+            "misses": self.misses,
+            "tasa_hits": self.hits / consultas if consultas else 0.0,
+        }
+
+    def limpiar(self):
+        with self._lock:
+            self._conn.execute(f"DELETE FROM {self.TABLA}")
+            self._conn.commit()
+            self._total = 0
+
+
+class CacheEmbeddings(_CacheSQLite):
+    """
+    Cache direccionado por contenido: la clave es un hash de la secuencia de
+    tokens más el nombre del modelo de embeddings. Persiste entre reinicios
+    (SQLite) y expulsa por LRU cuando supera `max_entradas`.
+    """
+    TABLA = "embeddings"
+    COLUMNA_ANTERIOR = "vector"
+
+    def __init__(self, ruta="cache_comet/embeddings.sqlite", max_entradas=200_000):
+        super().__init__(ruta, max_entradas)
+
+    @staticmethod
+    def clave(secuencia, modelo):
+        return hashlib.sha256(f"{modelo}\x00{secuencia}".encode("utf-8")).hexdigest()
+
+    def _serializar(self, vector):
+        return np.asarray(vector, dtype=np.float32).tobytes()
+
+    def _deserializar(self, blob):
+        return np.frombuffer(blob, dtype=np.float32).tolist()
+
+    def obtener(self, secuencia, modelo):
+        """Retorna el vector cacheado o None si no existe."""
+        return self._obtener(self.clave(secuencia, modelo))
+
+    def guardar(self, secuencia, modelo, vector):
+        self._guardar(self.clave(secuencia, modelo), modelo, vector)
+
+
+class CachePredicciones(_CacheSQLite):
+    """
+    Memoiza las respuestas JSON del LLM. La clave combina ambas secuencias,
+    el modelo, la temperatura y la versión del prompt: cambiar cualquiera
+    invalida la entrada. Las entradas vencen tras `ttl_segundos`.
+    """
+    TABLA = "predicciones"
+
+    def __init__(self, ruta="cache_comet/predicciones.sqlite", max_entradas=50_000,
+                 ttl_segundos=7 * 24 * 3600):
+        super().__init__(ruta, max_entradas, ttl_segundos)
+
+    @staticmethod
+    def clave(secuencia_actual, secuencia_similar, modelo, temperatura, version_prompt):
+        partes = [secuencia_actual, secuencia_similar, modelo, repr(temperatura), str(version_prompt)]
+        return hashlib.sha256("\x00".join(partes).encode("utf-8")).hexdigest()
+
+    def _serializar(self, prediccion):
+        return json.dumps(prediccion, ensure_ascii=False)
+
+    def _deserializar(self, blob):
+        return json.loads(blob)
+
+    def obtener(self, secuencia_actual, secuencia_similar, modelo, temperatura, version_prompt):
+        return self._obtener(self.clave(secuencia_actual, secuencia_similar, modelo, temperatura, version_prompt))
+
+    def guardar(self, secuencia_actual, secuencia_similar, modelo, temperatura, version_prompt, prediccion):
+        self._guardar(
+            self.clave(secuencia_actual, secuencia_similar, modelo, temperatura, version_prompt),
+            modelo, prediccion,
+        )
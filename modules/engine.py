@@ -3,30 +3,215 @@ MÓDULO: ENGINE
 Responsabilidad: Interacción con Modelos de Lenguaje (LLM) y Vectores.
 Aísla la dependencia de Ollama/LangChain.
 """
+import asyncio
+import os
+import time
+import httpx
 import numpy as np
 from langchain_ollama import ChatOllama, OllamaEmbeddings
 from sklearn.metrics.pairwise import cosine_similarity
 from langchain_core.output_parsers import JsonOutputParser
+from modules.backend import PoolOllama
+from modules.metricas import registro
+
+# Subir cuando cambie el texto de _prompt_riesgo: invalida las predicciones cacheadas
+VERSION_PROMPT_RIESGO = 1
+
+
+def _endpoints_de_entorno(variable):
+    """Lista de URLs separadas por coma (p. ej. COMET_OLLAMA_LLM=http://gpu1:11434,http://gpu2:11434)."""
+    valor = os.environ.get(variable, "")
+    return [url.strip() for url in valor.split(",") if url.strip()] or [None]
 
 class CometEngine:
-    def __init__(self):
+    def __init__(self, cache_embeddings=None, indice=None, max_concurrencia=8, timeout=120.0,
+                 cache_predicciones=None, indice_lexico=None, endpoints_embeddings=None,
+                 endpoints_llm=None, estrategia="menos_cargado", metricas=None):
         # Inicialización de modelos
-        self.embeddings_model = OllamaEmbeddings(model="nomic-embed-text")
-        self.llm = ChatOllama(model="llama3.1", temperature=0.1, format="json")
+        # El cliente async (httpx) es único por modelo y endpoint y mantiene un
+        # pool de conexiones keep-alive del tamaño de la concurrencia permitida
+        pool = {"limits": httpx.Limits(max_connections=max_concurrencia,
+                                       max_keepalive_connections=max_concurrencia)}
+        sincrono = {"timeout": timeout}
+        # Endpoints de Ollama: argumento, variables de entorno o el servidor local por defecto
+        endpoints_embeddings = endpoints_embeddings or _endpoints_de_entorno("COMET_OLLAMA_EMBEDDINGS")
+        endpoints_llm = endpoints_llm or _endpoints_de_entorno("COMET_OLLAMA_LLM")
+        self.modelo_embeddings = "nomic-embed-text"
+        self.pool_embeddings = PoolOllama(endpoints_embeddings, lambda url: OllamaEmbeddings(
+            model=self.modelo_embeddings, base_url=url, client_kwargs=sincrono, async_client_kwargs=pool,
+        ), estrategia=estrategia)
+        self.modelo_llm = "llama3.1"
+        self.temperatura = 0.1
+        self.pool_llm = PoolOllama(endpoints_llm, lambda url: ChatOllama(
+            model=self.modelo_llm, temperature=self.temperatura, format="json", base_url=url,
+            client_kwargs=sincrono, async_client_kwargs=pool,
+        ), estrategia=estrategia)
         self.parser = JsonOutputParser()
+        # Límite de peticiones async en vuelo y timeout por petición (segundos)
+        self.max_concurrencia = max_concurrencia
+        self.timeout = timeout
+        self._semaforo = None
+        self._loop_semaforo = None
+        # Cache en disco opcional (modules.cache.CacheEmbeddings)
+        self.cache_embeddings = cache_embeddings
+        # Índice vecinos más cercanos opcional (modules.indice)
+        self.indice = indice
+        # Memoización opcional de respuestas del LLM (modules.cache.CachePredicciones)
+        self.cache_predicciones = cache_predicciones
+        # Pre-filtro BM25 opcional para búsqueda híbrida (modules.lexico.IndiceLexico)
+        self.indice_lexico = indice_lexico
+        # Latencias por etapa, tokens de Ollama y trazas (modules.metricas)
+        self.metricas = metricas if metricas is not None else registro
 
     def generar_embedding(self, texto):
-        return self.embeddings_model.embed_query(texto)
+        if self.cache_embeddings is not None:
+            vector = self.cache_embeddings.obtener(texto, self.modelo_embeddings)
+            if vector is not None:
+                return vector
+
+        with self.metricas.span("embedding", modelo=self.modelo_embeddings):
+            vector = self.pool_embeddings.ejecutar(lambda modelo: modelo.embed_query(texto))
+
+        if self.cache_embeddings is not None:
+            self.cache_embeddings.guardar(texto, self.modelo_embeddings, vector)
+        return vector
+
+    def estado_endpoints(self):
+        """Carga, errores y latencia (p50/p95) por endpoint de cada pool."""
+        return {"embeddings": self.pool_embeddings.estadisticas(), "llm": self.pool_llm.estadisticas()}
+
+    def _semaforo_async(self):
+        # asyncio.Semaphore queda ligado al event loop donde se usa
+        loop = asyncio.get_running_loop()
+        if self._loop_semaforo is not loop:
+            self._semaforo = asyncio.Semaphore(self.max_concurrencia)
+            self._loop_semaforo = loop
+        return self._semaforo
+
+    async def generar_embedding_async(self, texto, timeout=None):
+        """Versión async de generar_embedding; respeta el semáforo y el timeout."""
+        if self.cache_embeddings is not None:
+            vector = self.cache_embeddings.obtener(texto, self.modelo_embeddings)
+            if vector is not None:
+                return vector
+
+        # El timeout va dentro de la llamada al nodo: un nodo colgado cuenta como fallo
+        async with self._semaforo_async():
+            with self.metricas.span("embedding", modelo=self.modelo_embeddings):
+                vector = await self.pool_embeddings.aejecutar(
+                    lambda modelo: asyncio.wait_for(modelo.aembed_query(texto), timeout or self.timeout)
+                )
+
+        if self.cache_embeddings is not None:
+            self.cache_embeddings.guardar(texto, self.modelo_embeddings, vector)
+        return vector
+
+    async def generar_embeddings_async(self, secuencias, timeout=None, reintentos=2):
+        """
+        Vectoriza concurrentemente (hasta max_concurrencia en vuelo), conservando
+        el orden. Como en generar_embeddings_lote, sólo se reintenta lo que falla:
+        cada secuencia hasta `reintentos` veces.
+        """
+        async def con_reintentos(sec):
+            for intento in range(reintentos + 1):
+                try:
+                    return await self.generar_embedding_async(sec, timeout)
+                except Exception:
+                    if intento == reintentos:
+                        raise
+                    await asyncio.sleep(0.5 * 2 ** intento)
+
+        return await asyncio.gather(*(con_reintentos(sec) for sec in secuencias))
+
+    def generar_embeddings_lote(self, secuencias, tamano_lote=32, reintentos=2):
+        """
+        Vectoriza muchas secuencias con la llamada por lotes del backend
+        (embed_documents). Conserva el orden de entrada y sólo reintenta
+        los lotes que fallan.
+        """
+        secuencias = list(secuencias)
+        vectores = [None] * len(secuencias)
+
+        pendientes = []
+        for i, sec in enumerate(secuencias):
+            if self.cache_embeddings is not None:
+                vectores[i] = self.cache_embeddings.obtener(sec, self.modelo_embeddings)
+            if vectores[i] is None:
+                pendientes.append(i)
+
+        for inicio in range(0, len(pendientes), tamano_lote):
+            lote = pendientes[inicio:inicio + tamano_lote]
+            textos = [secuencias[i] for i in lote]
+
+            with self.metricas.span("embedding_lote", modelo=self.modelo_embeddings, secuencias=len(textos)):
+                for intento in range(reintentos + 1):
+                    try:
+                        resultado = self.pool_embeddings.ejecutar(lambda modelo: modelo.embed_documents(textos))
+                        break
+                    except Exception:
+                        if intento == reintentos:
+                            raise
+                        time.sleep(0.5 * 2 ** intento)
+
+            for i, vec in zip(lote, resultado):
+                vectores[i] = vec
+                if self.cache_embeddings is not None:
+                    self.cache_embeddings.guardar(secuencias[i], self.modelo_embeddings, vec)
+
+        return vectores
 
     def buscar_similitud(self, vector_query, lista_vectores):
         """Retorna índice y score del más similar."""
-        if not lista_vectores:
+        if len(lista_vectores) == 0:
             return -1, 0.0
         similitudes = cosine_similarity([vector_query], lista_vectores)[0]
         idx_max = np.argmax(similitudes)
         return idx_max, similitudes[idx_max]
 
-    def predecir_riesgo(self, secuencia_actual, secuencia_similar):
+    def buscar_similares(self, vector_query, k=5, indice=None):
+        """Top-k del índice (el propio del engine si no se pasa otro): [(id, score), ...]"""
+        indice = indice if indice is not None else self.indice
+        if indice is None or len(indice) == 0:
+            return []
+        with self.metricas.span("busqueda", k=k, vectores=len(indice)):
+            return indice.buscar(vector_query, k)
+
+    def buscar_hibrido(self, secuencia_query, k=5, n_candidatos=200, indice=None, indice_lexico=None):
+        """
+        BM25 sobre tokens selecciona candidatos que comparten códigos poco
+        frecuentes; sólo esos se puntúan con embeddings. Si no hay candidatos
+        léxicos se usa la búsqueda densa completa; si Ollama no responde se
+        devuelve el ranking léxico (scores BM25 normalizados al máximo).
+        Retorna (resultados, modo) con modo en {"hibrido", "denso", "lexico"}.
+        En modo "lexico" los scores sólo ordenan: no son similitudes coseno.
+        """
+        indice = indice if indice is not None else self.indice
+        indice_lexico = indice_lexico if indice_lexico is not None else self.indice_lexico
+
+        candidatos = []
+        if indice_lexico is not None:
+            with self.metricas.span("busqueda_lexica", n_candidatos=n_candidatos):
+                candidatos = indice_lexico.buscar(indice_lexico.tokens_de(secuencia_query), n_candidatos)
+
+        try:
+            vector_query = self.generar_embedding(secuencia_query)
+        except Exception:
+            if not candidatos:
+                raise
+            maximo = candidatos[0][1]
+            return [(id_pt, sc / maximo) for id_pt, sc in candidatos[:k]], "lexico"
+
+        if not candidatos or indice is None:
+            return self.buscar_similares(vector_query, k, indice), "denso"
+        with self.metricas.span("busqueda", k=k, candidatos=len(candidatos)):
+            return indice.puntuar(vector_query, [id_pt for id_pt, _ in candidatos], k), "hibrido"
+
+    def _prompt_riesgo(self, secuencia_actual, secuencia_similar):
+        # Admite una historia similar o varias (top-k)
+        if isinstance(secuencia_similar, (list, tuple)):
+            secuencia_similar = "\n".join(
+                f"[{i + 1}] {sec}" for i, sec in enumerate(secuencia_similar)
+            )
         prompt = f"""
         Eres CoMET-Col, experto en riesgo salud Colombia.
         
@@ -37,8 +222,66 @@ class CometEngine:
         Responde ÚNICAMENTE en JSON válido con este formato:
         {{ "riesgo": "ALTO/MEDIO/BAJO", "evento_futuro": "string", "costo_tendencia": "string", "explicacion": "string" }}
         """
-        try:
-            res = self.llm.invoke(prompt)
-            return self.parser.parse(res.content)
-        except Exception as e:
-            return {"riesgo": "ERROR", "explicacion": str(e)}
\ No newline at end of file
+        return prompt
+
+    def _prediccion_cacheada(self, secuencia_actual, secuencia_similar):
+        if self.cache_predicciones is None:
+            return None
+        return self.cache_predicciones.obtener(
+            secuencia_actual, str(secuencia_similar), self.modelo_llm, self.temperatura, VERSION_PROMPT_RIESGO
+        )
+
+    def _cachear_prediccion(self, secuencia_actual, secuencia_similar, prediccion):
+        # Los errores (timeouts, JSON inválido) no se memoizan
+        if self.cache_predicciones is None or prediccion.get("riesgo") == "ERROR":
+            return
+        self.cache_predicciones.guardar(
+            secuencia_actual, str(secuencia_similar), self.modelo_llm, self.temperatura,
+            VERSION_PROMPT_RIESGO, prediccion,
+        )
+
+    def predecir_riesgo(self, secuencia_actual, secuencia_similar, usar_cache=True):
+        """`usar_cache=False` fuerza una nueva inferencia (y actualiza el cache)."""
+        if usar_cache:
+            prediccion = self._prediccion_cacheada(secuencia_actual, secuencia_similar)
+            if prediccion is not None:
+                return prediccion
+
+        prompt = self._prompt_riesgo(secuencia_actual, secuencia_similar)
+        with self.metricas.span("inferencia_llm", modelo=self.modelo_llm) as span:
+            try:
+                res = self.pool_llm.ejecutar(lambda modelo: modelo.invoke(prompt))
+                self.metricas.registrar_llm(res.response_metadata, span)
+                prediccion = self.parser.parse(res.content)
+            except Exception as e:
+                span.estado = "error"
+                return {"riesgo": "ERROR", "explicacion": str(e)}
+
+        self._cachear_prediccion(secuencia_actual, secuencia_similar, prediccion)
+        return prediccion
+
+    async def predecir_riesgo_async(self, secuencia_actual, secuencia_similar, timeout=None, usar_cache=True):
+        """Versión async de predecir_riesgo. La cancelación se propaga; el timeout se reporta como ERROR."""
+        if usar_cache:
+            prediccion = self._prediccion_cacheada(secuencia_actual, secuencia_similar)
+            if prediccion is not None:
+                return prediccion
+
+        prompt = self._prompt_riesgo(secuencia_actual, secuencia_similar)
+        async with self._semaforo_async():
+            with self.metricas.span("inferencia_llm", modelo=self.modelo_llm) as span:
+                try:
+                    res = await self.pool_llm.aejecutar(
+                        lambda modelo: asyncio.wait_for(modelo.ainvoke(prompt), timeout or self.timeout)
+                    )
+                    self.metricas.registrar_llm(res.response_metadata, span)
+                    prediccion = self.parser.parse(res.content)
+                except asyncio.TimeoutError:
+                    span.estado = "error"
+                    return {"riesgo": "ERROR", "explicacion": f"Timeout consultando el LLM ({timeout or self.timeout}s)"}
+                except Exception as e:
+                    span.estado = "error"
+                    return {"riesgo": "ERROR", "explicacion": str(e)}
+
+        self._cachear_prediccion(secuencia_actual, secuencia_similar, prediccion)
+        return prediccion
\ No newline at end of file
@@ -0,0 +1,148 @@
+"""
+MÓDULO: INDEXACIÓN
+Responsabilidad: Construir offline el índice vectorial del histórico (Tuva).
+Tokeniza y vectoriza una sola vez; la app sólo consume el snapshot resultante.
+Las re-indexaciones sólo procesan los pacientes agregados o modificados.
+"""
+import hashlib
+import json
+
+from modules.snapshot import SnapshotIndice, version_vigente
+
+
+def huella_paciente(paciente):
+    """Hash del registro crudo: cambia si cambia cualquier evento o dato del perfil."""
+    canonico = json.dumps(paciente, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha1(canonico.encode("utf-8")).hexdigest()
+
+
+class DeltaHistorico:
+    """Diferencia entre el histórico actual y el snapshot previo."""
+    def __init__(self):
+        self.agregados = []
+        self.modificados = []
+        self.eliminados = []
+        self.sin_cambios = 0
+
+    @property
+    def procesados(self):
+        return len(self.agregados) + len(self.modificados)
+
+    def resumen(self):
+        return (f"+{len(self.agregados)} nuevos, ~{len(self.modificados)} modificados, "
+                f"-{len(self.eliminados)} eliminados, ={self.sin_cambios} sin cambios")
+
+    def como_dict(self):
+        return {"agregados": self.agregados, "modificados": self.modificados,
+                "eliminados": self.eliminados, "sin_cambios": self.sin_cambios}
+
+    @classmethod
+    def desde_dict(cls, datos):
+        delta = cls()
+        delta.agregados = list(datos["agregados"])
+        delta.modificados = list(datos["modificados"])
+        delta.eliminados = list(datos["eliminados"])
+        delta.sin_cambios = datos.get("sin_cambios", 0)
+        return delta
+
+
+def actualizar_snapshot(previo, repo, tokenizador, engine, tamano_lote=32, progreso=None, filtros=None):
+    """
+    Genera un snapshot nuevo reutilizando del `previo` la secuencia y el vector
+    de cada paciente cuya huella no cambió. Si el previo no existe o fue
+    generado con otro modelo u ontología, se re-procesa todo.
+    Consume el histórico en streaming: el primer lote se vectoriza
+    mientras el resto del archivo aún no se ha leído.
+    `filtros` se pasa a repo.iterar_historico (sólo TuvaRepositoryParquet).
+    Retorna (snapshot, delta).
+    """
+    if previo is not None and not previo.es_compatible(engine.modelo_embeddings, tokenizador.maestro.version):
+        previo = None
+
+    delta = DeltaHistorico()
+    ids, secuencias, huellas, vectores = [], [], [], []
+    pendientes = []
+
+    def vaciar_pendientes():
+        nuevos = engine.generar_embeddings_lote([secuencias[i] for i in pendientes], tamano_lote)
+        for i, vec in zip(pendientes, nuevos):
+            vectores[i] = vec
+        pendientes.clear()
+        if progreso:
+            progreso(len(ids))
+
+    for pt in repo.iterar_historico(**(filtros or {})):
+        huella = huella_paciente(pt)
+        pos = previo.posicion(pt['id']) if previo is not None else None
+
+        ids.append(pt['id'])
+        huellas.append(huella)
+        if pos is not None and previo.huellas[pos] == huella:
+            secuencias.append(previo.secuencias[pos])
+            vectores.append(previo.vectores[pos])
+            delta.sin_cambios += 1
+            continue
+
+        (delta.agregados if pos is None else delta.modificados).append(pt['id'])
+        secuencias.append(tokenizador.construir_secuencia(pt))
+        vectores.append(None)
+        pendientes.append(len(ids) - 1)
+        if len(pendientes) == tamano_lote:
+            vaciar_pendientes()
+    if pendientes:
+        vaciar_pendientes()
+
+    if previo is not None:
+        vistos = set(ids)
+        delta.eliminados = [id_pt for id_pt in previo.ids if id_pt not in vistos]
+
+    snapshot = SnapshotIndice(
+        ids, secuencias, vectores,
+        modelo_embeddings=engine.modelo_embeddings,
+        version_ontologia=tokenizador.maestro.version,
+        huellas=huellas,
+        base=previo.version if previo is not None else None,
+        delta=delta.como_dict() if previo is not None else None,
+    )
+    return snapshot, delta
+
+
+def construir_snapshot(repo, tokenizador, engine, tamano_lote=32, progreso=None, filtros=None):
+    """Tokeniza y vectoriza (por lotes) todo el histórico del repositorio."""
+    snapshot, _ = actualizar_snapshot(None, repo, tokenizador, engine, tamano_lote, progreso, filtros)
+    return snapshot
+
+
+def aplicar_delta(indice, snapshot, delta, indice_lexico=None):
+    """Actualiza en sitio un IndiceVectorial ya cargado con el resultado de actualizar_snapshot."""
+    for id_pt in delta.eliminados:
+        if id_pt in indice:
+            indice.eliminar(id_pt)
+        if indice_lexico is not None and id_pt in indice_lexico:
+            indice_lexico.eliminar(id_pt)
+    cambiados = delta.agregados + delta.modificados
+    if cambiados:
+        indice.agregar(cambiados, [snapshot.vector_de(id_pt) for id_pt in cambiados])
+    if indice_lexico is not None:
+        for id_pt in cambiados:
+            indice_lexico.agregar(id_pt, indice_lexico.tokens_de(snapshot.secuencia_de(id_pt)))
+
+
+def sincronizar_indice(snapshot, indice, carpeta, indice_lexico=None):
+    """
+    Pone al día un índice cargado desde `snapshot` si en `carpeta` se publicó
+    una versión nueva: si se derivó del snapshot cargado (construir_indice.py
+    incremental) aplica sólo su delta en sitio. Retorna el snapshot vigente, o
+    None si la versión nueva exige recargar todo (reconstrucción completa,
+    otro modelo u ontología).
+    """
+    vigente = version_vigente(carpeta)
+    if vigente is None or vigente == snapshot.version:
+        return snapshot
+    nuevo = SnapshotIndice.cargar(carpeta)
+    # `base` es el directorio de versión del que se derivó: único aunque dos
+    # publicaciones caigan en el mismo segundo (a diferencia de `creado`)
+    if nuevo is None or nuevo.delta is None or nuevo.base is None or nuevo.base != snapshot.version:
+        return None
+    aplicar_delta(indice, nuevo, DeltaHistorico.desde_dict(nuevo.delta), indice_lexico)
+    return nuevo
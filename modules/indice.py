@@ -0,0 +1,575 @@
+"""
+MÓDULO: ÍNDICE
+Responsabilidad: Búsqueda de vecinos más cercanos (top-k) sobre trayectorias vectorizadas.
+Implementaciones intercambiables: exacta, IVF (listas invertidas), HNSW (hnswlib opcional)
+y cuantizada (int8 / producto) con re-ranking exacto.
+"""
+import numpy as np
+
+
+def normalizar_l2(matriz):
+    matriz = np.asarray(matriz, dtype=np.float32)
+    if matriz.ndim == 1:
+        matriz = matriz.reshape(1, -1)
+    normas = np.linalg.norm(matriz, axis=1, keepdims=True)
+    normas[normas == 0] = 1.0
+    return matriz / normas
+
+
+def _top_k(scores, k):
+    """Índices de los k mayores scores, ordenados de mayor a menor."""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    idx = np.argpartition(-scores, k - 1)[:k]
+    return idx[np.argsort(-scores[idx])]
+
+
+class _BloqueVectores:
+    """
+    Matriz contigua float32 (normalizada) que crece por duplicación.
+    Puede envolver un memmap de sólo lectura/copy-on-write sin copiarlo;
+    se copia a memoria privada sólo cuando hay que ampliarlo.
+    Con otro `dtype` guarda códigos cuantizados (IndiceCuantizado).
+    """
+    def __init__(self, dimension, matriz=None, ids=None, dtype=np.float32):
+        if matriz is None:
+            matriz = np.empty((16, dimension), dtype=dtype)
+        self.matriz = matriz
+        self.ids = list(ids) if ids is not None else []
+
+    def __len__(self):
+        return len(self.ids)
+
+    def agregar(self, ids, vectores):
+        n, nuevos = len(self.ids), len(ids)
+        if n + nuevos > len(self.matriz):
+            capacidad = max(n + nuevos, 2 * len(self.matriz))
+            ampliada = np.empty((capacidad, self.matriz.shape[1]), dtype=self.matriz.dtype)
+            ampliada[:n] = self.matriz[:n]
+            self.matriz = ampliada
+        self.matriz[n:n + nuevos] = vectores
+        self.ids.extend(ids)
+        return n
+
+    def eliminar(self, fila):
+        """Borra por intercambio con la última fila. Retorna el id que cambió de fila."""
+        ultima = len(self.ids) - 1
+        movido = None
+        if fila != ultima:
+            self.matriz[fila] = self.matriz[ultima]
+            self.ids[fila] = self.ids[ultima]
+            movido = self.ids[fila]
+        self.ids.pop()
+        return movido
+
+    def puntuar(self, q):
+        return self.matriz[:len(self.ids)] @ q
+
+
+class IndiceVectorial:
+    """Contrato común de los índices: similitud coseno, ids de paciente como llave."""
+    def agregar(self, ids, vectores):
+        raise NotImplementedError
+
+    def eliminar(self, id_paciente):
+        raise NotImplementedError
+
+    def buscar(self, vector, k=5):
+        """Retorna [(id_paciente, score), ...] ordenado por similitud descendente."""
+        raise NotImplementedError
+
+    def puntuar(self, vector, ids, k=None):
+        """Como buscar, pero sólo sobre los `ids` dados (re-ranking de candidatos)."""
+        ids = [id_pt for id_pt in ids if id_pt in self]
+        if not ids:
+            return []
+        scores = self._vectores_de(ids) @ normalizar_l2(vector)[0]
+        return [(ids[i], float(scores[i])) for i in _top_k(scores, k or len(ids))]
+
+    def _vectores_de(self, ids):
+        raise NotImplementedError
+
+    def __len__(self):
+        raise NotImplementedError
+
+    def __contains__(self, id_paciente):
+        raise NotImplementedError
+
+
+class IndiceExacto(IndiceVectorial):
+    """Fuerza bruta: un único producto matriz-vector. Recall perfecto."""
+    def __init__(self):
+        self._bloque = None
+        self._pos = {}
+
+    @classmethod
+    def desde_matriz(cls, ids, matriz):
+        """
+        Envuelve una matriz float32 ya normalizada (p. ej. el memmap de un
+        SnapshotIndice) sin copiarla: varios procesos que abren el mismo
+        archivo comparten las mismas páginas físicas.
+        """
+        indice = cls()
+        indice._bloque = _BloqueVectores(matriz.shape[1], matriz=matriz, ids=ids)
+        indice._pos = {id_pt: i for i, id_pt in enumerate(indice._bloque.ids)}
+        return indice
+
+    def __len__(self):
+        return len(self._pos)
+
+    def __contains__(self, id_paciente):
+        return id_paciente in self._pos
+
+    def agregar(self, ids, vectores):
+        ids = list(ids)
+        for id_paciente in ids:
+            if id_paciente in self._pos:
+                self.eliminar(id_paciente)
+        vectores = normalizar_l2(vectores)
+        if self._bloque is None:
+            self._bloque = _BloqueVectores(vectores.shape[1])
+        inicio = self._bloque.agregar(ids, vectores)
+        for i, id_paciente in enumerate(ids):
+            self._pos[id_paciente] = inicio + i
+
+    def eliminar(self, id_paciente):
+        fila = self._pos.pop(id_paciente)
+        movido = self._bloque.eliminar(fila)
+        if movido is not None:
+            self._pos[movido] = fila
+
+    def _vectores_de(self, ids):
+        return self._bloque.matriz[[self._pos[id_pt] for id_pt in ids]]
+
+    def buscar(self, vector, k=5):
+        if not self._pos:
+            return []
+        scores = self._bloque.puntuar(normalizar_l2(vector)[0])
+        return [(self._bloque.ids[i], float(scores[i])) for i in _top_k(scores, k)]
+
+
+def centroides_ivf(vectores, n_listas, iteraciones=20, semilla=0):
+    """k-means esférico (vectores normalizados) sobre una muestra de a lo sumo n_listas * 256 filas."""
+    rng = np.random.default_rng(semilla)
+    muestra = vectores
+    if len(vectores) > n_listas * 256:
+        muestra = vectores[np.sort(rng.choice(len(vectores), n_listas * 256, replace=False))]
+    muestra = np.asarray(muestra, dtype=np.float32)
+    centroides = muestra[rng.choice(len(muestra), n_listas, replace=False)].copy()
+
+    for _ in range(iteraciones):
+        asignacion = np.argmax(muestra @ centroides.T, axis=1)
+        for c in range(n_listas):
+            miembros = muestra[asignacion == c]
+            if len(miembros):
+                centroides[c] = miembros.sum(axis=0)
+        centroides = normalizar_l2(centroides)
+    return centroides
+
+
+def asignar_listas(vectores, centroides, tamano_bloque=65536):
+    """Lista (centroide más cercano) de cada fila, por bloques para no duplicar un memmap grande."""
+    asignacion = np.empty(len(vectores), dtype=np.int64)
+    for inicio in range(0, len(vectores), tamano_bloque):
+        bloque = vectores[inicio:inicio + tamano_bloque]
+        asignacion[inicio:inicio + len(bloque)] = np.argmax(bloque @ centroides.T, axis=1)
+    return asignacion
+
+
+class IndiceIVF(IndiceVectorial):
+    """
+    Listas invertidas (IVF): k-means agrupa los vectores en `n_listas`; cada
+    consulta sólo puntúa las `n_sondas` listas con centroide más cercano.
+    Más sondas = más recall y más latencia. Hasta tener datos suficientes
+    para entrenar (n_listas * 39) se comporta como búsqueda exacta.
+    """
+    def __init__(self, n_listas=256, n_sondas=16, iteraciones=20, semilla=0):
+        self.n_listas = n_listas
+        self.n_sondas = n_sondas
+        self.iteraciones = iteraciones
+        self.semilla = semilla
+        self.centroides = None
+        self._listas = []
+        self._pos = {}
+
+    def __len__(self):
+        return len(self._pos)
+
+    def __contains__(self, id_paciente):
+        return id_paciente in self._pos
+
+    @classmethod
+    def desde_listas(cls, ids, matriz, centroides, limites, **parametros):
+        """
+        IVF ya entrenado sobre una matriz agrupada por lista (filas de la lista
+        c en matriz[limites[c]:limites[c + 1]]), como la persiste SnapshotIndice.
+        Cada lista es una vista del memmap: sin copia ni k-means al arrancar.
+        """
+        indice = cls(n_listas=len(centroides), **parametros)
+        indice.centroides = np.asarray(centroides, dtype=np.float32)
+        ids = list(ids)
+        for c in range(len(centroides)):
+            inicio, fin = int(limites[c]), int(limites[c + 1])
+            # Una lista vacía recibe su propio bloque al primer agregar
+            vista = matriz[inicio:fin] if fin > inicio else None
+            indice._listas.append(_BloqueVectores(matriz.shape[1], matriz=vista, ids=ids[inicio:fin]))
+            for fila, id_paciente in enumerate(ids[inicio:fin]):
+                indice._pos[id_paciente] = (c, fila)
+        return indice
+
+    @property
+    def entrenado(self):
+        return self.centroides is not None
+
+    def _asignar(self, vectores):
+        if not self.entrenado:
+            return np.zeros(len(vectores), dtype=np.int64)
+        return np.argmax(vectores @ self.centroides.T, axis=1)
+
+    def _agregar_normalizados(self, ids, vectores):
+        if not self._listas:
+            self._listas = [_BloqueVectores(vectores.shape[1])]
+        asignacion = self._asignar(vectores)
+        for lista in np.unique(asignacion):
+            filas = np.flatnonzero(asignacion == lista)
+            ids_lista = [ids[f] for f in filas]
+            inicio = self._listas[lista].agregar(ids_lista, vectores[filas])
+            for i, id_paciente in enumerate(ids_lista):
+                self._pos[id_paciente] = (int(lista), inicio + i)
+
+    def agregar(self, ids, vectores):
+        ids = list(ids)
+        for id_paciente in ids:
+            if id_paciente in self._pos:
+                self.eliminar(id_paciente)
+        self._agregar_normalizados(ids, normalizar_l2(vectores))
+        if not self.entrenado and len(self._pos) >= self.n_listas * 39:
+            self.entrenar()
+
+    def eliminar(self, id_paciente):
+        lista, fila = self._pos.pop(id_paciente)
+        movido = self._listas[lista].eliminar(fila)
+        if movido is not None:
+            self._pos[movido] = (lista, fila)
+
+    def _vectores_de(self, ids):
+        return np.stack([self._listas[lista].matriz[fila] for lista, fila in (self._pos[i] for i in ids)])
+
+    def entrenar(self):
+        """k-means esférico sobre los vectores actuales y redistribución en listas."""
+        ids, vectores = [], []
+        for bloque in self._listas:
+            ids.extend(bloque.ids)
+            vectores.append(bloque.matriz[:len(bloque)])
+        vectores = np.vstack(vectores)
+
+        self.centroides = centroides_ivf(vectores, self.n_listas, self.iteraciones, self.semilla)
+        self._listas = [_BloqueVectores(vectores.shape[1]) for _ in range(self.n_listas)]
+        self._pos = {}
+        self._agregar_normalizados(ids, vectores)
+
+    def buscar(self, vector, k=5):
+        if not self._pos:
+            return []
+        q = normalizar_l2(vector)[0]
+        if self.entrenado:
+            sondas = _top_k(self.centroides @ q, self.n_sondas)
+        else:
+            sondas = [0]
+
+        ids, scores = [], []
+        for lista in sondas:
+            bloque = self._listas[lista]
+            if len(bloque):
+                ids.extend(bloque.ids)
+                scores.append(bloque.puntuar(q))
+        if not ids:
+            return []
+        scores = np.concatenate(scores)
+        return [(ids[i], float(scores[i])) for i in _top_k(scores, k)]
+
+
+class IndiceHNSW(IndiceVectorial):
+    """
+    Grafo HNSW vía hnswlib (dependencia opcional: pip install hnswlib).
+    `ef_busqueda` controla el compromiso recall/latencia en consulta.
+    """
+    def __init__(self, dimension, max_elementos=100_000, M=16, ef_construccion=200, ef_busqueda=64):
+        try:
+            import hnswlib
+        except ImportError as e:
+            raise ImportError("IndiceHNSW requiere 'hnswlib' (pip install hnswlib)") from e
+
+        self._indice = hnswlib.Index(space="cosine", dim=dimension)
+        self._indice.init_index(max_elements=max_elementos, ef_construction=ef_construccion,
+                                M=M, allow_replace_deleted=True)
+        self._indice.set_ef(ef_busqueda)
+        self._etiqueta = {}
+        self._id_de = {}
+        self._siguiente = 0
+
+    @property
+    def ef_busqueda(self):
+        return self._indice.ef
+
+    @ef_busqueda.setter
+    def ef_busqueda(self, valor):
+        self._indice.set_ef(valor)
+
+    def __len__(self):
+        return len(self._etiqueta)
+
+    def __contains__(self, id_paciente):
+        return id_paciente in self._etiqueta
+
+    def agregar(self, ids, vectores):
+        ids = list(ids)
+        for id_paciente in ids:
+            if id_paciente in self._etiqueta:
+                self.eliminar(id_paciente)
+        requerido = len(self._etiqueta) + len(ids)
+        if requerido > self._indice.get_max_elements():
+            self._indice.resize_index(max(requerido, 2 * self._indice.get_max_elements()))
+
+        etiquetas = np.arange(self._siguiente, self._siguiente + len(ids))
+        self._siguiente += len(ids)
+        for id_paciente, etiqueta in zip(ids, etiquetas):
+            self._etiqueta[id_paciente] = int(etiqueta)
+            self._id_de[int(etiqueta)] = id_paciente
+        self._indice.add_items(normalizar_l2(vectores), etiquetas, replace_deleted=True)
+
+    def eliminar(self, id_paciente):
+        etiqueta = self._etiqueta.pop(id_paciente)
+        del self._id_de[etiqueta]
+        self._indice.mark_deleted(etiqueta)
+
+    def _vectores_de(self, ids):
+        return normalizar_l2(self._indice.get_items([self._etiqueta[i] for i in ids]))
+
+    def buscar(self, vector, k=5):
+        k = min(k, len(self._etiqueta))
+        if k == 0:
+            return []
+        etiquetas, distancias = self._indice.knn_query(normalizar_l2(vector), k=k)
+        return [(self._id_de[int(e)], float(1.0 - d)) for e, d in zip(etiquetas[0], distancias[0])]
+
+
+def _kmeans(muestra, n_centroides, iteraciones, rng):
+    """k-means euclídeo (Lloyd) para los sub-espacios de la cuantización por producto."""
+    centroides = muestra[rng.choice(len(muestra), n_centroides, replace=False)].copy()
+    for _ in range(iteraciones):
+        distancias = (centroides ** 2).sum(axis=1)[None, :] - 2 * muestra @ centroides.T
+        asignacion = np.argmin(distancias, axis=1)
+        sumas = np.zeros_like(centroides)
+        np.add.at(sumas, asignacion, muestra)
+        conteo = np.bincount(asignacion, minlength=n_centroides)
+        # Los centroides sin miembros conservan su posición
+        ocupados = conteo > 0
+        centroides[ocupados] = sumas[ocupados] / conteo[ocupados, None]
+    return centroides
+
+
+class IndiceCuantizado(IndiceVectorial):
+    """
+    Códigos compactos en RAM y vectores float32 en disco (p. ej. el memmap de
+    un SnapshotIndice) sólo para re-ordenar. Cada consulta puntúa todos los
+    códigos, toma los `n_reranking` mejores y los re-puntúa con precisión
+    completa; sólo se leen del disco esas filas.
+    - 'int8': un byte por dimensión con escala por dimensión (4x menos RAM).
+    - 'pq': cuantización por producto, `m` sub-vectores de 256 centroides
+      (4 * dimension / m veces menos RAM; por defecto m = dimension / 4, 16x).
+    """
+    MODOS = ("int8", "pq")
+    _FILAS_POR_TRAMO = 16_384  # Acota la memoria temporal al puntuar códigos
+
+    def __init__(self, modo="int8", m=None, n_reranking=50, iteraciones=10, semilla=0):
+        if modo not in self.MODOS:
+            raise ValueError(f"Modo de cuantización desconocido: {modo}")
+        self.modo = modo
+        self.m = m
+        self.n_reranking = n_reranking
+        self.iteraciones = iteraciones
+        self.semilla = semilla
+        self.escala = None
+        self.libros = None
+        self._codigos = None
+        self._pos = {}
+        # Precisión completa: filas de una matriz externa (memmap) o vectores agregados después
+        self._completos = None
+        self._fila_completa = {}
+        self._extra = {}
+
+    @classmethod
+    def desde_matriz(cls, ids, matriz, **parametros):
+        """
+        Codifica una matriz float32 ya normalizada por tramos y la conserva
+        como referencia de precisión completa sin copiarla.
+        """
+        indice = cls(**parametros)
+        ids = list(ids)
+        indice.entrenar(matriz)
+        indice._completos = matriz
+        indice._fila_completa = {id_pt: i for i, id_pt in enumerate(ids)}
+        for inicio in range(0, len(ids), cls._FILAS_POR_TRAMO):
+            fin = inicio + cls._FILAS_POR_TRAMO
+            indice._agregar_codigos(ids[inicio:fin], np.asarray(matriz[inicio:fin], dtype=np.float32))
+        return indice
+
+    @property
+    def entrenado(self):
+        return self.escala is not None or self.libros is not None
+
+    def bytes_por_vector(self):
+        return self._codigos.matriz.shape[1] * self._codigos.matriz.itemsize if self._codigos else 0
+
+    def __len__(self):
+        return len(self._pos)
+
+    def __contains__(self, id_paciente):
+        return id_paciente in self._pos
+
+    def entrenar(self, vectores, tamano_muestra=None):
+        """Escala por dimensión (int8) o libros de códigos por sub-espacio (pq)."""
+        rng = np.random.default_rng(self.semilla)
+        # k-means de 256 centroides por sub-espacio converge con ~32 puntos por centroide
+        tamano_muestra = tamano_muestra or (65_536 if self.modo == "int8" else 256 * 32)
+        if len(vectores) > tamano_muestra:
+            muestra = np.asarray(vectores[np.sort(rng.choice(len(vectores), tamano_muestra, replace=False))])
+        else:
+            muestra = np.asarray(vectores)
+        muestra = normalizar_l2(muestra)
+        dimension = muestra.shape[1]
+
+        if self.modo == "int8":
+            maximo = np.abs(muestra).max(axis=0)
+            maximo[maximo == 0] = 1.0
+            self.escala = (maximo / 127.0).astype(np.float32)
+            return
+
+        if self.m is None:
+            self.m = max(d for d in range(1, dimension // 4 + 1) if dimension % d == 0)
+        if dimension % self.m:
+            raise ValueError(f"m={self.m} debe dividir la dimensión {dimension}")
+        ancho = dimension // self.m
+        n_centroides = min(256, len(muestra))
+        self.libros = np.stack([
+            _kmeans(muestra[:, j * ancho:(j + 1) * ancho], n_centroides, self.iteraciones, rng)
+            for j in range(self.m)
+        ])
+
+    def _codificar(self, vectores):
+        if self.modo == "int8":
+            return np.clip(np.rint(vectores / self.escala), -127, 127).astype(np.int8)
+        ancho = self.libros.shape[2]
+        codigos = np.empty((len(vectores), self.m), dtype=np.uint8)
+        for j, libro in enumerate(self.libros):
+            sub = vectores[:, j * ancho:(j + 1) * ancho]
+            distancias = (libro ** 2).sum(axis=1)[None, :] - 2 * sub @ libro.T
+            codigos[:, j] = np.argmin(distancias, axis=1)
+        return codigos
+
+    def _agregar_codigos(self, ids, vectores):
+        codigos = self._codificar(vectores)
+        if self._codigos is None:
+            self._codigos = _BloqueVectores(codigos.shape[1], dtype=codigos.dtype)
+        inicio = self._codigos.agregar(ids, codigos)
+        for i, id_paciente in enumerate(ids):
+            self._pos[id_paciente] = inicio + i
+
+    def agregar(self, ids, vectores):
+        ids = list(ids)
+        for id_paciente in ids:
+            if id_paciente in self._pos:
+                self.eliminar(id_paciente)
+        vectores = normalizar_l2(vectores)
+        if not self.entrenado:
+            self.entrenar(vectores)
+        # Los agregados en caliente no están en el archivo: su float32 queda en memoria
+        for id_paciente, vector in zip(ids, vectores):
+            self._extra[id_paciente] = vector
+        self._agregar_codigos(ids, vectores)
+
+    def eliminar(self, id_paciente):
+        fila = self._pos.pop(id_paciente)
+        self._extra.pop(id_paciente, None)
+        self._fila_completa.pop(id_paciente, None)
+        movido = self._codigos.eliminar(fila)
+        if movido is not None:
+            self._pos[movido] = fila
+
+    def _vectores_de(self, ids):
+        return np.stack([
+            self._extra[i] if i in self._extra else self._completos[self._fila_completa[i]]
+            for i in ids
+        ]).astype(np.float32)
+
+    def _scores_aproximados(self, q):
+        codigos = self._codigos.matriz[:len(self._codigos)]
+        scores = np.empty(len(codigos), dtype=np.float32)
+        if self.modo == "int8":
+            q_escalado = q * self.escala
+            for inicio in range(0, len(codigos), self._FILAS_POR_TRAMO):
+                tramo = codigos[inicio:inicio + self._FILAS_POR_TRAMO]
+                scores[inicio:inicio + len(tramo)] = tramo.astype(np.float32) @ q_escalado
+            return scores
+        # Distancia asimétrica: tabla (m x 256) de productos q_j · centroide
+        ancho = self.libros.shape[2]
+        tabla = np.einsum("jcd,jd->jc", self.libros, q.reshape(self.m, ancho))
+        columnas = np.arange(self.m)
+        for inicio in range(0, len(codigos), self._FILAS_POR_TRAMO):
+            tramo = codigos[inicio:inicio + self._FILAS_POR_TRAMO]
+            scores[inicio:inicio + len(tramo)] = tabla[columnas, tramo].sum(axis=1)
+        return scores
+
+    def buscar(self, vector, k=5):
+        if not self._pos:
+            return []
+        q = normalizar_l2(vector)[0]
+        candidatos = _top_k(self._scores_aproximados(q), max(k, self.n_reranking))
+        ids = [self._codigos.ids[i] for i in candidatos]
+        # Re-ranking exacto: sólo se leen del disco las filas candidatas
+        scores = self._vectores_de(ids) @ q
+        return [(ids[i], float(scores[i])) for i in _top_k(scores, k)]
+
+
+def medir_perdida(aproximado, ids, matriz, k=3, n_consultas=200, semilla=0):
+    """
+    Compara `aproximado` contra la búsqueda exacta usando vectores del propio
+    histórico como consultas (se excluye al paciente consultado).
+    Retorna recall@k, acierto del top-1 (el match que recibe predecir_riesgo)
+    y la pérdida máxima de similitud del top-1.
+    """
+    ids = list(ids)
+    exacto = IndiceExacto.desde_matriz(ids, normalizar_l2(matriz))
+    rng = np.random.default_rng(semilla)
+    filas = rng.choice(len(ids), min(n_consultas, len(ids)), replace=False)
+    recall, top1, perdida = [], [], []
+    for fila in filas:
+        q = np.asarray(matriz[fila], dtype=np.float32)
+        real = [r for r in exacto.buscar(q, k + 1) if r[0] != ids[fila]][:k]
+        aprox = [r for r in aproximado.buscar(q, k + 1) if r[0] != ids[fila]][:k]
+        if not real:
+            continue
+        recall.append(len({r[0] for r in real} & {r[0] for r in aprox}) / len(real))
+        top1.append(bool(aprox) and aprox[0][0] == real[0][0])
+        perdida.append(real[0][1] - (aprox[0][1] if aprox else 0.0))
+    return {
+        "consultas": len(recall),
+        "recall_k": float(np.mean(recall)) if recall else 1.0,
+        "top1": float(np.mean(top1)) if top1 else 1.0,
+        "perdida_max_top1": float(np.max(perdida)) if perdida else 0.0,
+    }
+
+
+def crear_indice(tipo="exacto", **parametros):
+    """Fábrica: 'exacto', 'ivf', 'hnsw' o 'cuantizado'."""
+    if tipo == "exacto":
+        return IndiceExacto(**parametros)
+    if tipo == "ivf":
+        return IndiceIVF(**parametros)
+    if tipo == "hnsw":
+        return IndiceHNSW(**parametros)
+    if tipo == "cuantizado":
+        return IndiceCuantizado(**parametros)
+    raise ValueError(f"Tipo de índice desconocido: {tipo}")
@@ -1,55 +1,239 @@
 """
 MÓDULO: KNOWLEDGE
 Responsabilidad: Contener la ontología estática y definiciones del sistema de salud (SISPRO).
-No tiene lógica compleja, solo diccionarios de traducción.
+Los catálogos completos se compilan a un snapshot binario (compilar_ontologia.py) que se
+mapea en memoria de forma perezosa y se comparte entre procesos; sin él se usan los
+diccionarios base de este módulo.
 """
+import hashlib
+import json
+import os
+import struct
+import threading
+from functools import lru_cache
+
+import numpy as np
+
+# CIE-10: Diagnósticos
+CIE10 = {
+    "E10": "DIABETES MELLITUS INSULINODEPENDIENTE TIPO 1 ENDOCRINO",
+    "E119": "DIABETES MELLITUS TIPO 2 NO INSULINODEPENDIENTE SIN COMPLICACIONES METABOLICO",
+    "E105": "DIABETES MELLITUS TIPO 1 CON COMPLICACIONES CIRCULATORIAS PERIFERICAS",
+    "N183": "ENFERMEDAD RENAL CRONICA ETAPA 3 FALLA RENAL MODERADA FILTRACION GLOMERULAR DISMINUIDA",
+    "I10X": "HIPERTENSION ARTERIAL ESENCIAL PRIMARIA RIESGO CARDIOVASCULAR",
+    "T814": "INFECCION CONSECUTIVA A PROCEDIMIENTO HERIDA QUIRURGICA COMPLICACION POSOPERATORIA",
+    "Z000": "EXAMEN MEDICO GENERAL CONTROL PREVENTIVO SALUD"
+}
+
+# CUPS: Procedimientos
+CUPS = {
+    "903895": "CREATININA EN SUERO ORINA FUNCION RENAL QUIMICA SANGUINEA",
+    "903841": "HEMOGLOBINA GLICOSILADA HB1AC CONTROL DIABETES",
+    "890201": "CONSULTA DE PRIMERA VEZ POR MEDICINA GENERAL",
+    "890301": "CONSULTA DE CONTROL POR MEDICINA GENERAL",
+    "871010": "RADIOGRAFIA DE TORAX",
+    "881112": "ECOGRAFIA RENAL VIAL URINARIAS"
+}
+
+# ATC: Medicamentos
+ATC = {
+    "A10BA02": "METFORMINA ANTIDIABETICO ORAL BIGUANIDAS",
+    "A10A": "INSULINAS Y ANALOGOS HORMONA",
+    "C09AA02": "ENALAPRIL ANTIHIPERTENSIVO INHIBIDOR ECA",
+    "J01CR02": "AMOXICILINA Y INHIBIDOR DE ENZIMA ANTIBIOTICO PENICILINAS"
+}
+
+# REGIMEN
+REGIMEN = {
+    "CONTRIBUTIVO": "PAGO POR CAPACIDAD ASEGURAMIENTO PRIVADO LABORAL",
+    "SUBSIDIADO": "PAGO POR ESTADO SISBEN VULNERABILIDAD",
+    "ESPECIAL": "FUERZAS MILITARES MAGISTERIO ECOPETROL"
+}
+
+NO_ESPECIFICADO = {
+    "DX": "ENFERMEDAD_NO_ESPECIFICADA",
+    "PROC": "PROCEDIMIENTO_NO_ESPECIFICADO",
+    "MED": "MEDICAMENTO_NO_ESPECIFICADO",
+}
+
+# Sube si cambia la lógica de resolución (p. ej. el respaldo por prefijo):
+# invalida snapshots vectoriales generados con la lógica anterior
+VERSION_LOGICA = 2
+
+# Snapshot compilado por defecto (se usa sólo si existe)
+RUTA_ONTOLOGIA = os.environ.get("COMET_ONTOLOGIA", "ontologia_sispro.bin")
+
+_MAGIA = b"CMTO"
+_ANCHO_CODIGO = 16
+
+
+def _version_catalogos(catalogos):
+    contenido = json.dumps([VERSION_LOGICA, catalogos], sort_keys=True)
+    return hashlib.sha1(contenido.encode("utf-8")).hexdigest()[:12]
+
+
+def compilar_ontologia(catalogos, ruta):
+    """
+    Escribe `catalogos` ({tipo: {codigo: descripcion}}) como snapshot binario:
+    cabecera JSON + por tipo un arreglo ordenado de códigos de ancho fijo
+    (búsqueda binaria sobre mmap), offsets uint32 y un blob UTF-8 de descripciones.
+    """
+    secciones, partes, posicion = {}, [], 0
+    for tipo, catalogo in sorted(catalogos.items()):
+        codigos = sorted(catalogo)
+        # numpy truncaría en silencio a S{ancho}: el código quedaría irreconocible
+        largos = [c for c in codigos if len(c.encode("utf-8")) > _ANCHO_CODIGO]
+        if largos:
+            raise ValueError(f"{len(largos)} códigos {tipo} superan {_ANCHO_CODIGO} bytes "
+                             f"(p. ej. {', '.join(largos[:3])})")
+        claves = np.array([c.encode("utf-8") for c in codigos], dtype=f"S{_ANCHO_CODIGO}")
+        blobs = [catalogo[c].encode("utf-8") for c in codigos]
+        offsets = np.zeros(len(blobs) + 1, dtype=np.uint32)
+        offsets[1:] = np.cumsum([len(b) for b in blobs])
+
+        seccion = {"n": len(codigos)}
+        for nombre, datos in (("claves", claves.tobytes()), ("offsets", offsets.tobytes()),
+                              ("blob", b"".join(blobs))):
+            seccion[nombre] = posicion
+            partes.append(datos)
+            posicion += len(datos)
+        secciones[tipo] = seccion
+
+    cabecera = json.dumps({
+        "formato": 1,
+        "version": _version_catalogos(catalogos),
+        "ancho_codigo": _ANCHO_CODIGO,
+        "secciones": secciones,
+    }).encode("utf-8")
+
+    temporal = ruta + ".tmp"
+    with open(temporal, "wb") as f:
+        f.write(_MAGIA + struct.pack("<I", len(cabecera)) + cabecera)
+        for datos in partes:
+            f.write(datos)
+    os.replace(temporal, ruta)
+
+
+class OntologiaCompilada:
+    """
+    Lector del snapshot binario. Sólo la cabecera se lee al crear el objeto;
+    los datos se mapean en memoria (páginas compartidas entre procesos) la
+    primera vez que se consulta un código. El archivo queda abierto: si
+    compilar_ontologia lo reemplaza, este objeto sigue leyendo el contenido
+    que corresponde a su cabecera.
+    """
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self._archivo = open(ruta, "rb")
+        f = self._archivo
+        if f.read(4) != _MAGIA:
+            f.close()
+            raise ValueError(f"{ruta} no es un snapshot de ontología CoMET")
+        largo = struct.unpack("<I", f.read(4))[0]
+        self._cabecera = json.loads(f.read(largo))
+        self._inicio_datos = 8 + largo
+        self.version = self._cabecera["version"]
+        self._secciones = None
+        self._lock = threading.Lock()
+        self.buscar = lru_cache(maxsize=65_536)(self._buscar)
+
+    def _mapear(self):
+        with self._lock:
+            if self._secciones is not None:
+                return
+            datos = np.memmap(self._archivo, dtype=np.uint8, mode="r", offset=self._inicio_datos)
+            ancho = self._cabecera["ancho_codigo"]
+            secciones = {}
+            for tipo, s in self._cabecera["secciones"].items():
+                n = s["n"]
+                claves = datos[s["claves"]:s["claves"] + n * ancho].view(f"S{ancho}")
+                offsets = datos[s["offsets"]:s["offsets"] + (n + 1) * 4].view(np.uint32)
+                blob = datos[s["blob"]:s["blob"] + int(offsets[-1])]
+                secciones[tipo] = (claves, offsets, blob)
+            self._secciones = secciones
+
+    def tipos(self):
+        return list(self._cabecera["secciones"])
+
+    def _buscar(self, tipo, codigo):
+        """Descripción exacta del código o None."""
+        if self._secciones is None:
+            self._mapear()
+        seccion = self._secciones.get(tipo)
+        if seccion is None:
+            return None
+        claves, offsets, blob = seccion
+        clave = codigo.encode("utf-8")
+        i = int(np.searchsorted(claves, clave))
+        if i == len(claves) or claves[i] != clave:
+            return None
+        return bytes(blob[offsets[i]:offsets[i + 1]]).decode("utf-8")
+
+
+_ONTOLOGIAS = {}
+_LOCK_ONTOLOGIAS = threading.Lock()
+
+
+def cargar_ontologia(ruta):
+    """
+    Una OntologiaCompilada por archivo y proceso (todos los tokenizadores la
+    comparten). Se vuelve a abrir si el archivo cambió (mtime/tamaño), p. ej.
+    tras compilar_ontologia.py; los maestros ya creados conservan la suya.
+    """
+    estado = os.stat(ruta)
+    firma = (estado.st_mtime_ns, estado.st_size)
+    entrada = _ONTOLOGIAS.get(ruta)
+    if entrada is None or entrada[0] != firma:
+        with _LOCK_ONTOLOGIAS:
+            entrada = _ONTOLOGIAS.get(ruta)
+            if entrada is None or entrada[0] != firma:
+                entrada = _ONTOLOGIAS[ruta] = (firma, OntologiaCompilada(ruta))
+    return entrada[1]
+
 
 class MaestroSispro:
-    def __init__(self):
-        # CIE-10: Diagnósticos
-        self.cie10 = {
-            "E10": "DIABETES MELLITUS INSULINODEPENDIENTE TIPO 1 ENDOCRINO",
-            "E119": "DIABETES MELLITUS TIPO 2 NO INSULINODEPENDIENTE SIN COMPLICACIONES METABOLICO",
-            "E105": "DIABETES MELLITUS TIPO 1 CON COMPLICACIONES CIRCULATORIAS PERIFERICAS",
-            "N183": "ENFERMEDAD RENAL CRONICA ETAPA 3 FALLA RENAL MODERADA FILTRACION GLOMERULAR DISMINUIDA",
-            "I10X": "HIPERTENSION ARTERIAL ESENCIAL PRIMARIA RIESGO CARDIOVASCULAR",
-            "T814": "INFECCION CONSECUTIVA A PROCEDIMIENTO HERIDA QUIRURGICA COMPLICACION POSOPERATORIA",
-            "Z000": "EXAMEN MEDICO GENERAL CONTROL PREVENTIVO SALUD"
-        }
-        
-        # CUPS: Procedimientos
-        self.cups = {
-            "903895": "CREATININA EN SUERO ORINA FUNCION RENAL QUIMICA SANGUINEA",
-            "903841": "HEMOGLOBINA GLICOSILADA HB1AC CONTROL DIABETES",
-            "890201": "CONSULTA DE PRIMERA VEZ POR MEDICINA GENERAL",
-            "890301": "CONSULTA DE CONTROL POR MEDICINA GENERAL",
-            "871010": "RADIOGRAFIA DE TORAX",
-            "881112": "ECOGRAFIA RENAL VIAL URINARIAS"
-        }
-        
-        # ATC: Medicamentos
-        self.atc = {
-            "A10BA02": "METFORMINA ANTIDIABETICO ORAL BIGUANIDAS",
-            "A10A": "INSULINAS Y ANALOGOS HORMONA",
-            "C09AA02": "ENALAPRIL ANTIHIPERTENSIVO INHIBIDOR ECA",
-            "J01CR02": "AMOXICILINA Y INHIBIDOR DE ENZIMA ANTIBIOTICO PENICILINAS"
-        }
-        
-        # REGIMEN
-        self.regimen = {
-            "CONTRIBUTIVO": "PAGO POR CAPACIDAD ASEGURAMIENTO PRIVADO LABORAL",
-            "SUBSIDIADO": "PAGO POR ESTADO SISBEN VULNERABILIDAD",
-            "ESPECIAL": "FUERZAS MILITARES MAGISTERIO ECOPETROL"
-        }
+    def __init__(self, ruta_compilada=None):
+        # Diccionarios base compartidos (no se copian por instancia)
+        self.cie10 = CIE10
+        self.cups = CUPS
+        self.atc = ATC
+        self.regimen = REGIMEN
+
+        ruta = ruta_compilada or RUTA_ONTOLOGIA
+        self.compilada = cargar_ontologia(ruta) if os.path.exists(ruta) else None
+        # Ruta efectiva: con ella un proceso spawn reconstruye el mismo maestro
+        self.ruta_compilada = ruta
+
+        # Huella del contenido: cambia si cambia cualquier catálogo
+        if self.compilada is not None:
+            self.version = self.compilada.version
+        else:
+            self.version = _version_catalogos(
+                {"DX": self.cie10, "PROC": self.cups, "MED": self.atc, "REG": self.regimen}
+            )
+
+    def _buscar(self, tipo, codigo):
+        if self.compilada is not None:
+            return self.compilada.buscar(tipo, codigo)
+        catalogo = {"DX": self.cie10, "PROC": self.cups, "MED": self.atc}[tipo]
+        return catalogo.get(codigo)
+
+    def _buscar_jerarquico(self, tipo, codigo):
+        """Respaldo por prefijo: E119 -> E11 -> E1 (igual para CUPS y ATC)."""
+        for largo in range(len(codigo), 1, -1):
+            desc = self._buscar(tipo, codigo[:largo])
+            if desc is not None:
+                return desc
+        return NO_ESPECIFICADO[tipo]
 
     def get_concepto(self, tipo, codigo):
         codigo_limpio = codigo.replace(".", "")
-        if tipo == "DX":
-            return self.cie10.get(codigo_limpio, "ENFERMEDAD_NO_ESPECIFICADA")
-        elif tipo == "PROC":
-            return self.cups.get(codigo_limpio, "PROCEDIMIENTO_NO_ESPECIFICADO")
-        elif tipo == "MED":
-            return self.atc.get(codigo_limpio, "MEDICAMENTO_NO_ESPECIFICADO")
+        if tipo in NO_ESPECIFICADO:
+            return self._buscar_jerarquico(tipo, codigo_limpio)
         elif tipo == "REG":
-            return self.regimen.get(codigo.upper(), "REGIMEN_NO_ESPECIFICADO")
-        return codigo
\ No newline at end of file
+            if self.compilada is not None and "REG" in self.compilada.tipos():
+                desc = self.compilada.buscar("REG", codigo.upper())
+            else:
+                desc = self.regimen.get(codigo.upper())
+            return desc or "REGIMEN_NO_ESPECIFICADO"
+        return codigo
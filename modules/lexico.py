@@ -0,0 +1,137 @@
+"""
+MÓDULO: LÉXICO
+Responsabilidad: Índice invertido BM25 sobre los tokens CoMET (DX:, PROC:, LUGAR_ATENCION:...).
+Pre-filtra candidatos que comparten códigos poco frecuentes sin llamar al modelo de embeddings.
+"""
+import math
+from array import array
+
+import numpy as np
+
+
+class IndiceLexico:
+    """
+    Listas de postings (doc, tf) por token en arreglos compactos.
+    Los tokens demasiado comunes (df > max_df * N, p. ej. PACIENTE_SEXO:M)
+    se ignoran en consulta: no discriminan y sus listas son las más largas.
+    Los borrados son lógicos (df y N sólo cuentan documentos vivos) y los
+    postings se compactan cuando los eliminados superan `max_eliminados` del total.
+    """
+    def __init__(self, k1=1.2, b=0.75, max_df=0.2, max_eliminados=0.25):
+        self.k1 = k1
+        self.b = b
+        self.max_df = max_df
+        self.max_eliminados = max_eliminados
+        self._postings = {}
+        self._docs = []
+        self._largos = array('I')
+        self._borrado = bytearray()
+        self._doc_de = {}
+        self._n_eliminados = 0
+        self._suma_largos = 0
+
+    def __len__(self):
+        return len(self._doc_de)
+
+    def __contains__(self, id_paciente):
+        return id_paciente in self._doc_de
+
+    @staticmethod
+    def tokens_de(secuencia):
+        """Los tokens de concepto no llevan espacios, así que basta con split()."""
+        return secuencia.split()
+
+    def agregar(self, id_paciente, tokens):
+        if id_paciente in self._doc_de:
+            self.eliminar(id_paciente)
+        doc = len(self._docs)
+        self._docs.append(id_paciente)
+        self._doc_de[id_paciente] = doc
+        self._largos.append(len(tokens))
+        self._borrado.append(0)
+        self._suma_largos += len(tokens)
+
+        frecuencias = {}
+        for token in tokens:
+            frecuencias[token] = frecuencias.get(token, 0) + 1
+        for token, tf in frecuencias.items():
+            posting = self._postings.get(token)
+            if posting is None:
+                posting = self._postings[token] = (array('I'), array('I'))
+            posting[0].append(doc)
+            posting[1].append(tf)
+
+    def eliminar(self, id_paciente):
+        """Borrado lógico: el doc se descarta al puntuar y deja de contar en df hasta compactar()."""
+        doc = self._doc_de.pop(id_paciente)
+        self._borrado[doc] = 1
+        self._n_eliminados += 1
+        self._suma_largos -= self._largos[doc]
+        if self._n_eliminados > self.max_eliminados * len(self._docs):
+            self.compactar()
+
+    def compactar(self):
+        """Reescribe los postings sin los documentos eliminados y renumera los vivos."""
+        if not self._n_eliminados:
+            return
+        borrado = np.frombuffer(self._borrado, dtype=np.uint8).astype(bool)
+        nuevo_doc = (np.cumsum(~borrado) - 1).astype(np.uint32)
+
+        postings = {}
+        for token, (docs, tfs) in self._postings.items():
+            docs = np.frombuffer(docs, dtype=np.uint32)
+            vivos = ~borrado[docs]
+            if not vivos.any():
+                continue
+            nuevos_docs, nuevos_tfs = array('I'), array('I')
+            nuevos_docs.frombytes(nuevo_doc[docs[vivos]].tobytes())
+            nuevos_tfs.frombytes(np.frombuffer(tfs, dtype=np.uint32)[vivos].tobytes())
+            postings[token] = (nuevos_docs, nuevos_tfs)
+
+        self._postings = postings
+        self._docs = [id_pt for id_pt, b in zip(self._docs, borrado) if not b]
+        largos = array('I')
+        largos.frombytes(np.frombuffer(self._largos, dtype=np.uint32)[~borrado].tobytes())
+        self._largos = largos
+        self._borrado = bytearray(len(self._docs))
+        self._doc_de = {id_pt: doc for doc, id_pt in enumerate(self._docs)}
+        self._n_eliminados = 0
+
+    def buscar(self, tokens, k=100):
+        """[(id_paciente, score_bm25), ...] de los k documentos con más afinidad."""
+        n = len(self._doc_de)
+        if n == 0:
+            return []
+        largo_medio = self._suma_largos / n
+        largos = np.frombuffer(self._largos, dtype=np.uint32)
+        borrado = np.frombuffer(self._borrado, dtype=np.uint8).astype(bool) if self._n_eliminados else None
+
+        docs_parciales, scores_parciales = [], []
+        for token in set(tokens):
+            posting = self._postings.get(token)
+            if posting is None:
+                continue
+            docs = np.frombuffer(posting[0], dtype=np.uint32)
+            tf = np.frombuffer(posting[1], dtype=np.uint32).astype(np.float32)
+            if borrado is not None:
+                vivos = ~borrado[docs]
+                docs, tf = docs[vivos], tf[vivos]
+            df = len(docs)
+            if df == 0 or (df > self.max_df * n and n > 1 / self.max_df):
+                continue
+            idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+            norma = self.k1 * (1 - self.b + self.b * largos[docs] / largo_medio)
+            docs_parciales.append(docs)
+            scores_parciales.append(idf * tf * (self.k1 + 1) / (tf + norma))
+
+        if not docs_parciales:
+            return []
+        docs, inverso = np.unique(np.concatenate(docs_parciales), return_inverse=True)
+        scores = np.bincount(inverso, weights=np.concatenate(scores_parciales))
+
+        k = min(k, len(docs))
+        if k == 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self._docs[docs[i]], float(scores[i])) for i in top]
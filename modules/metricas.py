@@ -0,0 +1,276 @@
+"""
+MÓDULO: MÉTRICAS
+Responsabilidad: Instrumentar las etapas del flujo (carga de datos, tokenización,
+embeddings, búsqueda e inferencia LLM) con histogramas de latencia, contadores
+de errores y tokens de Ollama, y trazas estructuradas por span.
+Exporta en formato de texto Prometheus y trazas JSONL:
+   COMET_METRICAS_PUERTO=9464  -> GET http://host:9464/metrics
+   COMET_TRAZAS=trazas.jsonl   -> un span JSON por línea
+"""
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import numpy as np
+
+# Cubetas (segundos): del milisegundo de una búsqueda al minuto de una inferencia en CPU
+CUBETAS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Duraciones recientes por etapa para p50/p95 del panel
+MUESTRAS_RECIENTES = 1024
+
+_span_actual = ContextVar("comet_span_actual", default=None)
+
+AYUDA = {
+    "comet_etapa_duracion_segundos": ("histogram", "Duración por etapa del flujo CoMET-Col"),
+    "comet_etapa_errores_total": ("counter", "Etapas terminadas con error"),
+    "comet_llm_tokens_total": ("counter", "Tokens reportados por Ollama (prompt/generados)"),
+    "comet_llm_eval_duracion_segundos": ("histogram", "Tiempos de evaluación reportados por Ollama"),
+}
+
+
+class Span:
+    """Intervalo con nombre dentro de una traza; `atributos` se puede enriquecer mientras está abierto."""
+    __slots__ = ("nombre", "traza", "id", "padre", "inicio", "duracion", "estado", "atributos")
+
+    def __init__(self, nombre, padre=None, atributos=None):
+        self.nombre = nombre
+        self.traza = padre.traza if padre is not None else uuid.uuid4().hex
+        self.id = uuid.uuid4().hex[:16]
+        self.padre = padre.id if padre is not None else None
+        self.inicio = time.time()
+        self.duracion = None
+        self.estado = "ok"
+        self.atributos = dict(atributos or {})
+
+    def como_dict(self):
+        return {
+            "traza": self.traza,
+            "span": self.id,
+            "padre": self.padre,
+            "nombre": self.nombre,
+            "inicio": datetime.fromtimestamp(self.inicio, timezone.utc).isoformat(),
+            "duracion_ms": round(self.duracion * 1000, 3) if self.duracion is not None else None,
+            "estado": self.estado,
+            "atributos": self.atributos,
+        }
+
+
+class _Histograma:
+    __slots__ = ("cubetas", "suma", "conteo")
+
+    def __init__(self):
+        self.cubetas = [0] * len(CUBETAS)
+        self.suma = 0.0
+        self.conteo = 0
+
+    def observar(self, valor):
+        for i, borde in enumerate(CUBETAS):
+            if valor <= borde:
+                self.cubetas[i] += 1
+        self.suma += valor
+        self.conteo += 1
+
+
+def _etiquetas(etiquetas):
+    return tuple(sorted(etiquetas.items()))
+
+
+def _formato_etiquetas(etiquetas, extra=()):
+    pares = list(etiquetas) + list(extra)
+    if not pares:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pares) + "}"
+
+
+class RegistroMetricas:
+    """
+    Contadores e histogramas con etiquetas, seguros entre hilos. Los spans se
+    anidan solos por contexto (hilos y tareas asyncio): un span abierto dentro
+    de otro hereda su traza y lo toma como padre.
+    """
+    def __init__(self, ruta_trazas=None, max_trazas=1000):
+        self.ruta_trazas = ruta_trazas
+        self._lock = threading.Lock()
+        self._contadores = {}
+        self._histogramas = {}
+        self._ayuda = dict(AYUDA)
+        self._recientes = {}
+        self._errores = {}
+        self._trazas = deque(maxlen=max_trazas)
+
+    def incrementar(self, nombre, valor=1, **etiquetas):
+        clave = (nombre, _etiquetas(etiquetas))
+        with self._lock:
+            self._contadores[clave] = self._contadores.get(clave, 0) + valor
+
+    def observar(self, nombre, valor, **etiquetas):
+        clave = (nombre, _etiquetas(etiquetas))
+        with self._lock:
+            histograma = self._histogramas.get(clave)
+            if histograma is None:
+                histograma = self._histogramas[clave] = _Histograma()
+            histograma.observar(valor)
+
+    @contextmanager
+    def span(self, etapa, **atributos):
+        """
+        Mide `etapa`: observa comet_etapa_duracion_segundos{etapa=...}, cuenta
+        las excepciones en comet_etapa_errores_total y registra el span.
+        """
+        span = Span(etapa, _span_actual.get(), atributos)
+        token = _span_actual.set(span)
+        inicio = time.perf_counter()
+        try:
+            yield span
+        except BaseException as e:
+            span.estado = "error"
+            span.atributos["error"] = type(e).__name__
+            raise
+        finally:
+            span.duracion = time.perf_counter() - inicio
+            _span_actual.reset(token)
+            self._cerrar_span(span)
+
+    def _cerrar_span(self, span):
+        self.observar("comet_etapa_duracion_segundos", span.duracion, etapa=span.nombre)
+        with self._lock:
+            recientes = self._recientes.get(span.nombre)
+            if recientes is None:
+                recientes = self._recientes[span.nombre] = deque(maxlen=MUESTRAS_RECIENTES)
+            recientes.append(span.duracion)
+            if span.estado == "error":
+                self._errores[span.nombre] = self._errores.get(span.nombre, 0) + 1
+            self._trazas.append(span)
+        if span.estado == "error":
+            self.incrementar("comet_etapa_errores_total", etapa=span.nombre)
+        if self.ruta_trazas:
+            linea = json.dumps(span.como_dict(), ensure_ascii=False, default=str)
+            with self._lock, open(self.ruta_trazas, "a", encoding="utf-8") as f:
+                f.write(linea + "\n")
+
+    def registrar_llm(self, metadatos, span=None):
+        """
+        Tokens y tiempos que Ollama reporta en cada respuesta (response_metadata):
+        prompt_eval_count, eval_count y las duraciones en nanosegundos.
+        """
+        metadatos = metadatos or {}
+        tokens_prompt = metadatos.get("prompt_eval_count")
+        tokens_generados = metadatos.get("eval_count")
+        if tokens_prompt is not None:
+            self.incrementar("comet_llm_tokens_total", tokens_prompt, tipo="prompt")
+        if tokens_generados is not None:
+            self.incrementar("comet_llm_tokens_total", tokens_generados, tipo="generados")
+        for campo, fase in (("prompt_eval_duration", "prompt"), ("eval_duration", "generacion"),
+                            ("load_duration", "carga_modelo")):
+            if metadatos.get(campo) is not None:
+                self.observar("comet_llm_eval_duracion_segundos", metadatos[campo] / 1e9, fase=fase)
+        if span is not None:
+            span.atributos.update({
+                "tokens_prompt": tokens_prompt,
+                "tokens_generados": tokens_generados,
+                "eval_ms": round(metadatos["eval_duration"] / 1e6, 3) if metadatos.get("eval_duration") else None,
+            })
+
+    def resumen(self):
+        """Por etapa: conteo, errores, media y p50/p95 (ms) recientes; más el uso de tokens del LLM."""
+        with self._lock:
+            recientes = {etapa: list(d) for etapa, d in self._recientes.items()}
+            errores = dict(self._errores)
+            contadores = dict(self._contadores)
+            histogramas = {clave: (h.suma, h.conteo) for clave, h in self._histogramas.items()}
+
+        etapas = {}
+        for etapa, duraciones in recientes.items():
+            suma, conteo = histogramas[("comet_etapa_duracion_segundos", (("etapa", etapa),))]
+            ms = np.asarray(duraciones) * 1000
+            p50, p95 = np.percentile(ms, [50, 95])
+            etapas[etapa] = {
+                "conteo": conteo,
+                "errores": errores.get(etapa, 0),
+                "total_s": round(suma, 3),
+                "media_ms": round(suma / conteo * 1000, 2),
+                "p50_ms": round(float(p50), 2),
+                "p95_ms": round(float(p95), 2),
+            }
+
+        generados = contadores.get(("comet_llm_tokens_total", (("tipo", "generados"),)), 0)
+        segundos_generacion = histogramas.get(
+            ("comet_llm_eval_duracion_segundos", (("fase", "generacion"),)), (0.0, 0))[0]
+        llm = {
+            "tokens_prompt": contadores.get(("comet_llm_tokens_total", (("tipo", "prompt"),)), 0),
+            "tokens_generados": generados,
+            "tokens_por_segundo": round(generados / segundos_generacion, 1) if segundos_generacion else None,
+        }
+        return {"etapas": etapas, "llm": llm}
+
+    def trazas(self, n=50):
+        """Últimos `n` spans cerrados, del más reciente al más antiguo."""
+        with self._lock:
+            ultimos = list(self._trazas)[-n:]
+        return [span.como_dict() for span in reversed(ultimos)]
+
+    def exportar_prometheus(self):
+        """Texto en formato de exposición Prometheus 0.0.4."""
+        with self._lock:
+            contadores = sorted(self._contadores.items())
+            histogramas = sorted((clave, (list(h.cubetas), h.suma, h.conteo))
+                                 for clave, h in self._histogramas.items())
+
+        lineas, descritos = [], set()
+
+        def encabezado(nombre, tipo):
+            if nombre in descritos:
+                return
+            descritos.add(nombre)
+            tipo, ayuda = self._ayuda.get(nombre, (tipo, nombre))
+            lineas.append(f"# HELP {nombre} {ayuda}")
+            lineas.append(f"# TYPE {nombre} {tipo}")
+
+        for (nombre, etiquetas), valor in contadores:
+            encabezado(nombre, "counter")
+            lineas.append(f"{nombre}{_formato_etiquetas(etiquetas)} {valor}")
+        for (nombre, etiquetas), (cubetas, suma, conteo) in histogramas:
+            encabezado(nombre, "histogram")
+            for borde, acumulado in zip(CUBETAS, cubetas):
+                lineas.append(f"{nombre}_bucket{_formato_etiquetas(etiquetas, [('le', borde)])} {acumulado}")
+            lineas.append(f"{nombre}_bucket{_formato_etiquetas(etiquetas, [('le', '+Inf')])} {conteo}")
+            lineas.append(f"{nombre}_sum{_formato_etiquetas(etiquetas)} {suma}")
+            lineas.append(f"{nombre}_count{_formato_etiquetas(etiquetas)} {conteo}")
+        return "\n".join(lineas) + "\n"
+
+
+def servir_prometheus(puerto, registro_metricas=None, host="0.0.0.0"):
+    """Expone GET /metrics en un hilo de fondo. Retorna el servidor (shutdown() para detenerlo)."""
+    registro_metricas = registro_metricas if registro_metricas is not None else registro
+
+    class Manejador(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_response(404)
+                self.end_headers()
+                return
+            datos = registro_metricas.exportar_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(datos)))
+            self.end_headers()
+            self.wfile.write(datos)
+
+    servidor = ThreadingHTTPServer((host, puerto), Manejador)
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor
+
+
+# Registro del proceso: lo comparten engine, repositorios, tokenizador y apps
+registro = RegistroMetricas(ruta_trazas=os.environ.get("COMET_TRAZAS") or None)
@@ -0,0 +1,161 @@
+"""
+MÓDULO: MINHASH
+Responsabilidad: Detectar trayectorias casi idénticas (doble facturación / fragmentación)
+en toda la población en tiempo ~lineal, con firmas MinHash y LSH por bandas.
+"""
+import hashlib
+
+import numpy as np
+
+# Tokens que no cuentan para la similitud: la misma secuencia clínica
+# facturada por otra IPS debe verse como duplicada
+PREFIJOS_EXCLUIDOS = ("PACIENTE_SEXO:", "EDAD:", "CONTEXTO_FINANCIERO:", "LUGAR_ATENCION:")
+
+
+def shingles(tokens, k=2, excluir=PREFIJOS_EXCLUIDOS):
+    """k-gramas de tokens clínicos consecutivos (conservan el orden de los eventos)."""
+    clinicos = [t for t in tokens if not t.startswith(excluir)]
+    if len(clinicos) < k:
+        return {" ".join(clinicos)} if clinicos else set()
+    return {" ".join(clinicos[i:i + k]) for i in range(len(clinicos) - k + 1)}
+
+
+# Multiplicador impar (razón áurea en 64 bits) para combinar los ids de un k-grama
+_MEZCLA = np.uint64(0x9E3779B97F4A7C15)
+
+
+class ShinglesIds:
+    """
+    shingles() sobre los ids de TokenizadorCoMET.construir_ids: cada k-grama
+    es un entero uint64 y no se arma ningún string. Los ids sólo son estables
+    dentro del mismo VocabularioCoMET, así que las firmas no se comparan
+    entre ejecuciones.
+    """
+    def __init__(self, vocabulario, k=2, excluir=PREFIJOS_EXCLUIDOS):
+        self.vocabulario = vocabulario
+        self.k = k
+        self.excluir = excluir
+        self._excluido = np.zeros(0, dtype=bool)
+
+    def _mascara(self):
+        # El vocabulario sólo crece: se clasifican los tokens nuevos
+        n = len(self.vocabulario)
+        if n > len(self._excluido):
+            nuevos = [self.vocabulario.token_de(i).startswith(self.excluir)
+                      for i in range(len(self._excluido), n)]
+            self._excluido = np.concatenate([self._excluido, np.array(nuevos, dtype=bool)])
+        return self._excluido
+
+    def __call__(self, ids):
+        clinicos = ids[~self._mascara()[ids]].astype(np.uint64)
+        if len(clinicos) == 0:
+            return clinicos
+        k = min(self.k, len(clinicos))
+        m = len(clinicos) - k + 1
+        with np.errstate(over="ignore"):
+            gramas = clinicos[:m].copy()
+            for j in range(1, k):
+                gramas = gramas * _MEZCLA + clinicos[j:j + m]
+        return np.unique(gramas)
+
+
+def _hash32(texto):
+    # blake2b en lugar de hash(): estable entre procesos y ejecuciones
+    return int.from_bytes(hashlib.blake2b(texto.encode("utf-8"), digest_size=4).digest(), "little")
+
+
+class GeneradorMinHash:
+    """
+    Familia multiply-shift: h_i(x) = (a_i * x + b_i) >> 32 en aritmética
+    uint64 modular; la firma es el mínimo de cada h_i sobre los shingles.
+    """
+    def __init__(self, num_permutaciones=128, semilla=1):
+        rng = np.random.default_rng(semilla)
+        self.num_permutaciones = num_permutaciones
+        self._a = rng.integers(1, 2**63, num_permutaciones, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+        self._b = rng.integers(0, 2**63, num_permutaciones, dtype=np.uint64)
+
+    def firma(self, conjunto):
+        """`conjunto`: shingles de texto (set) o ya enteros (arreglo uint64 de ShinglesIds)."""
+        if not len(conjunto):
+            return np.full(self.num_permutaciones, np.iinfo(np.uint32).max, dtype=np.uint32)
+        if isinstance(conjunto, np.ndarray):
+            x = conjunto.astype(np.uint64, copy=False)
+        else:
+            x = np.fromiter((_hash32(s) for s in conjunto), dtype=np.uint64, count=len(conjunto))
+        with np.errstate(over="ignore"):
+            h = (x[:, None] * self._a[None, :] + self._b[None, :]) >> np.uint64(32)
+        return h.min(axis=0).astype(np.uint32)
+
+
+def similitud_estimada(firma_a, firma_b):
+    """Fracción de componentes iguales ≈ Jaccard de los shingles."""
+    return float(np.mean(firma_a == firma_b))
+
+
+class IndiceLSH:
+    """
+    Divide cada firma en `bandas` de `num_permutaciones / bandas` filas; dos
+    trayectorias son candidatas si coinciden en al menos una banda completa.
+    Umbral aproximado de detección: (1 / bandas) ** (1 / filas).
+    """
+    def __init__(self, num_permutaciones=128, bandas=32, max_cubeta=1000):
+        if num_permutaciones % bandas:
+            raise ValueError("num_permutaciones debe ser múltiplo de bandas")
+        self.bandas = bandas
+        self.filas = num_permutaciones // bandas
+        self.max_cubeta = max_cubeta
+        self._cubetas = [dict() for _ in range(bandas)]
+        self._firmas = {}
+        self.cubetas_omitidas = 0
+
+    def __len__(self):
+        return len(self._firmas)
+
+    @property
+    def umbral(self):
+        return (1 / self.bandas) ** (1 / self.filas)
+
+    def _claves(self, firma):
+        return [firma[i * self.filas:(i + 1) * self.filas].tobytes() for i in range(self.bandas)]
+
+    def agregar(self, id_paciente, firma):
+        self._firmas[id_paciente] = firma
+        for banda, clave in zip(self._cubetas, self._claves(firma)):
+            banda.setdefault(clave, []).append(id_paciente)
+
+    def candidatos(self, firma):
+        encontrados = set()
+        for banda, clave in zip(self._cubetas, self._claves(firma)):
+            encontrados.update(banda.get(clave, ()))
+        return encontrados
+
+    def pares_candidatos(self):
+        """
+        Pares que comparten alguna cubeta. Las cubetas gigantes (p. ej.
+        trayectorias vacías o sólo con controles) se omiten y se cuentan.
+        """
+        pares = set()
+        self.cubetas_omitidas = 0
+        for banda in self._cubetas:
+            for ids in banda.values():
+                if len(ids) < 2:
+                    continue
+                if len(ids) > self.max_cubeta:
+                    self.cubetas_omitidas += 1
+                    continue
+                for i in range(len(ids)):
+                    for j in range(i + 1, len(ids)):
+                        a, b = ids[i], ids[j]
+                        pares.add((a, b) if str(a) < str(b) else (b, a))
+        return pares
+
+    def barrido(self, umbral=0.8):
+        """Pares (a, b, similitud) con similitud estimada >= umbral, de mayor a menor."""
+        resultado = []
+        for a, b in self.pares_candidatos():
+            sim = similitud_estimada(self._firmas[a], self._firmas[b])
+            if sim >= umbral:
+                resultado.append((a, b, sim))
+        resultado.sort(key=lambda x: -x[2])
+        return resultado
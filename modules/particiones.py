@@ -0,0 +1,236 @@
+"""
+MÓDULO: PARTICIONES
+Responsabilidad: Repartir el índice vectorial en N particiones servidas por procesos
+independientes. Las consultas se difunden a todas (scatter) y se fusionan los top-k
+parciales (gather): la búsqueda escala con los núcleos y cada partición se reconstruye sola.
+"""
+import heapq
+import json
+import multiprocessing
+import os
+import threading
+import zlib
+
+import numpy as np
+
+from modules.indice import IndiceVectorial, crear_indice
+from modules.snapshot import SnapshotIndice, UMBRAL_IVF, publicar_version, ruta_vigente
+
+MANIFIESTO = "particiones.json"
+
+
+def particion_de(clave, n_particiones):
+    """Partición estable entre procesos y ejecuciones (hash() de Python no lo es)."""
+    return zlib.crc32(str(clave).encode("utf-8")) % n_particiones
+
+
+def _carpeta_particion(carpeta, i):
+    return os.path.join(carpeta, f"particion_{i:03d}")
+
+
+def _sin_version(carpeta):
+    """Nombres del formato sin versiones: el manifiesto suelto y las particion_NNN que declara."""
+    try:
+        with open(os.path.join(carpeta, MANIFIESTO), "r", encoding="utf-8") as f:
+            n_particiones = json.load(f)["n_particiones"]
+    except (OSError, ValueError, KeyError):
+        return ()
+    return (MANIFIESTO,) + tuple(os.path.basename(_carpeta_particion(carpeta, i)) for i in range(n_particiones))
+
+
+def particionar_snapshot(snapshot, carpeta, n_particiones, clave_de=None, criterio="id", umbral_ivf=UMBRAL_IVF):
+    """
+    Escribe `snapshot` como `n_particiones` sub-snapshots en `carpeta`.
+    `clave_de` ({id_paciente: clave}, p. ej. régimen/EPS o departamento)
+    agrupa los pacientes de una misma clave en la misma partición; sin él
+    se reparte por hash del id del paciente. Las particiones de `umbral_ivf`
+    pacientes o más guardan su IVF entrenado (ver SnapshotIndice.guardar).
+    """
+    clave_de = clave_de or {}
+    filas = [[] for _ in range(n_particiones)]
+    for fila, id_pt in enumerate(snapshot.ids):
+        filas[particion_de(clave_de.get(id_pt, id_pt), n_particiones)].append(fila)
+
+    def escribir(directorio):
+        for i, propias in enumerate(filas):
+            parte = SnapshotIndice(
+                [snapshot.ids[f] for f in propias],
+                [snapshot.secuencias[f] for f in propias],
+                snapshot.vectores[propias] if propias else [],
+                modelo_embeddings=snapshot.modelo_embeddings,
+                version_ontologia=snapshot.version_ontologia,
+                creado=snapshot.creado,
+                huellas=[snapshot.huellas[f] for f in propias],
+            )
+            os.makedirs(_carpeta_particion(directorio, i))
+            parte.escribir(_carpeta_particion(directorio, i), umbral_ivf)
+
+        with open(os.path.join(directorio, MANIFIESTO), "w", encoding="utf-8") as f:
+            json.dump({
+                "n_particiones": n_particiones,
+                "criterio": criterio,
+                "creado": snapshot.creado,
+                "modelo_embeddings": snapshot.modelo_embeddings,
+                "version_ontologia": snapshot.version_ontologia,
+                "tamanos": [len(p) for p in filas],
+            }, f, ensure_ascii=False)
+
+    # Versión nueva + puntero: los workers vivos siguen sobre sus archivos
+    publicar_version(carpeta, escribir, heredados=_sin_version(carpeta))
+
+
+def leer_manifiesto(carpeta):
+    """Manifiesto de la carpeta particionada o None si no existe."""
+    path = os.path.join(ruta_vigente(carpeta), MANIFIESTO)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _servir_particion(conexion, carpeta, cuantizacion):
+    """Bucle del proceso worker: un índice local y un protocolo (operación, argumentos)."""
+    snapshot = SnapshotIndice.cargar(carpeta)
+    indice = None
+    if snapshot is not None and len(snapshot):
+        indice = snapshot.construir_indice(cuantizacion)
+    conexion.send(("ok", len(indice) if indice is not None else 0))
+
+    while True:
+        operacion, argumentos = conexion.recv()
+        if operacion == "cerrar":
+            conexion.close()
+            return
+        try:
+            if operacion == "buscar":
+                respuesta = indice.buscar(*argumentos) if indice is not None else []
+            elif operacion == "puntuar":
+                respuesta = indice.puntuar(*argumentos) if indice is not None else []
+            elif operacion == "contiene":
+                respuesta = indice is not None and argumentos[0] in indice
+            elif operacion == "agregar":
+                if indice is None:
+                    indice = crear_indice("cuantizado", modo=cuantizacion) if cuantizacion else crear_indice("exacto")
+                indice.agregar(*argumentos)
+                respuesta = None
+            elif operacion == "eliminar":
+                # Se difunde a todas: sólo la dueña del id lo borra
+                ids = [id_pt for id_pt in argumentos[0] if indice is not None and id_pt in indice]
+                for id_pt in ids:
+                    indice.eliminar(id_pt)
+                respuesta = ids
+            else:
+                raise ValueError(f"Operación desconocida: {operacion}")
+            conexion.send(("ok", respuesta, len(indice) if indice is not None else 0))
+        except Exception as e:
+            conexion.send(("error", f"{type(e).__name__}: {e}", len(indice) if indice is not None else 0))
+
+
+class IndiceParticionado(IndiceVectorial):
+    """
+    IndiceVectorial cuyas N particiones viven en procesos worker. Cada worker
+    mapea su sub-snapshot (ver particionar_snapshot) y resuelve su top-k local;
+    este proceso sólo difunde la consulta y fusiona N listas de k resultados.
+    `enrutar(id_paciente) -> clave` debe coincidir con el criterio usado al
+    particionar para que los pacientes nuevos caigan en la partición correcta.
+    `cuantizacion` ('int8' o 'pq') se aplica en cada worker (ver IndiceCuantizado).
+    """
+    def __init__(self, carpeta, enrutar=None, metodo_inicio="spawn", cuantizacion=None):
+        # Se fija la versión una vez: una publicación posterior no mezcla particiones
+        carpeta = ruta_vigente(carpeta)
+        manifiesto = leer_manifiesto(carpeta)
+        if manifiesto is None:
+            raise FileNotFoundError(f"'{carpeta}' no contiene un índice particionado ({MANIFIESTO})")
+        self.manifiesto = manifiesto
+        self.n_particiones = manifiesto["n_particiones"]
+        self.enrutar = enrutar or (lambda id_pt: id_pt)
+        # Una consulta a la vez por tubería; la fusión es O(N * k)
+        self._lock = threading.Lock()
+
+        contexto = multiprocessing.get_context(metodo_inicio)
+        self._conexiones, self._procesos = [], []
+        for i in range(self.n_particiones):
+            local, remota = contexto.Pipe()
+            proceso = contexto.Process(target=_servir_particion, daemon=True,
+                                       args=(remota, _carpeta_particion(carpeta, i), cuantizacion))
+            proceso.start()
+            remota.close()
+            self._conexiones.append(local)
+            self._procesos.append(proceso)
+        self._tamanos = [conexion.recv()[1] for conexion in self._conexiones]
+
+    def _difundir(self, mensajes):
+        """Envía un mensaje por partición (None = no enviar) y recoge las respuestas."""
+        with self._lock:
+            destinos = []
+            for i, mensaje in enumerate(mensajes):
+                if mensaje is not None:
+                    self._conexiones[i].send(mensaje)
+                    destinos.append(i)
+            respuestas, errores = {}, []
+            for i in destinos:
+                estado, respuesta, tamano = self._conexiones[i].recv()
+                self._tamanos[i] = tamano
+                if estado == "error":
+                    errores.append(f"partición {i}: {respuesta}")
+                respuestas[i] = respuesta
+        if errores:
+            raise RuntimeError("; ".join(errores))
+        return respuestas
+
+    def tamanos(self):
+        return list(self._tamanos)
+
+    def __len__(self):
+        return sum(self._tamanos)
+
+    def __contains__(self, id_paciente):
+        return any(self._difundir([("contiene", (id_paciente,))] * self.n_particiones).values())
+
+    def buscar(self, vector, k=5):
+        vector = np.asarray(vector, dtype=np.float32)
+        parciales = self._difundir([("buscar", (vector, k))] * self.n_particiones)
+        return heapq.nlargest(k, (r for lista in parciales.values() for r in lista), key=lambda x: x[1])
+
+    def puntuar(self, vector, ids, k=None):
+        ids = list(ids)
+        if not ids:
+            return []
+        vector = np.asarray(vector, dtype=np.float32)
+        parciales = self._difundir([("puntuar", (vector, ids, k))] * self.n_particiones)
+        return heapq.nlargest(k or len(ids), (r for lista in parciales.values() for r in lista),
+                              key=lambda x: x[1])
+
+    def agregar(self, ids, vectores):
+        ids = list(ids)
+        vectores = np.asarray(vectores, dtype=np.float32)
+        # Reemplazo: el id puede vivir en otra partición si cambió su clave
+        self._difundir([("eliminar", (ids,))] * self.n_particiones)
+        por_particion = [[] for _ in range(self.n_particiones)]
+        for fila, id_pt in enumerate(ids):
+            por_particion[particion_de(self.enrutar(id_pt), self.n_particiones)].append(fila)
+        self._difundir([
+            ("agregar", ([ids[f] for f in filas], vectores[filas])) if filas else None
+            for filas in por_particion
+        ])
+
+    def eliminar(self, id_paciente):
+        borrados = self._difundir([("eliminar", ([id_paciente],))] * self.n_particiones)
+        if not any(borrados.values()):
+            raise KeyError(id_paciente)
+
+    def cerrar(self):
+        with self._lock:
+            for conexion, proceso in zip(self._conexiones, self._procesos):
+                if proceso.is_alive():
+                    conexion.send(("cerrar", ()))
+                conexion.close()
+            for proceso in self._procesos:
+                proceso.join(timeout=5)
+            self._conexiones, self._procesos = [], []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cerrar()
@@ -0,0 +1,219 @@
+"""
+MÓDULO: PIPELINE ÍNDICE
+Responsabilidad: Construcción paralela del snapshot vectorial (re-indexaciones completas).
+Tokeniza en un pool de procesos, vectoriza en hilos con contrapresión, escribe los
+vectores por bloques y deja un checkpoint para retomar una construcción interrumpida.
+"""
+import json
+import multiprocessing
+import os
+import shutil
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import numpy as np
+
+from modules.indexacion import huella_paciente, DeltaHistorico
+from modules.snapshot import SnapshotIndice
+from modules.tokenization import TokenizadorCoMET
+
+_tokenizador = None
+
+
+def _iniciar_worker(configuracion):
+    global _tokenizador
+    _tokenizador = TokenizadorCoMET.desde_configuracion(configuracion)
+
+
+def _tokenizar_bloque(pacientes):
+    """Se ejecuta en el pool de procesos (CPU-bound)."""
+    return _tokenizador.construir_secuencias_lote(pacientes)
+
+
+class CheckpointConstruccion:
+    """
+    Carpeta de trabajo con un par de archivos por bloque terminado:
+    `bloque_NNNNNN.npy` (vectores) y `bloque_NNNNNN.json` (ids, secuencias,
+    huellas). El .json se escribe al final y de forma atómica, así que un
+    bloque interrumpido a medias no cuenta como hecho.
+    Si cambia el modelo o la ontología, el checkpoint se descarta.
+    """
+    def __init__(self, carpeta, modelo_embeddings, version_ontologia):
+        self.carpeta = carpeta
+        firma = {"modelo_embeddings": modelo_embeddings, "version_ontologia": version_ontologia}
+        path_firma = os.path.join(carpeta, "checkpoint.json")
+        if os.path.exists(path_firma):
+            with open(path_firma, "r", encoding="utf-8") as f:
+                if json.load(f) != firma:
+                    shutil.rmtree(carpeta)
+        os.makedirs(carpeta, exist_ok=True)
+        with open(path_firma, "w", encoding="utf-8") as f:
+            json.dump(firma, f)
+
+        self._hechos = {}  # id -> (bloque, fila, huella)
+        self._bloques = {}
+        self._siguiente = 0
+        self._lock = threading.Lock()
+        for nombre in sorted(os.listdir(carpeta)):
+            if nombre.startswith("bloque_") and nombre.endswith(".json"):
+                numero = int(nombre[len("bloque_"):-len(".json")])
+                with open(os.path.join(carpeta, nombre), "r", encoding="utf-8") as f:
+                    meta = json.load(f)
+                for fila, (id_pt, huella) in enumerate(zip(meta["ids"], meta["huellas"])):
+                    self._hechos[id_pt] = (numero, fila, huella)
+                self._siguiente = max(self._siguiente, numero + 1)
+
+    def __len__(self):
+        return len(self._hechos)
+
+    def hecho(self, id_paciente, huella):
+        registro = self._hechos.get(id_paciente)
+        return registro is not None and registro[2] == huella
+
+    def nuevo_bloque(self):
+        with self._lock:
+            numero = self._siguiente
+            self._siguiente += 1
+            return numero
+
+    def guardar_bloque(self, numero, ids, secuencias, huellas, vectores):
+        base = os.path.join(self.carpeta, f"bloque_{numero:06d}")
+        np.save(base + ".npy", np.asarray(vectores, dtype=np.float32))
+        with open(base + ".json.tmp", "w", encoding="utf-8") as f:
+            json.dump({"ids": ids, "secuencias": secuencias, "huellas": huellas}, f, ensure_ascii=False)
+        os.replace(base + ".json.tmp", base + ".json")
+        with self._lock:
+            for fila, (id_pt, huella) in enumerate(zip(ids, huellas)):
+                self._hechos[id_pt] = (numero, fila, huella)
+
+    def obtener(self, id_paciente):
+        """(secuencia, vector) de un paciente ya vectorizado."""
+        numero, fila, _ = self._hechos[id_paciente]
+        bloque = self._bloques.get(numero)
+        if bloque is None:
+            base = os.path.join(self.carpeta, f"bloque_{numero:06d}")
+            with open(base + ".json", "r", encoding="utf-8") as f:
+                secuencias = json.load(f)["secuencias"]
+            bloque = self._bloques[numero] = (secuencias, np.load(base + ".npy", mmap_mode="r"))
+        return bloque[0][fila], bloque[1][fila]
+
+
+def descartar_checkpoint(carpeta):
+    """Se llama cuando el snapshot final ya quedó guardado."""
+    if os.path.exists(carpeta):
+        shutil.rmtree(carpeta)
+
+
+def construir_snapshot_paralelo(previo, repo, tokenizador, engine, carpeta_checkpoint, procesos=None,
+                                hilos=4, tamano_bloque=256, tamano_lote=32, progreso=None, filtros=None):
+    """
+    Equivalente a indexacion.actualizar_snapshot, en tubería:
+    lectura del repositorio → tokenización (procesos) → embeddings (hilos) → bloque en disco.
+    Como mucho 2x procesos bloques esperan tokenización y 2x hilos esperan
+    embeddings; la lectura del histórico se frena hasta que haya cupo.
+    `progreso(revisados, vectorizados, pacientes_por_segundo)` se llama al cerrar cada bloque.
+    Retorna (snapshot, delta, metricas).
+    """
+    if previo is not None and not previo.es_compatible(engine.modelo_embeddings, tokenizador.maestro.version):
+        previo = None
+    procesos = procesos or os.cpu_count()
+
+    checkpoint = CheckpointConstruccion(carpeta_checkpoint, engine.modelo_embeddings,
+                                        tokenizador.maestro.version)
+    delta = DeltaHistorico()
+    orden = []
+    metricas = {"vectorizados": 0, "reanudados": 0}
+    inicio = time.perf_counter()
+
+    def vectorizar(numero, ids, huellas, secuencias):
+        """Se ejecuta en el pool de hilos (I/O-bound)."""
+        vectores = engine.generar_embeddings_lote(secuencias, tamano_lote)
+        checkpoint.guardar_bloque(numero, ids, secuencias, huellas, vectores)
+        return len(ids)
+
+    # spawn: este proceso ya tiene hilos vivos cuando el pool crea workers
+    contexto = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(procesos, mp_context=contexto, initializer=_iniciar_worker,
+                             initargs=(tokenizador.configuracion(),)) as pool_procesos, \
+            ThreadPoolExecutor(hilos) as pool_hilos:
+        tokenizando = deque()
+        vectorizando = set()
+        bloque = []
+
+        def drenar(limite):
+            nonlocal vectorizando
+            while len(vectorizando) > limite:
+                listos, vectorizando = wait(vectorizando, return_when=FIRST_COMPLETED)
+                for futuro in listos:
+                    metricas["vectorizados"] += futuro.result()
+                if progreso:
+                    progreso(len(orden), metricas["vectorizados"],
+                             metricas["vectorizados"] / (time.perf_counter() - inicio))
+
+        def avanzar():
+            ids, huellas, futuro = tokenizando.popleft()
+            secuencias = futuro.result()
+            drenar(2 * hilos - 1)
+            vectorizando.add(pool_hilos.submit(vectorizar, checkpoint.nuevo_bloque(), ids, huellas, secuencias))
+
+        def despachar():
+            ids = [pt['id'] for pt, _ in bloque]
+            huellas = [huella for _, huella in bloque]
+            tokenizando.append((ids, huellas, pool_procesos.submit(_tokenizar_bloque, [pt for pt, _ in bloque])))
+            bloque.clear()
+            while len(tokenizando) > 2 * procesos:
+                avanzar()
+
+        for pt in repo.iterar_historico(**(filtros or {})):
+            huella = huella_paciente(pt)
+            orden.append((pt['id'], huella))
+            pos = previo.posicion(pt['id']) if previo is not None else None
+            if pos is not None and previo.huellas[pos] == huella:
+                delta.sin_cambios += 1
+                continue
+
+            (delta.agregados if pos is None else delta.modificados).append(pt['id'])
+            if checkpoint.hecho(pt['id'], huella):
+                metricas["reanudados"] += 1
+                continue
+            bloque.append((pt, huella))
+            if len(bloque) == tamano_bloque:
+                despachar()
+        if bloque:
+            despachar()
+        while tokenizando:
+            avanzar()
+        drenar(0)
+
+    ids, huellas, secuencias, vectores = [], [], [], None
+    for fila, (id_pt, huella) in enumerate(orden):
+        pos = previo.posicion(id_pt) if previo is not None else None
+        if pos is not None and previo.huellas[pos] == huella:
+            secuencia, vector = previo.secuencias[pos], previo.vectores[pos]
+        else:
+            secuencia, vector = checkpoint.obtener(id_pt)
+        if vectores is None:
+            vectores = np.empty((len(orden), len(vector)), dtype=np.float32)
+        vectores[fila] = vector
+        ids.append(id_pt)
+        huellas.append(huella)
+        secuencias.append(secuencia)
+
+    if previo is not None:
+        vistos = set(ids)
+        delta.eliminados = [id_pt for id_pt in previo.ids if id_pt not in vistos]
+
+    snapshot = SnapshotIndice(
+        ids, secuencias, vectores if vectores is not None else [],
+        modelo_embeddings=engine.modelo_embeddings,
+        version_ontologia=tokenizador.maestro.version,
+        huellas=huellas,
+        base=previo.version if previo is not None else None,
+        delta=delta.como_dict() if previo is not None else None,
+    )
+    metricas["segundos"] = time.perf_counter() - inicio
+    metricas["pacientes_por_segundo"] = (metricas["vectorizados"] / metricas["segundos"]
+                                         if metricas["segundos"] else 0.0)
+    return snapshot, delta, metricas
@@ -0,0 +1,134 @@
+"""
+MÓDULO: REGLAS
+Responsabilidad: Pre-filtro determinístico de fragmentación sobre el historial de eventos.
+Resuelve los casos evidentes (sin evento previo en otra IPS, diagnóstico de rutina,
+complicación explícita tras un procedimiento en otra IPS) y sólo escala al agente los ambiguos.
+"""
+import threading
+from datetime import date
+
+FRAGMENTACION = "FRAGMENTACION"
+CORRECTA = "CORRECTA"
+ESCALAR = "ESCALAR"
+
+# CIE-10 que por definición son complicaciones de una atención previa:
+# T80-T88 (complicaciones de atención médica y quirúrgica) y trastornos posprocedimiento
+PREFIJOS_COMPLICACION = (
+    "T80", "T81", "T82", "T83", "T84", "T85", "T86", "T87", "T88",
+    "E89", "G97", "H59", "I97", "J95", "K91", "M96", "N99",
+)
+
+# Diagnósticos que pueden ser complicación o un cuadro independiente: los decide el agente
+PREFIJOS_SOSPECHOSOS = ("A41", "I26", "I80", "J18", "L03", "N39", "R50")
+
+# Un evento previo cuenta como procedimiento si trae código CUPS (o lista de
+# procedimientos) o si su tipo de servicio lo declara
+CAMPOS_PROCEDIMIENTO = ("cod_procedimiento", "procedimientos")
+TIPOS_PROCEDIMIENTO = ("PROCEDIMIENTO", "CIRUGIA", "QUIRURGICO")
+
+
+def _fecha(texto):
+    return date.fromisoformat(texto[:10])
+
+
+def _codigo(texto):
+    return (texto or "").replace(".", "").strip().upper()
+
+
+class PrefiltroFragmentacion:
+    """
+    Clasifica un evento nuevo contra el historial en FRAGMENTACION, CORRECTA
+    o ESCALAR. Lleva la cuenta de cuántos casos se resolvieron sin LLM; es
+    seguro compartir una instancia entre sesiones/hilos.
+    """
+    def __init__(self, ventana_dias=30, prefijos_complicacion=PREFIJOS_COMPLICACION,
+                 prefijos_sospechosos=PREFIJOS_SOSPECHOSOS):
+        self.ventana_dias = ventana_dias
+        # tuple: str.startswith evalúa todos los prefijos en C
+        self.prefijos_complicacion = tuple(_codigo(p) for p in prefijos_complicacion)
+        self.prefijos_sospechosos = tuple(_codigo(p) for p in prefijos_sospechosos)
+        self._conteo = {FRAGMENTACION: 0, CORRECTA: 0, ESCALAR: 0}
+        self._lock = threading.Lock()
+
+    def eventos_en_ventana(self, nuevo, historial, ventana_dias=None):
+        """Eventos previos (o del mismo día) dentro de la ventana, del más reciente al más antiguo."""
+        ventana = self.ventana_dias if ventana_dias is None else ventana_dias
+        fecha_nueva = _fecha(nuevo['fecha'])
+        previos = []
+        for evento in historial:
+            if evento.get('id_evento') is not None and evento.get('id_evento') == nuevo.get('id_evento'):
+                continue
+            dias = (fecha_nueva - _fecha(evento['fecha'])).days
+            if 0 <= dias <= ventana:
+                previos.append((dias, evento))
+        previos.sort(key=lambda x: x[0])
+        return [evento for _, evento in previos]
+
+    @staticmethod
+    def es_procedimiento(evento):
+        if any(evento.get(campo) for campo in CAMPOS_PROCEDIMIENTO):
+            return True
+        return str(evento.get('tipo') or "").upper() in TIPOS_PROCEDIMIENTO
+
+    def _resultado(self, decision, regla, evidencia, explicacion):
+        with self._lock:
+            self._conteo[decision] += 1
+        causa = evidencia[0] if evidencia else None
+        return {
+            "decision": decision,
+            "regla": regla,
+            "evidencia": evidencia,
+            "es_fragmentacion": decision == FRAGMENTACION,
+            "causa_raiz": (f"{causa['descripcion']} ({causa['prestador']}, {causa['fecha']})"
+                           if causa else "Ninguna"),
+            "explicacion": explicacion,
+            # El porcentaje de ahorro lo estima el agente; la regla no lo calcula
+            "ahorro_potencial": 0.0 if decision == CORRECTA else None,
+        }
+
+    def clasificar(self, nuevo, historial, ventana_dias=None):
+        ventana = self.ventana_dias if ventana_dias is None else ventana_dias
+        previos = self.eventos_en_ventana(nuevo, historial, ventana)
+        otras_ips = [e for e in previos if e['prestador'] != nuevo['prestador']]
+        codigo = _codigo(nuevo.get('cod_diagnostico'))
+
+        if not previos:
+            return self._resultado(CORRECTA, "SIN_EVENTO_PREVIO", [],
+                                   f"No hay atenciones previas en los {ventana} días anteriores.")
+        if not otras_ips:
+            return self._resultado(CORRECTA, "MISMA_IPS", previos,
+                                   "Todas las atenciones de la ventana son de la misma IPS: "
+                                   "no hay fragmentación de red.")
+        if not codigo:
+            return self._resultado(ESCALAR, "SIN_DIAGNOSTICO", otras_ips,
+                                   "La factura no trae diagnóstico; requiere revisión del agente.")
+        if codigo.startswith(self.prefijos_complicacion):
+            procedimientos = [e for e in otras_ips if self.es_procedimiento(e)]
+            if not procedimientos:
+                # Consultas o dispensaciones previas no bastan para el veredicto duro
+                return self._resultado(ESCALAR, "COMPLICACION_SIN_PROCEDIMIENTO", otras_ips,
+                                       f"El diagnóstico {codigo} es una complicación, pero en la ventana "
+                                       f"no hay un procedimiento previo en otra IPS.")
+            return self._resultado(FRAGMENTACION, "COMPLICACION_OTRA_IPS", procedimientos,
+                                   f"El diagnóstico {codigo} es una complicación de atención previa y "
+                                   f"se factura en {nuevo['prestador']} dentro de los {ventana} días "
+                                   f"siguientes a un procedimiento en otra IPS.")
+        if codigo.startswith(self.prefijos_sospechosos):
+            return self._resultado(ESCALAR, "POSIBLE_COMPLICACION", otras_ips,
+                                   f"El diagnóstico {codigo} puede derivar de la atención previa en otra IPS.")
+        return self._resultado(CORRECTA, "DIAGNOSTICO_RUTINA", otras_ips,
+                               f"El diagnóstico {codigo} no corresponde a una complicación.")
+
+    def estadisticas(self):
+        with self._lock:
+            conteo = dict(self._conteo)
+        total = sum(conteo.values())
+        resueltos = conteo[FRAGMENTACION] + conteo[CORRECTA]
+        return {
+            "total": total,
+            "resueltos_por_reglas": resueltos,
+            "escalados": conteo[ESCALAR],
+            "fragmentacion": conteo[FRAGMENTACION],
+            "correctos": conteo[CORRECTA],
+            "tasa_cortocircuito": resueltos / total if total else 0.0,
+        }
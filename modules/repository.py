@@ -5,6 +5,52 @@ Simula la conexión con el Data Warehouse (Tuva).
 """
 import json
 import os
+import re
+
+from modules.metricas import registro
+
+_SEPARADORES = re.compile(r"[\s,]*")
+
+
+def _iterar_arreglo_json(f, tamano_bloque=1 << 16):
+    """
+    Parser incremental de un arreglo JSON de objetos: entrega cada elemento
+    apenas termina de leerse, sin cargar el archivo completo en memoria.
+    """
+    decoder = json.JSONDecoder()
+    buffer = f.read(tamano_bloque).lstrip()
+    if not buffer:
+        return
+    if not buffer.startswith("["):
+        raise ValueError("Se esperaba un arreglo JSON de pacientes")
+    pos = 1
+
+    while True:
+        pos = _SEPARADORES.match(buffer, pos).end()
+        if pos == len(buffer):
+            bloque = f.read(tamano_bloque)
+            if not bloque:
+                raise ValueError("Arreglo JSON incompleto")
+            buffer, pos = buffer[pos:] + bloque, 0
+            continue
+        if buffer[pos] == "]":
+            return
+
+        try:
+            obj, fin = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            # Elemento partido entre bloques: leer más y reintentar
+            bloque = f.read(tamano_bloque)
+            if not bloque:
+                raise
+            buffer, pos = buffer[pos:] + bloque, 0
+            continue
+
+        yield obj
+        pos = fin
+        if pos > tamano_bloque:
+            buffer, pos = buffer[pos:], 0
+
 
 class TuvaRepository:
     def __init__(self, data_folder="datos_rip"):
@@ -22,19 +68,44 @@ class TuvaRepository:
             os.path.join(self.folder_path, "nuevo_evento.json")
         )
 
+    def get_ruta_ndjson(self):
+        """Extracto masivo: un paciente JSON por línea."""
+        return os.path.join(self.folder_path, "historial_paciente.ndjson")
+
     def cargar_datos(self):
         path_hist, path_new = self.get_rutas()
         
         historico = []
         nuevo = {}
         
-        # Carga segura con manejo de errores
-        if os.path.exists(path_hist):
-            with open(path_hist, 'r', encoding='utf-8') as f:
-                historico = json.load(f)
-        
-        if os.path.exists(path_new):
-            with open(path_new, 'r', encoding='utf-8') as f:
-                nuevo = json.load(f)
+        with registro.span("carga_datos", fuente=path_hist) as span:
+            # Carga segura con manejo de errores
+            if os.path.exists(path_hist):
+                with open(path_hist, 'r', encoding='utf-8') as f:
+                    historico = json.load(f)
+            
+            if os.path.exists(path_new):
+                with open(path_new, 'r', encoding='utf-8') as f:
+                    nuevo = json.load(f)
+            span.atributos["pacientes"] = len(historico)
                 
-        return historico, nuevo, path_hist, path_new
\ No newline at end of file
+        return historico, nuevo, path_hist, path_new
+
+    def iterar_historico(self):
+        """
+        Generador de pacientes en streaming (memoria constante).
+        Prefiere historial_paciente.ndjson; si no existe, parsea
+        incrementalmente el arreglo de historial_paciente.json.
+        """
+        path_ndjson = self.get_ruta_ndjson()
+        path_hist, _ = self.get_rutas()
+
+        if os.path.exists(path_ndjson):
+            with open(path_ndjson, 'r', encoding='utf-8') as f:
+                for linea in f:
+                    linea = linea.strip()
+                    if linea:
+                        yield json.loads(linea)
+        elif os.path.exists(path_hist):
+            with open(path_hist, 'r', encoding='utf-8') as f:
+                yield from _iterar_arreglo_json(f)
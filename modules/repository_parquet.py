@@ -0,0 +1,272 @@
+"""
+MÓDULO: REPOSITORY (PARQUET)
+Responsabilidad: Backend columnar del Data Warehouse (Tuva) sobre Parquet particionado.
+Filtra por fecha, régimen, IPS o diagnóstico leyendo sólo las particiones y columnas necesarias,
+y entrega el mismo diccionario de paciente que consume TokenizadorCoMET.
+"""
+import json
+import os
+import shutil
+from datetime import date
+
+from modules.metricas import registro
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+except ImportError:  # Dependencia opcional: pip install pyarrow
+    pa = None
+
+_LISTAS_EVENTO = ("diagnosticos", "procedimientos", "medicamentos")
+
+
+def _esquemas():
+    def lista(campo_codigo):
+        return pa.list_(pa.struct([(campo_codigo, pa.string()), ("desc", pa.string())]))
+
+    pacientes = pa.schema([
+        ("id", pa.string()),
+        ("sexo", pa.string()),
+        ("edad", pa.int16()),
+        ("regimen", pa.string()),
+        ("tipo_afiliado", pa.string()),
+    ])
+    eventos = pa.schema([
+        ("id_paciente", pa.string()),
+        ("fecha", pa.date32()),
+        ("anio", pa.int16()),
+        ("cod_ips", pa.string()),
+        ("especialidad_medico", pa.string()),
+        ("diagnosticos", lista("cod")),
+        ("procedimientos", lista("cod")),
+        ("medicamentos", lista("atc")),
+    ])
+    return pacientes, eventos
+
+
+class TuvaRepositoryParquet:
+    """
+    Dos datasets Parquet con particionado Hive dentro de `data_folder`:
+      pacientes/regimen=<REGIMEN>/...   perfil del afiliado
+      eventos/anio=<AAAA>/...           un registro por atención
+    Los eventos sin una lista (p. ej. sin 'procedimientos') se guardan como
+    null y se restauran sin la llave, para que la tokenización sea idéntica.
+    """
+    def __init__(self, data_folder="datos_parquet"):
+        if pa is None:
+            raise ImportError("TuvaRepositoryParquet requiere 'pyarrow' (pip install pyarrow)")
+        self.folder_path = data_folder
+        self.path_pacientes = os.path.join(data_folder, "pacientes")
+        self.path_eventos = os.path.join(data_folder, "eventos")
+        self.esquema_pacientes, self.esquema_eventos = _esquemas()
+
+    # ------------------------------------------------------------------
+    # Escritura
+    # ------------------------------------------------------------------
+    def importar(self, pacientes, tamano_lote=50_000):
+        """Reemplaza el warehouse con un iterable de pacientes (p. ej. TuvaRepository.iterar_historico())."""
+        for path in (self.path_pacientes, self.path_eventos):
+            if os.path.exists(path):
+                shutil.rmtree(path)
+
+        total, n_lote, lote = 0, 0, []
+        for pt in pacientes:
+            lote.append(pt)
+            if len(lote) == tamano_lote:
+                self._escribir_lote(lote, n_lote)
+                total, n_lote, lote = total + len(lote), n_lote + 1, []
+        if lote:
+            self._escribir_lote(lote, n_lote)
+            total += len(lote)
+        return total
+
+    def _escribir_lote(self, pacientes, n_lote):
+        filas_p, filas_e = [], []
+        for pt in pacientes:
+            perfil = pt['perfil']
+            filas_p.append({
+                "id": pt['id'],
+                "sexo": perfil.get('sexo'),
+                "edad": perfil.get('edad'),
+                "regimen": perfil.get('regimen'),
+                "tipo_afiliado": perfil.get('tipo_afiliado'),
+            })
+            for evt in pt['eventos']:
+                fecha = date.fromisoformat(evt['fecha'])
+                fila = {
+                    "id_paciente": pt['id'],
+                    "fecha": fecha,
+                    "anio": fecha.year,
+                    "cod_ips": evt.get('cod_ips'),
+                    "especialidad_medico": evt.get('especialidad_medico'),
+                }
+                for campo in _LISTAS_EVENTO:
+                    fila[campo] = evt.get(campo)
+                filas_e.append(fila)
+
+        plantilla = f"lote{n_lote:05d}-{{i}}.parquet"
+        ds.write_dataset(
+            pa.Table.from_pylist(filas_p, schema=self.esquema_pacientes), self.path_pacientes,
+            format="parquet", partitioning=["regimen"], partitioning_flavor="hive",
+            basename_template=plantilla, existing_data_behavior="overwrite_or_ignore",
+        )
+        ds.write_dataset(
+            pa.Table.from_pylist(filas_e, schema=self.esquema_eventos), self.path_eventos,
+            format="parquet", partitioning=["anio"], partitioning_flavor="hive",
+            basename_template=plantilla, existing_data_behavior="overwrite_or_ignore",
+        )
+
+    # ------------------------------------------------------------------
+    # Lectura con pushdown
+    # ------------------------------------------------------------------
+    def _dataset(self, path, esquema, particion):
+        return ds.dataset(
+            path, format="parquet", schema=esquema,
+            partitioning=ds.partitioning(pa.schema([esquema.field(particion)]), flavor="hive"),
+        )
+
+    def _filtro_eventos(self, fecha_desde=None, fecha_hasta=None, cod_ips=None):
+        filtro = None
+
+        def y(expr):
+            return expr if filtro is None else filtro & expr
+
+        # Se filtra también por 'anio' para que Arrow descarte particiones completas
+        if fecha_desde:
+            d = date.fromisoformat(fecha_desde)
+            filtro = y((ds.field("anio") >= d.year) & (ds.field("fecha") >= pa.scalar(d, pa.date32())))
+        if fecha_hasta:
+            d = date.fromisoformat(fecha_hasta)
+            filtro = y((ds.field("anio") <= d.year) & (ds.field("fecha") <= pa.scalar(d, pa.date32())))
+        if cod_ips:
+            filtro = y(ds.field("cod_ips").isin(_como_lista(cod_ips)))
+        return filtro
+
+    def consultar_eventos(self, columnas=None, fecha_desde=None, fecha_hasta=None, cod_ips=None):
+        """Consulta poblacional: tabla Arrow con sólo las columnas pedidas."""
+        eventos = self._dataset(self.path_eventos, self.esquema_eventos, "anio")
+        filtro = self._filtro_eventos(fecha_desde, fecha_hasta, cod_ips)
+        return eventos.to_table(columns=columnas, filter=filtro)
+
+    def _pacientes_con_diagnostico(self, eventos, filtro, diagnosticos):
+        tabla = eventos.to_table(columns=["id_paciente", "diagnosticos"], filter=filtro)
+        if tabla.num_rows == 0:
+            return pa.array([], pa.string())
+        dx = tabla.column("diagnosticos").combine_chunks()
+        codigos = pc.struct_field(pc.list_flatten(dx), "cod")
+        padres = pc.list_parent_indices(dx)
+        filas = pc.filter(padres, pc.is_in(codigos, value_set=pa.array(_como_lista(diagnosticos))))
+        return pc.unique(pc.take(tabla.column("id_paciente"), filas))
+
+    def _datasets_por_lote(self, path, esquema, particion):
+        """
+        {lote: dataset} con los archivos de cada lote de importar() (prefijo
+        'loteNNNNN-'). Un paciente y todos sus eventos se escriben en el mismo
+        lote, así que cada lote se puede reunir por separado. Si hay archivos
+        de otro origen se entrega un único grupo con todo.
+        """
+        rutas = {}
+        for fragmento in self._dataset(path, esquema, particion).get_fragments():
+            nombre = os.path.basename(fragmento.path)
+            lote = nombre.split("-", 1)[0] if nombre.startswith("lote") and "-" in nombre else None
+            rutas.setdefault(lote, []).append(fragmento.path)
+        if None in rutas:
+            rutas = {None: [ruta for grupo in rutas.values() for ruta in grupo]}
+        particionado = ds.partitioning(pa.schema([esquema.field(particion)]), flavor="hive")
+        return {
+            lote: ds.dataset(sorted(grupo), format="parquet", schema=esquema,
+                             partitioning=particionado, partition_base_dir=path)
+            for lote, grupo in rutas.items()
+        }
+
+    def iterar_historico(self, fecha_desde=None, fecha_hasta=None, regimen=None,
+                         cod_ips=None, diagnostico=None):
+        """
+        Pacientes con la misma forma que historial_paciente.json.
+        - fecha_desde/fecha_hasta/cod_ips restringen los eventos entregados.
+        - regimen y diagnostico (código CIE-10 o lista) restringen los pacientes.
+        Con filtros de eventos se omiten los pacientes sin eventos que cumplan.
+        Se reúne lote por lote de importar(): la memoria queda acotada por
+        `tamano_lote` pacientes, no por el tamaño del warehouse.
+        """
+        if not os.path.exists(self.path_pacientes):
+            return
+
+        lotes_p = self._datasets_por_lote(self.path_pacientes, self.esquema_pacientes, "regimen")
+        lotes_e = (self._datasets_por_lote(self.path_eventos, self.esquema_eventos, "anio")
+                   if os.path.exists(self.path_eventos) else {})
+        if None in lotes_p or None in lotes_e:
+            # Archivos que no vienen de importar(): no se puede asumir la co-ubicación
+            lotes_p = {None: self._dataset(self.path_pacientes, self.esquema_pacientes, "regimen")}
+            lotes_e = ({None: self._dataset(self.path_eventos, self.esquema_eventos, "anio")}
+                       if os.path.exists(self.path_eventos) else {})
+
+        filtro_p = ds.field("regimen").isin(_como_lista(regimen)) if regimen else None
+        filtro_base = self._filtro_eventos(fecha_desde, fecha_hasta, cod_ips)
+        # regimen filtra pacientes, no eventos: un afiliado sin atenciones se entrega igual.
+        # diagnostico sí exige eventos (el paciente sólo califica por ellos)
+        hay_filtro_eventos = filtro_base is not None or bool(diagnostico)
+
+        for lote in sorted(lotes_p, key=lambda clave: clave or ""):
+            tabla_p = lotes_p[lote].to_table(filter=filtro_p)
+            if tabla_p.num_rows == 0:
+                continue
+            eventos = lotes_e.get(lote)
+
+            eventos_por_paciente = {}
+            if eventos is not None:
+                ids = tabla_p.column("id").combine_chunks() if regimen else None
+                if diagnostico:
+                    con_dx = self._pacientes_con_diagnostico(eventos, filtro_base, diagnostico)
+                    ids = con_dx if ids is None else pc.filter(con_dx, pc.is_in(con_dx, value_set=ids))
+                filtro_e = filtro_base
+                if ids is not None:
+                    expr = ds.field("id_paciente").isin(ids)
+                    filtro_e = expr if filtro_e is None else filtro_e & expr
+                for bloque in eventos.to_batches(filter=filtro_e):
+                    for fila in bloque.to_pylist():
+                        eventos_por_paciente.setdefault(fila['id_paciente'], []).append(_evento_desde_fila(fila))
+
+            for fila in tabla_p.to_pylist():
+                evts = eventos_por_paciente.get(fila['id'])
+                if evts is None and hay_filtro_eventos:
+                    continue
+                yield {
+                    "id": fila['id'],
+                    "perfil": {
+                        "sexo": fila['sexo'],
+                        "edad": fila['edad'],
+                        "regimen": fila['regimen'],
+                        "tipo_afiliado": fila['tipo_afiliado'],
+                    },
+                    "eventos": evts or [],
+                }
+
+    def cargar_datos(self):
+        """Misma firma que TuvaRepository.cargar_datos (nuevo_evento.json junto al dataset)."""
+        path_new = os.path.join(self.folder_path, "nuevo_evento.json")
+        nuevo = {}
+        with registro.span("carga_datos", fuente=self.folder_path) as span:
+            if os.path.exists(path_new):
+                with open(path_new, 'r', encoding='utf-8') as f:
+                    nuevo = json.load(f)
+            historico = list(self.iterar_historico())
+            span.atributos["pacientes"] = len(historico)
+        return historico, nuevo, self.folder_path, path_new
+
+
+def _como_lista(valor):
+    return list(valor) if isinstance(valor, (list, tuple, set)) else [valor]
+
+
+def _evento_desde_fila(fila):
+    evt = {
+        "fecha": fila['fecha'].isoformat(),
+        "cod_ips": fila['cod_ips'],
+        "especialidad_medico": fila['especialidad_medico'],
+    }
+    for campo in _LISTAS_EVENTO:
+        if fila[campo] is not None:
+            evt[campo] = fila[campo]
+    return evt
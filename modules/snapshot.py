@@ -0,0 +1,252 @@
+"""
+MÓDULO: SNAPSHOT
+Responsabilidad: Persistir el índice vectorial histórico pre-calculado.
+Permite que la app arranque leyendo vectores del disco en lugar de re-vectorizar.
+"""
+import json
+import os
+import shutil
+from datetime import datetime
+
+import numpy as np
+
+from modules.indice import (normalizar_l2, IndiceExacto, IndiceIVF, IndiceCuantizado,
+                            centroides_ivf, asignar_listas)
+from modules.lexico import IndiceLexico
+
+# 2: vectores L2-normalizados en disco
+# 3: huella de contenido por paciente (re-indexación incremental)
+FORMATO_VERSION = 3
+
+# Por debajo de este tamaño la búsqueda exacta ya es de milisegundos
+UMBRAL_IVF = 50_000
+# Listas del IVF que se persiste junto a los snapshots grandes
+N_LISTAS_IVF = 256
+# Filas copiadas por bloque al escribir la matriz reordenada
+_BLOQUE_ESCRITURA = 65536
+
+# Cada guardar() publica un directorio v_<fecha> nuevo y cambia este puntero
+PUNTERO = "ACTUAL"
+# Versiones que se conservan: la anterior puede seguir mapeada por procesos vivos
+VERSIONES_CONSERVADAS = 2
+# Archivos del formato sin versiones (sueltos en la carpeta): los únicos que se retiran
+ARCHIVOS_SIN_VERSION = ("vectores.npy", "meta.json", "ivf_centroides.npy", "ivf_limites.npy")
+
+
+def version_vigente(carpeta):
+    """Nombre de la versión publicada en `carpeta` (None si no hay puntero)."""
+    try:
+        with open(os.path.join(carpeta, PUNTERO), "r", encoding="utf-8") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def ruta_vigente(carpeta):
+    """Directorio de la versión vigente; sin puntero, la carpeta misma (formato anterior, sin versiones)."""
+    version = version_vigente(carpeta)
+    return os.path.join(carpeta, version) if version else carpeta
+
+
+def publicar_version(carpeta, escribir, conservar=VERSIONES_CONSERVADAS, heredados=ARCHIVOS_SIN_VERSION):
+    """
+    `escribir(directorio)` llena un directorio de versión nuevo; al terminar
+    se publica cambiando el puntero con os.replace (atómico). Nunca se borra
+    la versión que otros procesos pueden tener mapeada: sólo las más viejas
+    que las `conservar` últimas. `heredados` son los nombres del formato sin
+    versiones que se retiran después; el resto de la carpeta no se toca.
+    Retorna el nombre de la versión.
+    """
+    os.makedirs(carpeta, exist_ok=True)
+    version = f"v_{datetime.now():%Y%m%dT%H%M%S%f}"
+    temporal = os.path.join(carpeta, version + ".tmp")
+    os.makedirs(temporal)
+    escribir(temporal)
+    os.replace(temporal, os.path.join(carpeta, version))
+
+    puntero_temporal = os.path.join(carpeta, PUNTERO + ".tmp")
+    with open(puntero_temporal, "w", encoding="utf-8") as f:
+        f.write(version)
+    os.replace(puntero_temporal, os.path.join(carpeta, PUNTERO))
+    _podar_versiones(carpeta, conservar, heredados)
+    return version
+
+
+def _podar_versiones(carpeta, conservar, heredados):
+    # Los .tmp son publicaciones en curso (u otro proceso): no cuentan ni se borran
+    versiones = sorted(nombre for nombre in os.listdir(carpeta)
+                       if nombre.startswith("v_") and not nombre.endswith(".tmp")
+                       and os.path.isdir(os.path.join(carpeta, nombre)))
+    # En Windows un memmap abierto impide borrar: se reintenta en la próxima publicación
+    for nombre in versiones[:-conservar]:
+        shutil.rmtree(os.path.join(carpeta, nombre), ignore_errors=True)
+    # Formato sin versiones: se retira cuando ya hay `conservar` versiones
+    if len(versiones) >= conservar:
+        for nombre in heredados:
+            ruta = os.path.join(carpeta, nombre)
+            if os.path.isdir(ruta):
+                shutil.rmtree(ruta, ignore_errors=True)
+            elif os.path.exists(ruta):
+                try:
+                    os.remove(ruta)
+                except OSError:
+                    pass
+
+
+class SnapshotIndice:
+    """
+    Fotografía versionada del histórico vectorizado.
+    En disco es una carpeta con `vectores.npy` (float32, L2-normalizados) y
+    `meta.json` (ids, secuencias, huellas del registro crudo, modelo de
+    embeddings y versión de la ontología).
+    Al cargar, la matriz se mapea en memoria: la búsqueda exacta es un
+    producto matriz-vector y los workers del mismo host comparten páginas.
+    Los snapshots grandes guardan además el IVF entrenado (`ivf_centroides.npy`,
+    `ivf_limites.npy`) con las filas agrupadas por lista, y se abren sin k-means.
+    Cada guardado es una versión inmutable (ver publicar_version); `base` (la
+    versión de la que se derivó) y `delta` (qué pacientes cambiaron) sirven
+    para aplicar el cambio en sitio a un índice ya cargado.
+    """
+    def __init__(self, ids, secuencias, vectores, modelo_embeddings, version_ontologia,
+                 creado=None, huellas=None, base=None, delta=None):
+        self.ids = list(ids)
+        self.secuencias = list(secuencias)
+        self.huellas = list(huellas) if huellas is not None else [None] * len(self.ids)
+        self.vectores = normalizar_l2(vectores) if len(ids) else np.empty((0, 0), dtype=np.float32)
+        self.modelo_embeddings = modelo_embeddings
+        self.version_ontologia = version_ontologia
+        self.creado = creado or datetime.now().isoformat(timespec="seconds")
+        self.base = base
+        self.delta = delta
+        self.version = None
+        self._posiciones = None
+        self._ivf = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def posicion(self, id_paciente):
+        """Fila del paciente en la matriz (None si no está en el snapshot)."""
+        if self._posiciones is None:
+            self._posiciones = {id_pt: i for i, id_pt in enumerate(self.ids)}
+        return self._posiciones.get(id_paciente)
+
+    def secuencia_de(self, id_paciente):
+        return self.secuencias[self.posicion(id_paciente)]
+
+    def vector_de(self, id_paciente):
+        return self.vectores[self.posicion(id_paciente)]
+
+    def construir_indice(self, cuantizacion=None):
+        """
+        Índice top-k sobre los vectores del snapshot, sin copiar la matriz mapeada:
+        el IVF persistido por guardar() si existe, si no búsqueda exacta.
+        `cuantizacion` ('int8' o 'pq') deja en RAM sólo códigos compactos y
+        re-ordena los candidatos contra vectores.npy mapeado desde el disco.
+        """
+        if cuantizacion:
+            return IndiceCuantizado.desde_matriz(self.ids, self.vectores, modo=cuantizacion)
+        if self._ivf is not None:
+            centroides, limites = self._ivf
+            return IndiceIVF.desde_listas(self.ids, self.vectores, centroides, limites)
+        # Sin copia: la matriz mapeada es compartida entre workers
+        return IndiceExacto.desde_matriz(self.ids, self.vectores)
+
+    def construir_indice_lexico(self):
+        """Índice BM25 sobre las secuencias del snapshot (pre-filtro de la búsqueda híbrida)."""
+        lexico = IndiceLexico()
+        for id_pt, sec in zip(self.ids, self.secuencias):
+            lexico.agregar(id_pt, IndiceLexico.tokens_de(sec))
+        return lexico
+
+    def es_compatible(self, modelo_embeddings, version_ontologia):
+        """Un snapshot sólo sirve si fue generado con el mismo modelo y ontología."""
+        return (self.modelo_embeddings == modelo_embeddings
+                and self.version_ontologia == version_ontologia)
+
+    def _escribir_vectores(self, carpeta, umbral_ivf):
+        """
+        Escribe vectores.npy. Desde `umbral_ivf` pacientes entrena el IVF aquí
+        (una vez, al construir) y guarda las filas agrupadas por lista.
+        Retorna el orden de filas escrito (None = el original).
+        """
+        path = os.path.join(carpeta, "vectores.npy")
+        if len(self) < umbral_ivf:
+            np.save(path, self.vectores)
+            return None
+
+        centroides = centroides_ivf(self.vectores, N_LISTAS_IVF)
+        asignacion = asignar_listas(self.vectores, centroides)
+        orden = np.argsort(asignacion, kind="stable")
+        limites = np.searchsorted(asignacion[orden], np.arange(N_LISTAS_IVF + 1))
+        salida = np.lib.format.open_memmap(path, mode="w+", dtype=np.float32, shape=self.vectores.shape)
+        for inicio in range(0, len(orden), _BLOQUE_ESCRITURA):
+            filas = orden[inicio:inicio + _BLOQUE_ESCRITURA]
+            salida[inicio:inicio + len(filas)] = self.vectores[filas]
+        salida.flush()
+        del salida
+        np.save(os.path.join(carpeta, "ivf_centroides.npy"), centroides)
+        np.save(os.path.join(carpeta, "ivf_limites.npy"), limites.astype(np.int64))
+        return orden
+
+    def guardar(self, carpeta, umbral_ivf=UMBRAL_IVF):
+        """Publica el snapshot como una versión nueva de `carpeta` (las anteriores no se tocan)."""
+        self.version = publicar_version(carpeta, lambda directorio: self.escribir(directorio, umbral_ivf))
+
+    def escribir(self, directorio, umbral_ivf=UMBRAL_IVF):
+        """Escribe los archivos del snapshot en `directorio` (ya existente), sin versionar."""
+        orden = self._escribir_vectores(directorio, umbral_ivf)
+        ids, secuencias, huellas = self.ids, self.secuencias, self.huellas
+        if orden is not None:
+            ids = [ids[i] for i in orden]
+            secuencias = [secuencias[i] for i in orden]
+            huellas = [huellas[i] for i in orden]
+        meta = {
+            "formato": FORMATO_VERSION,
+            "creado": self.creado,
+            "modelo_embeddings": self.modelo_embeddings,
+            "version_ontologia": self.version_ontologia,
+            "dimension": int(self.vectores.shape[1]) if self.vectores.ndim == 2 else 0,
+            "ids": ids,
+            "secuencias": secuencias,
+            "huellas": huellas,
+            "base": self.base,
+            "delta": self.delta,
+        }
+        with open(os.path.join(directorio, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+
+    @classmethod
+    def cargar(cls, carpeta):
+        """Retorna la versión vigente del snapshot o None si la carpeta no existe o es de otro formato."""
+        version = version_vigente(carpeta)
+        carpeta = ruta_vigente(carpeta)
+        path_meta = os.path.join(carpeta, "meta.json")
+        if not os.path.exists(path_meta):
+            return None
+
+        with open(path_meta, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("formato") != FORMATO_VERSION:
+            return None
+
+        # mmap copy-on-write: la carga no depende del tamaño del histórico y
+        # las páginas sólo se duplican si un proceso las modifica
+        vectores = np.load(os.path.join(carpeta, "vectores.npy"), mmap_mode="c")
+        snapshot = cls.__new__(cls)
+        snapshot.ids = meta["ids"]
+        snapshot.secuencias = meta["secuencias"]
+        snapshot.huellas = meta["huellas"]
+        snapshot.vectores = vectores
+        snapshot.modelo_embeddings = meta["modelo_embeddings"]
+        snapshot.version_ontologia = meta["version_ontologia"]
+        snapshot.creado = meta["creado"]
+        snapshot.base = meta.get("base")
+        snapshot.delta = meta.get("delta")
+        snapshot.version = version
+        snapshot._posiciones = None
+        snapshot._ivf = None
+        path_centroides = os.path.join(carpeta, "ivf_centroides.npy")
+        if os.path.exists(path_centroides):
+            snapshot._ivf = (np.load(path_centroides), np.load(os.path.join(carpeta, "ivf_limites.npy")))
+        return snapshot
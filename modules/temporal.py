@@ -0,0 +1,82 @@
+"""
+MÓDULO: TEMPORAL
+Responsabilidad: Índice por paciente de eventos ordenados por fecha.
+"Todos los eventos del paciente en los N días anteriores a la factura" se
+resuelve con dos búsquedas binarias en lugar de un barrido semántico.
+"""
+from bisect import bisect_left, bisect_right
+from datetime import date
+
+# Paciente implícito cuando los eventos no traen identificador (historial de un solo paciente)
+PACIENTE_UNICO = "__UNICO__"
+
+
+def _ordinal(fecha):
+    return date.fromisoformat(fecha[:10]).toordinal()
+
+
+class IndiceTemporal:
+    """
+    Por paciente, una lista de ordinales de fecha ordenada y la lista de
+    eventos alineada con ella. Consultar una ventana es O(log n + m), con m
+    el número de eventos devueltos.
+    """
+    def __init__(self, campo_fecha="fecha"):
+        self.campo_fecha = campo_fecha
+        self._fechas = {}
+        self._eventos = {}
+
+    def __len__(self):
+        return len(self._eventos)
+
+    def __contains__(self, id_paciente):
+        return id_paciente in self._eventos
+
+    def agregar(self, id_paciente, eventos):
+        """Reemplaza el historial del paciente (se ordena una sola vez)."""
+        pares = sorted(((_ordinal(e[self.campo_fecha]), e) for e in eventos), key=lambda x: x[0])
+        self._fechas[id_paciente] = [f for f, _ in pares]
+        self._eventos[id_paciente] = [e for _, e in pares]
+
+    def insertar(self, id_paciente, evento):
+        """Agrega un evento manteniendo el orden (p. ej. una factura ya auditada)."""
+        fechas = self._fechas.setdefault(id_paciente, [])
+        eventos = self._eventos.setdefault(id_paciente, [])
+        ordinal = _ordinal(evento[self.campo_fecha])
+        i = bisect_right(fechas, ordinal)
+        fechas.insert(i, ordinal)
+        eventos.insert(i, evento)
+
+    def eliminar(self, id_paciente):
+        self._fechas.pop(id_paciente, None)
+        self._eventos.pop(id_paciente, None)
+
+    def eventos_de(self, id_paciente):
+        return list(self._eventos.get(id_paciente, ()))
+
+    def ventana(self, id_paciente, fecha, dias=90):
+        """Eventos del paciente con fecha en [fecha - dias, fecha], en orden cronológico."""
+        fechas = self._fechas.get(id_paciente)
+        if not fechas:
+            return []
+        fin = _ordinal(fecha)
+        return self._eventos[id_paciente][bisect_left(fechas, fin - dias):bisect_right(fechas, fin)]
+
+    @classmethod
+    def desde_eventos(cls, eventos, campo_paciente="id_paciente", campo_fecha="fecha"):
+        """Eventos planos (FEV-RIPS); los que no traen paciente van a PACIENTE_UNICO."""
+        por_paciente = {}
+        for evento in eventos:
+            por_paciente.setdefault(evento.get(campo_paciente, PACIENTE_UNICO), []).append(evento)
+        indice = cls(campo_fecha)
+        for id_paciente, propios in por_paciente.items():
+            indice.agregar(id_paciente, propios)
+        return indice
+
+    @classmethod
+    def desde_pacientes(cls, pacientes, campo_fecha="fecha"):
+        """Pacientes en formato TuvaRepository ({'id', 'perfil', 'eventos'})."""
+        indice = cls(campo_fecha)
+        for pt in pacientes:
+            indice.agregar(pt['id'], pt['eventos'])
+        return indice
@@ -4,11 +4,49 @@ Responsabilidad: Implementar la lógica del paper CoMET.
 Convierte eventos discretos y fechas en una secuencia narrativa semántica.
 """
 from datetime import datetime
+import numpy as np
 from modules.knowledge import MaestroSispro
+from modules.vocabulario import VocabularioCoMET
+from modules.metricas import registro
+
+# Cubetas de _calcular_gap_temporal para la ruta vectorizada:
+# 0 | 1-7 | 8-30 | 31-90 | >90 días
+_BORDES_GAP = np.array([0, 7, 30, 90])
+_ETIQUETAS_GAP = np.array(
+    ["[MISMO_DIA_URGENCIA]", "[SEMANA_1_SEGUIMIENTO]", "[MES_1_CONTROL]", "[TRIMESTRE_1_CRONICO]", None],
+    dtype=object,
+)
 
 class TokenizadorCoMET:
-    def __init__(self):
-        self.maestro = MaestroSispro()
+    def __init__(self, vocabulario=None, maestro=None):
+        self.maestro = maestro if maestro is not None else MaestroSispro()
+        self.vocabulario = vocabulario if vocabulario is not None else VocabularioCoMET()
+        # Token ya formateado por (prefijo, tipo, código): evita rehacer el string
+        self._tokens_concepto = {}
+        # Id del vocabulario por clave cruda (p. ej. ("IPS", cod)): construir_ids no arma strings
+        self._ids_token = {}
+
+    def configuracion(self):
+        """
+        Argumentos picklables para reconstruir este tokenizador en otro proceso
+        (initargs de un pool spawn): ver desde_configuracion.
+        """
+        return {"ruta_ontologia": self.maestro.ruta_compilada, "version_ontologia": self.maestro.version}
+
+    @classmethod
+    def desde_configuracion(cls, configuracion):
+        """
+        Tokenizador equivalente al que produjo `configuracion`. Falla si la
+        ontología resultante no es la misma versión (p. ej. un maestro en
+        memoria que no vive en disco, o el .bin recompilado entretanto).
+        """
+        tokenizador = cls(maestro=MaestroSispro(configuracion["ruta_ontologia"]))
+        if tokenizador.maestro.version != configuracion["version_ontologia"]:
+            raise RuntimeError(
+                f"La ontología del worker ({tokenizador.maestro.version}) no es la del proceso "
+                f"principal ({configuracion['version_ontologia']}): no se puede tokenizar en paralelo"
+            )
+        return tokenizador
 
     def _calcular_gap_temporal(self, fecha_prev, fecha_curr):
         if not fecha_prev:
@@ -24,40 +62,131 @@ class TokenizadorCoMET:
         if dias <= 90: return "[TRIMESTRE_1_CRONICO]"
         return f"[GAP_LARGO_{dias}_DIAS_ABANDONO]"
 
-    def construir_secuencia(self, paciente_data):
-        perfil = paciente_data['perfil']
-        eventos = sorted(paciente_data['eventos'], key=lambda x: x['fecha'])
-        
+    def _token_concepto(self, prefijo, tipo, codigo):
+        clave = (prefijo, tipo, codigo)
+        token = self._tokens_concepto.get(clave)
+        if token is None:
+            desc_rica = self.maestro.get_concepto(tipo, codigo)
+            token = f"{prefijo}:{codigo}__{desc_rica.replace(' ', '_')}"
+            self._tokens_concepto[clave] = token
+        return token
+
+    def _tokens_perfil(self, perfil):
         semantica_regimen = self.maestro.get_concepto("REG", perfil['regimen'])
-        secuencia = [
+        return [
             f"PACIENTE_SEXO:{perfil['sexo']}",
             f"EDAD:{perfil['edad']}_ANOS_GRUPO_RIESGO",
             f"CONTEXTO_FINANCIERO:{semantica_regimen}"
         ]
+
+    def _agregar_tokens_evento(self, secuencia, evt, time_token):
+        secuencia.append(f"TIEMPO:{time_token}")
+        secuencia.append(f"LUGAR_ATENCION:IPS_{evt['cod_ips']}") 
+        secuencia.append(f"ACTOR_MEDICO:{evt['especialidad_medico']}")
+        
+        if 'diagnosticos' in evt:
+            for dx in evt['diagnosticos']:
+                secuencia.append(self._token_concepto("DX", "DX", dx['cod']))
+        
+        if 'procedimientos' in evt:
+            for proc in evt['procedimientos']:
+                secuencia.append(self._token_concepto("PROC", "PROC", proc['cod']))
+        
+        if 'medicamentos' in evt:
+            for med in evt['medicamentos']:
+                secuencia.append(self._token_concepto("FARMACO", "MED", med['atc']))
+
+    def construir_tokens(self, paciente_data):
+        """Lista de tokens de la trayectoria (base de construir_secuencia y construir_ids)."""
+        eventos = sorted(paciente_data['eventos'], key=lambda x: x['fecha'])
+        secuencia = self._tokens_perfil(paciente_data['perfil'])
         
         fecha_anterior = None
         
         for evt in eventos:
             time_token = self._calcular_gap_temporal(fecha_anterior, evt['fecha'])
-            secuencia.append(f"TIEMPO:{time_token}")
-            secuencia.append(f"LUGAR_ATENCION:IPS_{evt['cod_ips']}") 
-            secuencia.append(f"ACTOR_MEDICO:{evt['especialidad_medico']}")
-            
-            if 'diagnosticos' in evt:
-                for dx in evt['diagnosticos']:
-                    desc_rica = self.maestro.get_concepto("DX", dx['cod'])
-                    secuencia.append(f"DX:{dx['cod']}__{desc_rica.replace(' ', '_')}")
-            
-            if 'procedimientos' in evt:
-                for proc in evt['procedimientos']:
-                    desc_rica = self.maestro.get_concepto("PROC", proc['cod'])
-                    secuencia.append(f"PROC:{proc['cod']}__{desc_rica.replace(' ', '_')}")
-            
-            if 'medicamentos' in evt:
-                for med in evt['medicamentos']:
-                    desc_rica = self.maestro.get_concepto("MED", med['atc'])
-                    secuencia.append(f"FARMACO:{med['atc']}__{desc_rica.replace(' ', '_')}")
-            
+            self._agregar_tokens_evento(secuencia, evt, time_token)
             fecha_anterior = evt['fecha']
         
-        return " ".join(secuencia)
\ No newline at end of file
+        return secuencia
+
+    def construir_tokens_lote(self, pacientes):
+        """
+        Versión poblacional de construir_tokens. Aplana todos los eventos en
+        columnas, ordena con un único lexsort (paciente, fecha) y calcula los
+        gaps con aritmética datetime64 y una búsqueda de cubetas vectorizada.
+        El resultado es idéntico al de construir_tokens paciente a paciente.
+        """
+        pacientes = list(pacientes)
+        eventos, dueno, fechas = [], [], []
+        for i, pt in enumerate(pacientes):
+            for evt in pt['eventos']:
+                eventos.append(evt)
+                dueno.append(i)
+                fechas.append(evt['fecha'])
+
+        dueno = np.asarray(dueno, dtype=np.int64)
+        fechas = np.asarray(fechas, dtype="datetime64[D]")
+        orden = np.lexsort((fechas, dueno))  # estable, como sorted()
+        dueno, fechas = dueno[orden], fechas[orden]
+
+        inicio_historia = np.ones(len(dueno), dtype=bool)
+        inicio_historia[1:] = dueno[1:] != dueno[:-1]
+        dias = np.zeros(len(dueno), dtype=np.int64)
+        dias[1:] = np.diff(fechas).astype(np.int64)
+
+        cubeta = np.searchsorted(_BORDES_GAP, dias, side="left")
+        tokens_tiempo = _ETIQUETAS_GAP[cubeta]
+        for j in np.flatnonzero((cubeta == len(_BORDES_GAP)) & ~inicio_historia):
+            tokens_tiempo[j] = f"[GAP_LARGO_{dias[j]}_DIAS_ABANDONO]"
+        tokens_tiempo[inicio_historia] = "[INICIO_HISTORIA]"
+
+        secuencias = [self._tokens_perfil(pt['perfil']) for pt in pacientes]
+        for j, k in enumerate(orden):
+            self._agregar_tokens_evento(secuencias[dueno[j]], eventos[k], tokens_tiempo[j])
+        return secuencias
+
+    def construir_secuencias_lote(self, pacientes):
+        pacientes = list(pacientes)
+        with registro.span("tokenizacion_lote", pacientes=len(pacientes)):
+            return [" ".join(tokens) for tokens in self.construir_tokens_lote(pacientes)]
+
+    def construir_secuencia(self, paciente_data):
+        return " ".join(self.construir_tokens(paciente_data))
+
+    def _id(self, clave, fabricar):
+        """Id del token identificado por `clave`; `fabricar()` arma el string sólo la primera vez."""
+        id_token = self._ids_token.get(clave)
+        if id_token is None:
+            id_token = self._ids_token[clave] = self.vocabulario.id_de(fabricar())
+        return id_token
+
+    def construir_ids(self, paciente_data):
+        """
+        Trayectoria como arreglo uint32 de ids del vocabulario interno, sin
+        pasar por los strings de construir_tokens para códigos ya vistos.
+        self.vocabulario.decodificar(ids) == construir_secuencia(paciente_data).
+        """
+        perfil = paciente_data['perfil']
+        ids = [
+            self._id(("SEXO", perfil['sexo']), lambda: f"PACIENTE_SEXO:{perfil['sexo']}"),
+            self._id(("EDAD", perfil['edad']), lambda: f"EDAD:{perfil['edad']}_ANOS_GRUPO_RIESGO"),
+            self._id(("REG", perfil['regimen']),
+                     lambda: f"CONTEXTO_FINANCIERO:{self.maestro.get_concepto('REG', perfil['regimen'])}"),
+        ]
+
+        fecha_anterior = None
+        for evt in sorted(paciente_data['eventos'], key=lambda x: x['fecha']):
+            time_token = self._calcular_gap_temporal(fecha_anterior, evt['fecha'])
+            fecha_anterior = evt['fecha']
+            ids.append(self._id(("TIEMPO", time_token), lambda: f"TIEMPO:{time_token}"))
+            ids.append(self._id(("IPS", evt['cod_ips']), lambda: f"LUGAR_ATENCION:IPS_{evt['cod_ips']}"))
+            ids.append(self._id(("MEDICO", evt['especialidad_medico']),
+                                lambda: f"ACTOR_MEDICO:{evt['especialidad_medico']}"))
+            for campo, prefijo, tipo, llave in (("diagnosticos", "DX", "DX", "cod"),
+                                                ("procedimientos", "PROC", "PROC", "cod"),
+                                                ("medicamentos", "FARMACO", "MED", "atc")):
+                for item in evt.get(campo, ()):
+                    clave = (prefijo, tipo, item[llave])
+                    ids.append(self._id(clave, lambda: self._token_concepto(*clave)))
+        return np.asarray(ids, dtype=np.uint32)
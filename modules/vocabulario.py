@@ -0,0 +1,57 @@
+"""
+MÓDULO: VOCABULARIO
+Responsabilidad: Internar los tokens CoMET en ids enteros compactos.
+Una trayectoria se guarda como un arreglo uint32 en lugar de un string largo,
+y se recupera sin pérdida la secuencia textual original.
+"""
+import json
+import threading
+
+import numpy as np
+
+
+class VocabularioCoMET:
+    """Tabla bidireccional token <-> id. Los ids son estables mientras el vocabulario crezca."""
+    def __init__(self, tokens=None):
+        self._tokens = []
+        self._ids = {}
+        self._lock = threading.Lock()
+        for token in tokens or []:
+            self.id_de(token)
+
+    def __len__(self):
+        return len(self._tokens)
+
+    def __contains__(self, token):
+        return token in self._ids
+
+    def id_de(self, token):
+        """Id del token, internándolo si es nuevo."""
+        id_token = self._ids.get(token)
+        if id_token is None:
+            with self._lock:
+                id_token = self._ids.get(token)
+                if id_token is None:
+                    id_token = len(self._tokens)
+                    self._tokens.append(token)
+                    self._ids[token] = id_token
+        return id_token
+
+    def token_de(self, id_token):
+        return self._tokens[id_token]
+
+    def codificar(self, tokens):
+        return np.fromiter((self.id_de(t) for t in tokens), dtype=np.uint32)
+
+    def decodificar(self, ids):
+        """Inverso exacto de codificar: reconstruye el string de construir_secuencia."""
+        return " ".join(self._tokens[i] for i in ids)
+
+    def guardar(self, ruta):
+        with open(ruta, 'w', encoding='utf-8') as f:
+            json.dump(self._tokens, f, ensure_ascii=False)
+
+    @classmethod
+    def cargar(cls, ruta):
+        with open(ruta, 'r', encoding='utf-8') as f:
+            return cls(json.load(f))